@@ -0,0 +1,205 @@
+# ADMIN BALANCE JOBS AND THEIR SCHEDULER
+# A job resets, sets, adjusts or totals the balances of every user, of the sellers or of the buyers, optionally only
+# of a list of usernames. It walks the users in chunks of ADMIN_JOB_CHUNK_SIZE: each chunk is one
+# Storage.update_balances step (one round of user locks, one SQLite transaction, one journal record) and the job goes
+# back to the event loop between chunks, so /buy requests interleave with a job over a million users instead of
+# queueing behind it.
+#
+# Schedules start jobs every N seconds or daily at a UTC time, from one asyncio task. An occurrence is skipped while the
+# previous job of the same schedule still runs. Jobs and schedules live in the worker process that accepted them, so
+# schedules only run with WORKERS=1 (with several workers every one of them would run them).
+
+import asyncio
+import itertools
+import time
+from collections import OrderedDict
+
+import settings
+from metrics import CallbackGauge
+from storage import get_storage
+
+# action -> Storage.update_balances mode, users -> is_seller filter
+MODES = {"reset": "set", "set": "set", "add": "add", "report": "report"}
+ROLES = {"all": None, "sellers": True, "buyers": False}
+DAY = 86400
+
+class BalanceJob:
+    def __init__(self, id, action, users, usernames, amount_in_cents, schedule=None):
+        self.id = id
+        self.action = action
+        self.users = users
+        self.usernames = usernames
+        self.amount_in_cents = 0 if action == "reset" else amount_in_cents
+        self.schedule = schedule
+        self.status = "running"
+        self.chunks = 0
+        self.users_matched = 0
+        self.balance_before_in_cents = 0
+        self.balance_after_in_cents = 0
+        self.started_at = time.time()
+        self.finished_at = None
+        self.error = None
+        self.task = None
+
+    def pages(self, storage):
+        size = settings.ADMIN_JOB_CHUNK_SIZE
+        if self.usernames is None:
+            return storage.iter_username_pages(size, ROLES[self.users])
+        return (self.usernames[i:i + size] for i in range(0, len(self.usernames), size))
+
+    async def run(self, storage):
+        try:
+            for page in self.pages(storage):
+                matched, before, after = storage.update_balances(page, MODES[self.action], self.amount_in_cents, ROLES[self.users])
+                self.chunks += 1
+                self.users_matched += matched
+                self.balance_before_in_cents += before
+                self.balance_after_in_cents += after
+                await asyncio.sleep(settings.ADMIN_JOB_PAUSE_SECONDS)
+            await storage.sync()
+            self.status = "done"
+        except asyncio.CancelledError:
+            self.status = "cancelled"
+            raise
+        except Exception as e:
+            self.status = "failed"
+            self.error = str(e)
+        finally:
+            self.finished_at = time.time()
+
+    def to_dict(self):
+        return {"id": self.id, "action": self.action, "users": self.users, "usernames": self.usernames,
+                "amount_in_cents": self.amount_in_cents, "schedule": self.schedule, "status": self.status,
+                "chunks": self.chunks, "users_matched": self.users_matched,
+                "balance_before_in_cents": self.balance_before_in_cents,
+                "balance_after_in_cents": self.balance_after_in_cents,
+                "started_at": self.started_at, "finished_at": self.finished_at, "error": self.error}
+
+# Running jobs plus the last max_finished finished ones, in start order
+class JobRegistry:
+    def __init__(self, max_finished):
+        self.max_finished = max_finished
+        self._jobs = OrderedDict()  # id -> BalanceJob
+        self._ids = itertools.count(1)
+
+    def __len__(self):
+        return len(self._jobs)
+
+    # must be called on the event loop, the job runs as a task of it
+    def start(self, action, users="all", usernames=None, amount_in_cents=0, schedule=None):
+        job = BalanceJob(next(self._ids), action, users, usernames, amount_in_cents, schedule)
+        job.task = asyncio.create_task(job.run(get_storage()))
+        self._jobs[job.id] = job
+        finished = [job_id for job_id, other in self._jobs.items() if other.finished_at is not None]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def list(self):
+        return list(self._jobs.values())
+
+    @property
+    def running(self):
+        return sum(1 for job in self._jobs.values() if job.finished_at is None)
+
+    def clear(self):
+        for job in self._jobs.values():
+            if job.task is not None:
+                job.task.cancel()
+        self._jobs.clear()
+
+# "HH:MM" -> minutes after midnight UTC, ValueError when malformed
+def parse_daily_at(value):
+    hours, _, minutes = value.partition(":")
+    if not (hours.isdigit() and minutes.isdigit() and len(minutes) == 2 and int(hours) < 24 and int(minutes) < 60):
+        raise ValueError("daily_at must be HH:MM")
+    return int(hours) * 60 + int(minutes)
+
+class ScheduledJob:
+    def __init__(self, name, action, users, usernames, amount_in_cents, every_seconds=None, daily_at=None):
+        self.name = name
+        self.action = action
+        self.users = users
+        self.usernames = usernames
+        self.amount_in_cents = amount_in_cents
+        self.every_seconds = every_seconds
+        self.daily_at = daily_at  # minutes after midnight UTC
+        self.last_job = None
+        self.next_run = self.following(time.time())
+
+    def following(self, now):
+        if self.every_seconds is not None:
+            return now + self.every_seconds
+        at = now - now % DAY + self.daily_at * 60
+        return at if at > now else at + DAY
+
+    def to_dict(self):
+        return {"name": self.name, "action": self.action, "users": self.users, "usernames": self.usernames,
+                "amount_in_cents": self.amount_in_cents, "every_seconds": self.every_seconds,
+                "daily_at": None if self.daily_at is None else "{:02d}:{:02d}".format(*divmod(self.daily_at, 60)),
+                "next_run": self.next_run, "last_job": None if self.last_job is None else self.last_job.id}
+
+class Scheduler:
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self.schedules = {}  # name -> ScheduledJob
+        self._changed = asyncio.Event()
+        self._task = None
+
+    @property
+    def enabled(self):
+        return settings.WORKERS == 1
+
+    # adds or replaces a schedule, the loop picks it up right away
+    def put(self, schedule):
+        self.schedules[schedule.name] = schedule
+        self._changed.set()
+
+    def remove(self, name):
+        removed = self.schedules.pop(name, None) is not None
+        self._changed.set()
+        return removed
+
+    # called on the event loop: by the lifespan hook (main.py) and whenever a schedule is added
+    def start(self):
+        loop = asyncio.get_running_loop()
+        if self.enabled and (self._task is None or self._task.done() or self._task.get_loop() is not loop):
+            self._changed = asyncio.Event()
+            self._task = loop.create_task(self._loop())
+
+    async def stop(self):
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    def _run_due(self, now):
+        for schedule in list(self.schedules.values()):
+            if schedule.next_run > now:
+                continue
+            if schedule.last_job is None or schedule.last_job.finished_at is not None:
+                schedule.last_job = self.jobs.start(schedule.action, schedule.users, schedule.usernames,
+                                                    schedule.amount_in_cents, schedule=schedule.name)
+            schedule.next_run = schedule.following(now)
+
+    # also ends once it is no longer the scheduler's task: wait_for can swallow a cancellation that races the event
+    async def _loop(self):
+        while asyncio.current_task() is self._task:
+            self._changed.clear()
+            self._run_due(time.time())
+            next_run = min((schedule.next_run for schedule in self.schedules.values()), default=None)
+            try:
+                await asyncio.wait_for(self._changed.wait(), None if next_run is None else max(0.0, next_run - time.time()))
+            except asyncio.TimeoutError:
+                pass
+
+balance_jobs = JobRegistry(settings.ADMIN_MAX_JOBS)
+scheduler = Scheduler(balance_jobs)
+if settings.ADMIN_NIGHTLY_RESET_AT:
+    scheduler.put(ScheduledJob("nightly-reset", "reset", "all", None, 0, daily_at=parse_daily_at(settings.ADMIN_NIGHTLY_RESET_AT)))
+
+CallbackGauge("vending_admin_jobs_running", "Admin balance jobs running", lambda: balance_jobs.running)
+CallbackGauge("vending_admin_schedules", "Admin balance job schedules", lambda: len(scheduler.schedules))
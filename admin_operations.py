@@ -0,0 +1,73 @@
+# ADMIN OPERATIONS
+# Bulk balance jobs and their schedules (see admin.py), for the usernames listed in settings.ADMIN_USERS.
+# A job answers 202 right away with its id, GET /admin/jobs/{job_id} follows its progress and totals.
+
+from typing import List
+from fastapi import APIRouter, HTTPException, Depends, status
+import settings
+from models import User, BalanceOperation, Schedule, Message, BalanceJobInfo, ScheduleInfo, checked_cents, is_whole_cents
+from user_operations import get_current_user
+from admin import ScheduledJob, balance_jobs, scheduler, parse_daily_at
+from metrics import timed_route_class
+
+admin_router = APIRouter(route_class=timed_route_class("admin"))
+
+async def get_admin_user(current_user: User = Depends(get_current_user)):
+    if current_user.username not in settings.ADMIN_USERS:
+        raise HTTPException(status.HTTP_401_UNAUTHORIZED, detail="User is not an admin")
+    return current_user
+
+def amount_in_cents(operation):
+    try:
+        cents = checked_cents(operation.amount)
+    except ValueError as e:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if not is_whole_cents(operation.amount):
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Amount must be a whole number of cents")
+    if operation.action == "set" and cents < 0:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Balance cannot be negative")
+    return cents
+
+# Reset, set, adjust or total the balances of the selected users in one chunked job
+@admin_router.post("/admin/balances", response_model=BalanceJobInfo, status_code=status.HTTP_202_ACCEPTED)
+async def start_balance_job(operation: BalanceOperation, current_user: User = Depends(get_admin_user)):
+    job = balance_jobs.start(operation.action, operation.users, operation.usernames, amount_in_cents(operation))
+    return job.to_dict()
+
+@admin_router.get("/admin/jobs", response_model=List[BalanceJobInfo])
+async def read_jobs(current_user: User = Depends(get_admin_user)):
+    return [job.to_dict() for job in balance_jobs.list()]
+
+@admin_router.get("/admin/jobs/{job_id}", response_model=BalanceJobInfo)
+async def read_job(job_id: int, current_user: User = Depends(get_admin_user)):
+    job = balance_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Job not found")
+    return job.to_dict()
+
+# Create or replace a recurring job, every every_seconds or daily at daily_at (UTC)
+@admin_router.put("/admin/schedules/{name}", response_model=ScheduleInfo)
+async def put_schedule(name: str, schedule: Schedule, current_user: User = Depends(get_admin_user)):
+    if not scheduler.enabled:
+        raise HTTPException(status.HTTP_409_CONFLICT, detail="Schedules need WORKERS=1")
+    if (schedule.every_seconds is None) == (schedule.daily_at is None):
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Give either every_seconds or daily_at")
+    try:
+        daily_at = None if schedule.daily_at is None else parse_daily_at(schedule.daily_at)
+    except ValueError as e:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=str(e))
+    scheduled = ScheduledJob(name, schedule.action, schedule.users, schedule.usernames, amount_in_cents(schedule),
+                             every_seconds=schedule.every_seconds, daily_at=daily_at)
+    scheduler.put(scheduled)
+    scheduler.start()
+    return scheduled.to_dict()
+
+@admin_router.get("/admin/schedules", response_model=List[ScheduleInfo])
+async def read_schedules(current_user: User = Depends(get_admin_user)):
+    return [schedule.to_dict() for schedule in scheduler.schedules.values()]
+
+@admin_router.delete("/admin/schedules/{name}", response_model=Message)
+async def delete_schedule(name: str, current_user: User = Depends(get_admin_user)):
+    if not scheduler.remove(name):
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Schedule not found")
+    return {"message": "Schedule {} was deleted".format(name)}
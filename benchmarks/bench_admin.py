@@ -0,0 +1,95 @@
+# bulk balance reset over 1M users: POST /admin/balances resetting every buyer in chunks of ADMIN_JOB_CHUNK_SIZE
+# and in a single chunk (one lock round / transaction over every user), with POST /buy p50/p99 measured while each job
+# runs next to /buy on its own; and the per-user POST /reset/{username} calls (made by the admin) the job replaces
+#
+#   python -m benchmarks.bench_admin --users 1000000
+#   python -m benchmarks.bench_admin --engine sqlite --users 1000000
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import settings
+from benchmarks.common import asgi_client, percentile
+from models import Product, User
+from security import hash_password
+from storage import InMemoryStorage, SQLiteStorage, set_storage, memory_storage
+
+def seed(storage, users):
+    password = hash_password("pw", rounds=4)
+    # the kiosk buying during the jobs is flagged as a seller, so the reset of the buyers leaves its balance alone
+    storage.add_users([User(username="admin", password=password, is_seller=True),
+                       User(username="kiosk", password=password, is_seller=True)])
+    for start in range(0, users, 100000):
+        storage.add_users([User(username="user{:07d}".format(i), password="hash", balance_in_cents=100)
+                           for i in range(start, min(start + 100000, users))])
+    storage.add_products([Product(id=i, name="Item {}".format(i), price_in_cents=5, quantity=10 ** 9, seller="seller")
+                          for i in range(100)])
+    storage.add_coins({coin: 10 ** 6 for coin in (5, 10, 20, 50, 100)})
+
+# an in-process request never suspends once credentials are cached, so every request first goes back to the event
+# loop like a socket read would; the time a job chunk holds the loop counts towards the request waiting for it
+async def buy(client, storage, i, latencies):
+    storage.set_balance("kiosk", 1000)
+    started = time.perf_counter()
+    await asyncio.sleep(0)
+    response = await client.post("/buy", params={"product_id": i % 100, "quantity": 1}, auth=("kiosk", "pw"))
+    assert response.status_code == 200, response.text
+    latencies.append(time.perf_counter() - started)
+
+def report(label, latencies):
+    print("POST /buy {}: {} requests, p50 {:.2f} ms, p99 {:.2f} ms, max {:.2f} ms".format(
+        label, len(latencies), percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000, max(latencies) * 1000))
+
+# /buy in a loop for as long as a reset job runs
+async def bench_job(client, storage, users, chunk_size):
+    settings.ADMIN_JOB_CHUNK_SIZE = chunk_size
+    storage.update_balances(["user{:07d}".format(i) for i in range(users)], "set", 100)
+    latencies = []
+    response = await client.post("/admin/balances", json={"action": "reset", "users": "buyers"}, auth=("admin", "pw"))
+    assert response.status_code == 202, response.text
+    job_id = response.json()["id"]
+    while True:
+        await buy(client, storage, len(latencies), latencies)
+        job = (await client.get("/admin/jobs/{}".format(job_id), auth=("admin", "pw"))).json()
+        if job["status"] != "running":
+            break
+    assert job["status"] == "done" and job["users_matched"] == users and job["balance_after_in_cents"] == 0
+    print("reset of {} buyers in chunks of {}: {} chunks in {:.2f} s".format(
+        users, chunk_size, job["chunks"], job["finished_at"] - job["started_at"]))
+    report("during the job", latencies)
+
+async def bench(storage, users, requests, resets):
+    settings.ADMIN_USERS = frozenset(["admin"])
+    seed(storage, users)
+    set_storage(storage)
+    async with asgi_client() as client:
+        latencies = []
+        for i in range(requests):
+            await buy(client, storage, i, latencies)
+        report("alone", latencies)
+        await bench_job(client, storage, users, 1000)
+        await bench_job(client, storage, users, users)
+
+        started = time.perf_counter()
+        for i in range(resets):
+            assert (await client.post("/reset/user{:07d}".format(i), auth=("admin", "pw"))).status_code == 200
+        elapsed = time.perf_counter() - started
+        print("{} POST /reset/{{username}} calls: {:.2f} s, {:.0f} s for all {} users at that rate".format(
+            resets, elapsed, elapsed / resets * users, users))
+    set_storage(memory_storage)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--engine", choices=("memory", "sqlite"), default="memory")
+    parser.add_argument("--users", type=int, default=10 ** 6)
+    parser.add_argument("--requests", type=int, default=2000, help="/buy requests without a job running")
+    parser.add_argument("--resets", type=int, default=10000, help="per-user /reset calls timed")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        storage = InMemoryStorage() if args.engine == "memory" else SQLiteStorage(os.path.join(directory, "admin.db"))
+        asyncio.run(bench(storage, args.users, args.requests, args.resets))
+        storage.close()
@@ -0,0 +1,35 @@
+# /buy throughput with the credential cache on and off
+
+import argparse
+import asyncio
+
+from benchmarks.common import asgi_client, print_summary, run_sequential
+from product_operations import products_db
+from security import credential_cache
+from user_operations import users_db
+
+async def bench(count):
+    users_db.clear()
+    products_db.clear()
+    async with asgi_client() as client:
+        await client.post("/users/", params={"username": "seller", "password": "pw", "is_seller": True})
+        await client.post("/users/", params={"username": "buyer", "password": "pw"})
+        await client.post("/products/", params={"id": 1, "name": "Soda", "price": 1.0, "quantity": 10 ** 9},
+                          auth=("seller", "pw"))
+
+        async def buy(_):
+            users_db["buyer"].balance_in_cents = 100
+            response = await client.post("/buy", params={"product_id": 1, "quantity": 1}, auth=("buyer", "pw"))
+            assert response.status_code == 200, response.text
+
+        for enabled in (False, True):
+            credential_cache.clear()
+            credential_cache.enabled = enabled
+            result = await run_sequential("buy cache={}".format("on" if enabled else "off"), buy, count)
+            print_summary(result)
+        print("cache stats:", credential_cache.stats())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    asyncio.run(bench(parser.parse_args().requests))
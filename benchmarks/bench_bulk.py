@@ -0,0 +1,72 @@
+# POST /products/bulk with 1M generated CSV rows streamed through the ASGI stack, then GET /products/export.
+# The body is generated on the fly, so peak RSS growth is what the import pipeline (and the engine) keeps in memory.
+
+import argparse
+import asyncio
+import os
+import resource
+import sys
+import tempfile
+import time
+
+from benchmarks.common import asgi_client
+from storage import SQLiteStorage, set_storage, memory_storage
+from user_operations import users_db
+from product_operations import products_db
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+
+async def csv_body(rows, chunk_bytes=1 << 16):
+    lines = ["id,name,price,quantity\n"]
+    size = 0
+    for i in range(1, rows + 1):
+        line = "{},Product {},{}.{:02d},{}\n".format(i, i, 1 + i % 20, i % 100, 1 + i % 50)
+        lines.append(line)
+        size += len(line)
+        if size >= chunk_bytes:
+            yield "".join(lines).encode()
+            lines, size = [], 0
+    if lines:
+        yield "".join(lines).encode()
+
+async def bench(rows, engine, max_rss_mb):
+    users_db.clear()
+    products_db.clear()
+    directory = tempfile.mkdtemp()
+    if engine == "sqlite":
+        set_storage(SQLiteStorage(os.path.join(directory, "bench.db")))
+
+    async with asgi_client() as client:
+        await client.post("/users/", params={"username": "seller", "password": "pw", "is_seller": True})
+        rss_before = peak_rss_mb()
+        started = time.perf_counter()
+        response = await client.post("/products/bulk", params={"format": "csv"}, content=csv_body(rows),
+                                     auth=("seller", "pw"), timeout=None)
+        elapsed = time.perf_counter() - started
+        report = response.json()
+        growth = peak_rss_mb() - rss_before
+        print("import {:>9,} rows on {:<6}: {:>7.1f} s  {:>9,.0f} rows/s  peak RSS +{:.0f} MiB  failed {}".format(
+            report["imported"], engine, elapsed, report["imported"] / elapsed, growth, report["failed"]))
+
+        started = time.perf_counter()
+        size = 0
+        async with client.stream("GET", "/products/export", params={"format": "csv"}) as export:
+            async for chunk in export.aiter_bytes():
+                size += len(chunk)
+        elapsed = time.perf_counter() - started
+        print("export {:>9,} rows on {:<6}: {:>7.1f} s  {:>9,.0f} rows/s  {:.0f} MiB".format(
+            rows, engine, elapsed, rows / elapsed, size / 2 ** 20))
+
+    set_storage(memory_storage)
+    if max_rss_mb and growth > max_rss_mb:
+        print("peak RSS grew by {:.0f} MiB during the import, ceiling is {} MiB".format(growth, max_rss_mb))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=10 ** 6)
+    parser.add_argument("--engine", choices=("memory", "sqlite"), default="sqlite")
+    parser.add_argument("--max-rss-mb", type=float, default=256, help="ceiling for the import's peak RSS growth, 0 disables")
+    args = parser.parse_args()
+    asyncio.run(bench(args.rows, args.engine, args.max_rss_mb))
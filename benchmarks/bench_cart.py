@@ -0,0 +1,51 @@
+# checkout latency of a cart: one POST /buy/batch vs one POST /buy per item
+
+import argparse
+import asyncio
+import time
+
+from benchmarks.common import asgi_client, percentile
+from product_operations import products_db
+from user_operations import users_db
+
+async def bench(sizes, carts):
+    users_db.clear()
+    products_db.clear()
+    async with asgi_client() as client:
+        await client.post("/users/", params={"username": "seller", "password": "pw", "is_seller": True})
+        await client.post("/users/", params={"username": "buyer", "password": "pw"})
+        for product_id in range(max(sizes)):
+            await client.post("/products/", params={"id": product_id, "name": "Item", "price": 1.0, "quantity": 10 ** 9},
+                              auth=("seller", "pw"))
+
+        async def sequential(size):
+            for product_id in range(size):
+                users_db["buyer"].balance_in_cents = 100  # each /buy hands the rest of the balance back as change
+                response = await client.post("/buy", params={"product_id": product_id, "quantity": 1}, auth=("buyer", "pw"))
+                assert response.status_code == 200, response.text
+
+        async def batch(size):
+            users_db["buyer"].balance_in_cents = 100 * size
+            cart = [{"product_id": product_id, "quantity": 1} for product_id in range(size)]
+            response = await client.post("/buy/batch", json=cart, auth=("buyer", "pw"))
+            assert response.status_code == 200, response.text
+
+        print("{:>5} {:>16} {:>16} {:>9}".format("items", "sequential p50", "batch p50", "speedup"))
+        for size in sizes:
+            results = {}
+            for name, checkout in (("sequential", sequential), ("batch", batch)):
+                latencies = []
+                for _ in range(carts):
+                    t0 = time.perf_counter()
+                    await checkout(size)
+                    latencies.append(time.perf_counter() - t0)
+                results[name] = percentile(latencies, 50) * 1000
+            print("{:>5} {:>13.2f} ms {:>13.2f} ms {:>8.1f}x".format(
+                size, results["sequential"], results["batch"], results["sequential"] / results["batch"]))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 5, 10, 25, 50])
+    parser.add_argument("--carts", type=int, default=20, help="checkouts per cart size")
+    args = parser.parse_args()
+    asyncio.run(bench(args.sizes, args.carts))
@@ -0,0 +1,68 @@
+# catalog listing over a large in-memory catalog: filtered pages vs the full /products/all list vs the NDJSON export
+
+import argparse
+import asyncio
+import random
+import time
+
+from benchmarks.common import asgi_client, percentile
+from models import Product
+from product_operations import product_lines, products_db
+from storage import memory_storage
+
+def load(count, sellers):
+    products_db.clear()
+    rng = random.Random(42)
+    started = time.perf_counter()
+    memory_storage.add_products(
+        Product(id=i, name="Item {}".format(i), price_in_cents=rng.randint(1, 10000), quantity=rng.randint(1, 100),
+                seller="seller{}".format(i % sellers))
+        for i in range(count))
+    return time.perf_counter() - started
+
+async def page_latency(client, params, repeat):
+    latencies = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        response = await client.get("/products/", params=params)
+        assert response.status_code == 200, response.text
+        latencies.append(time.perf_counter() - t0)
+    return percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000
+
+async def bench(count, sellers, repeat, full_list):
+    print("loaded {:,} products in {:.2f} s".format(count, load(count, sellers)))
+    async with asgi_client() as client:
+        middle = count // 2
+        cases = [
+            ("first page", {"limit": 50}),
+            ("page deep in the catalog", {"limit": 50, "cursor": str(middle)}),
+            ("seller filter", {"limit": 50, "seller": "seller7"}),
+            ("price range", {"limit": 50, "min_price": 10.0, "max_price": 10.5}),
+            ("seller + price + in stock", {"limit": 50, "seller": "seller3", "min_price": 50.0, "in_stock": True}),
+        ]
+        for name, params in cases:
+            p50, p99 = await page_latency(client, params, repeat)
+            print("{:<28} p50 {:>8.3f} ms  p99 {:>8.3f} ms".format(name, p50, p99))
+
+        if full_list:
+            t0 = time.perf_counter()
+            response = await client.get("/products/all")
+            print("{:<28} {:>8.2f} s total, {:,} bytes, first byte only after the full body".format(
+                "/products/all json", time.perf_counter() - t0, len(response.content)))
+
+    t0 = time.perf_counter()
+    lines = product_lines(memory_storage)
+    first = next(lines)
+    first_chunk = time.perf_counter() - t0
+    size = len(first) + sum(len(chunk) for chunk in lines)
+    print("{:<28} {:>8.2f} s total, {:,} bytes, first chunk after {:.2f} ms".format(
+        "/products/all ndjson", time.perf_counter() - t0, size, first_chunk * 1000))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--products", type=int, default=1000000)
+    parser.add_argument("--sellers", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--skip-full-list", action="store_true", help="skip the non-streamed /products/all request")
+    args = parser.parse_args()
+    asyncio.run(bench(args.products, args.sellers, args.repeat, not args.skip_full_list))
@@ -0,0 +1,42 @@
+# change making microbenchmarks: the old coin-by-coin loop vs the table engine vs the bounded-coin solver
+
+import argparse
+import timeit
+
+from change import DENOMINATIONS, compute_change, make_change, solve_bounded_change
+
+# the original implementation, kept here as the baseline
+def loop_change(amount):
+    denominations = [100, 50, 20, 10, 5]
+    change_in_coins = {str(coin): 0 for coin in denominations}
+    for coin in denominations:
+        while amount >= coin:
+            amount -= coin
+            change_in_coins[str(coin)] += 1
+    return {"change_given": change_in_coins, "unpaid_cents": amount}
+
+def per_call_us(fn, amount, number):
+    return min(timeit.repeat(lambda: fn(amount), number=number, repeat=3)) / number * 10 ** 6
+
+def main(number):
+    plenty = {coin: 10 ** 7 for coin in DENOMINATIONS}
+    no_twenties = {100: 10 ** 4, 50: 1, 20: 0, 10: 0, 5: 10 ** 5}  # forces the solver
+    cases = [
+        ("loop (old)", loop_change),
+        ("compute_change", compute_change),
+        ("make_change, full machine", lambda amount: make_change(amount, plenty)),
+        ("solver, short machine", lambda amount: solve_bounded_change(amount, no_twenties)),
+    ]
+    amounts = [0, 35, 95, 1000, 10 ** 4, 10 ** 5, 10 ** 6]
+    print("{:<26}".format("amount (cents)") + "".join("{:>12,}".format(a) for a in amounts))
+    for name, fn in cases:
+        row = []
+        for amount in amounts:
+            # the slow variants grow with the amount, fewer iterations keep the run short
+            row.append(per_call_us(fn, amount, max(1, number // (1 + amount // 1000))))
+        print("{:<26}".format(name) + "".join("{:>9.2f} us".format(t) for t in row))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=2000, help="calls per measurement for small amounts")
+    main(parser.parse_args().number)
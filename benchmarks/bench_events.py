@@ -0,0 +1,109 @@
+# inventory events with 10k concurrent subscribers: POST /buy latency with no subscribers, 10k spread over 100 sellers
+# and 10k watching everything; how long until every consumer task has the event; and 10k subscribers that never read,
+# whose queues stay bounded under both policies
+#
+#   python -m benchmarks.bench_events --subscribers 10000
+
+import argparse
+import asyncio
+import time
+import tracemalloc
+
+from benchmarks.common import asgi_client, percentile, run_sequential
+from events import event_bus, publish_stock
+from models import Product, User
+from product_operations import products_db
+from response_cache import product_cache
+from security import hash_password
+from user_operations import users_db
+from vending_operations import coins_db
+
+SELLERS = 100
+
+def seed(products):
+    users_db.clear()
+    products_db.clear()
+    product_cache.clear()
+    users_db["buyer"] = User(username="buyer", password=hash_password("pw", rounds=4), balance_in_cents=1000)
+    products_db.load([Product(id=i, name="Item {}".format(i), price_in_cents=5, quantity=10 ** 9, seller="seller{}".format(i % SELLERS))
+                      for i in range(products)])
+    coins_db.update({coin: 10 ** 6 for coin in coins_db})
+
+async def consume(subscriber, received):
+    while True:
+        await subscriber.get()
+        received[0] += 1
+        if received[0] == received[1]:
+            received[2].set()
+
+async def bench_fan_out(client, label, subscribers, by_seller, count):
+    received = [0, 0, None]  # events read, events expected, set when all are read
+    subs = [event_bus.subscribe("seller{}".format(i % SELLERS) if by_seller else None, policy="drop")
+            for i in range(subscribers)]
+    tasks = [asyncio.create_task(consume(subscriber, received)) for subscriber in subs]
+    await asyncio.sleep(0)
+    per_event = subscribers // SELLERS if by_seller else subscribers
+    bought, delivered = [], []
+
+    async def buy(i):
+        received[0], received[1], received[2] = 0, per_event, asyncio.Event()
+        users_db["buyer"].balance_in_cents = 1000
+        started = time.perf_counter()
+        response = await client.post("/buy", params={"product_id": i % SELLERS, "quantity": 1}, auth=("buyer", "pw"))
+        assert response.status_code == 200
+        bought.append(time.perf_counter() - started)
+        if per_event:
+            await received[2].wait()
+        delivered.append(time.perf_counter() - started)
+    await run_sequential(label, buy, count)
+    print("POST /buy {}: p50 {:.2f} ms, p99 {:.2f} ms; read by all {} consumers: p50 {:.2f} ms, p99 {:.2f} ms".format(
+        label, percentile(bought, 50) * 1000, percentile(bought, 99) * 1000,
+        per_event, percentile(delivered, 50) * 1000, percentile(delivered, 99) * 1000))
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    for subscriber in subs:
+        event_bus.unsubscribe(subscriber)
+
+def bench_slow_consumers(subscribers, products, events):
+    def publish(policy):
+        subs = [event_bus.subscribe(policy=policy) for _ in range(subscribers)]
+        started = time.perf_counter()
+        for i in range(events):
+            publish_stock(i % products, "seller{}".format(i % SELLERS), 100 - i % 100, 101 - i % 100)
+        return subs, time.perf_counter() - started
+
+    for policy in ("coalesce", "drop"):
+        dropped = event_bus.dropped
+        subs, elapsed = publish(policy)
+        for subscriber in subs:
+            event_bus.unsubscribe(subscriber)
+        tracemalloc.start()  # second run for the memory held, tracing slows it down
+        subs, _ = publish(policy)
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print("{} subscribers that never read, {}: {} events in {:.2f} s ({:.1f} us per subscriber offer), "
+              "longest queue {}, {} dropped, {:.0f} MB held".format(
+                  subscribers, policy, events, elapsed, elapsed / (events * subscribers) * 1e6,
+                  max(len(s) for s in subs), (event_bus.dropped - dropped) // 2, memory / 2 ** 20))
+        for subscriber in subs:
+            event_bus.unsubscribe(subscriber)
+
+async def bench(subscribers, count, events):
+    event_bus.max_subscribers = max(event_bus.max_subscribers, subscribers)
+    seed(1000)
+    async with asgi_client() as client:
+        await bench_fan_out(client, "no subscribers", 0, True, count)
+        await bench_fan_out(client, "{} by seller".format(subscribers), subscribers, True, count)
+        await bench_fan_out(client, "{} unfiltered".format(subscribers), subscribers, False, count // 10)
+    bench_slow_consumers(subscribers, 1000, events)
+    users_db.clear()
+    products_db.clear()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subscribers", type=int, default=10000)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--events", type=int, default=200, help="events published to the subscribers that never read")
+    args = parser.parse_args()
+    asyncio.run(bench(args.subscribers, args.requests, args.events))
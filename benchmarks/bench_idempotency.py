@@ -0,0 +1,56 @@
+# cost of Idempotency-Key on POST /deposit: requests without a key, first requests with a fresh key and replays of a
+# used key, with the credential cache on and off (off, every executed request pays bcrypt and a replay does not),
+# and a storm of concurrent copies of one key
+#
+#   python -m benchmarks.bench_idempotency --rounds 10
+
+import argparse
+import asyncio
+import time
+
+from benchmarks.common import asgi_client, print_summary, run_sequential
+from idempotency import idempotency_store
+from models import User
+from security import credential_cache, hash_password
+from user_operations import users_db
+
+async def bench(rounds, count, bcrypt_count, storm):
+    users_db.clear()
+    idempotency_store.clear()
+    users_db["buyer"] = User(username="buyer", password=hash_password("pw", rounds=rounds))
+    async with asgi_client() as client:
+        async def deposit(key=None):
+            headers = {"Idempotency-Key": key} if key is not None else {}
+            response = await client.post("/deposit", json={"coins_5": 1}, headers=headers, auth=("buyer", "pw"))
+            assert response.status_code == 200
+            return response
+
+        for cache in (True, False):
+            credential_cache.enabled = cache
+            credential_cache.clear()
+            n = count if cache else bcrypt_count
+            label = "cache on" if cache else "cache off"
+            await deposit("replayed " + label)
+            print_summary(await run_sequential("no key, " + label, lambda i: deposit(), n))
+            print_summary(await run_sequential("fresh key, " + label, lambda i: deposit("{} {}".format(label, i)), n))
+            print_summary(await run_sequential("replay, " + label, lambda i: deposit("replayed " + label), n))
+        credential_cache.enabled = True
+
+        balance = users_db["buyer"].balance_in_cents
+        started = time.perf_counter()
+        responses = await asyncio.gather(*[deposit("storm") for _ in range(storm)])
+        elapsed = time.perf_counter() - started
+        replayed = sum(r.headers.get("idempotent-replayed") == "true" for r in responses)
+        print("storm of {} copies of one key: {:.1f} ms, {} replayed, balance credited {} time(s)".format(
+            storm, elapsed * 1000, replayed, (users_db["buyer"].balance_in_cents - balance) // 5))
+    users_db.clear()
+    idempotency_store.clear()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=10, help="bcrypt cost of the user's hash")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--bcrypt-requests", type=int, default=100, help="requests per case with the credential cache off")
+    parser.add_argument("--storm", type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.run(bench(args.rounds, args.requests, args.bcrypt_requests, args.storm))
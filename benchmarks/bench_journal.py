@@ -0,0 +1,84 @@
+# journal:// engine: acknowledged write throughput per fsync policy, and recovery time from a long journal vs a snapshot
+
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+
+from benchmarks.common import percentile
+from models import User, Product
+from storage import open_journaled_storage
+
+USERS = 1000
+PRODUCTS = 10000
+
+# concurrent "requests": each writes a balance and waits until the journal acknowledges it
+async def acknowledged_writes(storage, count, concurrency):
+    latencies = []
+
+    async def worker(w):
+        for i in range(w, count, concurrency):
+            t0 = time.perf_counter()
+            storage.set_balance("user{}".format(i % USERS), i)
+            await storage.sync()
+            latencies.append(time.perf_counter() - t0)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(w) for w in range(concurrency)))
+    return count / (time.perf_counter() - started), latencies
+
+def bench_append(count, concurrency):
+    for fsync in ("always", "interval", "never"):
+        directory = tempfile.mkdtemp()
+        storage = open_journaled_storage(directory, fsync=fsync, snapshot_every=10 ** 9)
+        storage.add_users([User(username="user{}".format(i), password="hash") for i in range(USERS)])
+        rate, latencies = asyncio.run(acknowledged_writes(storage, count, concurrency))
+        started = time.perf_counter()
+        storage.close()
+        print("fsync={:<8} {:>9,.0f} acknowledged writes/s  p50 {:7.3f} ms  p99 {:7.3f} ms  (close {:.2f} s)".format(
+            fsync, rate, percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000, time.perf_counter() - started))
+        shutil.rmtree(directory)
+
+# a journal of purchase records written directly in the engine's format, then timed recoveries
+def bench_recovery(entries):
+    directory = tempfile.mkdtemp()
+    storage = open_journaled_storage(directory, fsync="never", snapshot_every=10 ** 9)
+    storage.add_users([User(username="user{}".format(i), password="hash", balance_in_cents=10 ** 6) for i in range(USERS)])
+    storage.add_products([Product(id=i, name="Item {}".format(i), price_in_cents=100, quantity=10 ** 9, seller="seller")
+                          for i in range(PRODUCTS)])
+    storage.close()
+    seq = storage.journal._seq
+    started = time.perf_counter()
+    with open(os.path.join(directory, "journal-{:020d}.log".format(seq + 1)), "w") as f:
+        for i in range(1, entries + 1):
+            f.write('[{},["q",{},{}],["b","user{}",{}],["c",[{},0,0,0,0]]]\n'.format(
+                seq + i, i % PRODUCTS, 10 ** 9 - i // PRODUCTS, i % USERS, i % 100, i))
+    size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+    print("journal of {:,} records written in {:.1f} s ({:.0f} MiB)".format(entries, time.perf_counter() - started, size / 2 ** 20))
+
+    started = time.perf_counter()
+    storage = open_journaled_storage(directory, fsync="never", snapshot_every=10 ** 9)
+    elapsed = time.perf_counter() - started
+    print("recovery from the journal alone: {:.1f} s ({:,.0f} records/s)".format(elapsed, entries / elapsed))
+
+    started = time.perf_counter()
+    storage.journal.snapshot()
+    print("snapshot: {:.1f} s".format(time.perf_counter() - started))
+    storage.close()
+
+    started = time.perf_counter()
+    storage = open_journaled_storage(directory, fsync="never", snapshot_every=10 ** 9)
+    print("recovery from the snapshot: {:.2f} s".format(time.perf_counter() - started))
+    storage.close()
+    shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writes", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--entries", type=int, default=10 ** 7)
+    args = parser.parse_args()
+    bench_append(args.writes, args.concurrency)
+    bench_recovery(args.entries)
@@ -0,0 +1,75 @@
+# bytes per user and per product of the in-memory engine, pydantic models vs compact rows (MEMORY_COMPACT_ROWS),
+# and what building models on reads costs. Sizes are what tracemalloc still sees allocated once the table is built:
+# rows, keys, strings and the product indexes, without the allocator's own overhead.
+#
+#   python -m benchmarks.bench_memory --rows 1000000
+
+import argparse
+import gc
+import time
+import tracemalloc
+
+from models import User, Product
+from storage import InMemoryStorage
+
+LAYOUTS = (("models", False), ("compact", True))
+SELLERS = 1000
+
+# fresh strings per row like request data: bcrypt-length hashes, and seller names decoded again for every product
+def users(rows):
+    for i in range(rows):
+        yield User(username="user{}".format(i), password="$2b$12${:053d}".format(i), balance_in_cents=i % 5000)
+
+def products(rows):
+    for i in range(rows):
+        yield Product(id=i, name="Item {}".format(i), price_in_cents=5 + i % 2000, quantity=1 + i % 100,
+                      seller="seller{}".format(i % SELLERS))
+
+def fill_users(storage, rows):
+    storage.add_users(users(rows))
+
+def fill_products(storage, rows):
+    storage.add_products(products(rows))
+
+def measure(compact, fill, rows):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        storage = InMemoryStorage(compact=compact)
+        fill(storage, rows)
+        elapsed = time.perf_counter() - started
+        gc.collect()
+        retained = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    return storage, retained / rows, elapsed
+
+def read_cost(read, count):
+    started = time.perf_counter()
+    for i in range(count):
+        read(i)
+    return (time.perf_counter() - started) / count * 10 ** 6
+
+def main(rows, reads):
+    print("{:<8} {:<8} {:>12} {:>10} {:>14}".format("table", "layout", "bytes/row", "build s", "get us/call"))
+    for table, fill in (("users", fill_users), ("products", fill_products)):
+        results = {}
+        for layout, compact in LAYOUTS:
+            storage, per_row, elapsed = measure(compact, fill, rows)
+            if table == "users":
+                per_read = read_cost(lambda i: storage.get_user("user{}".format(i % rows)), reads)
+            else:
+                per_read = read_cost(lambda i: storage.get_product(i % rows), reads)
+            results[layout] = per_row
+            print("{:<8} {:<8} {:>12,.0f} {:>10.1f} {:>14.2f}".format(table, layout, per_row, elapsed, per_read))
+            del storage
+        print("{:<8} compact rows use {:.0%} of the memory of models".format(table, results["compact"] / results["models"]))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--reads", type=int, default=100000, help="get_user / get_product calls timed per layout")
+    args = parser.parse_args()
+    main(args.rows, args.reads)
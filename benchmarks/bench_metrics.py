@@ -0,0 +1,54 @@
+# request overhead of the metrics: the same product read with a plain and an instrumented route, plus /buy with all stage timers
+
+import argparse
+import asyncio
+import time
+
+import httpx
+from fastapi import APIRouter, FastAPI
+
+from benchmarks.common import asgi_client, print_summary, run_sequential
+from metrics import timed_route_class, LATENCY
+from models import Product
+from product_operations import products_db, read_product
+from user_operations import users_db
+
+def product_app(route_class):
+    router = APIRouter() if route_class is None else APIRouter(route_class=route_class)
+    router.add_api_route("/products/{product_id}", read_product, methods=["GET"], response_model=Product)
+    app = FastAPI()
+    app.include_router(router)
+    return app
+
+async def bench(count):
+    users_db.clear()
+    products_db.clear()
+    products_db[1] = Product(id=1, name="Soda", price_in_cents=100, quantity=10 ** 9, seller="seller")
+
+    for name, route_class in (("read plain route", None), ("read instrumented route", timed_route_class("bench"))):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=product_app(route_class)), base_url="http://bench") as client:
+            async def read(_):
+                assert (await client.get("/products/1")).status_code == 200
+            await run_sequential(name, read, count // 10)  # warm up
+            print_summary(await run_sequential(name, read, count))
+
+    # raw cost of what every instrumented request records
+    started = time.perf_counter()
+    for _ in range(count * 10):
+        LATENCY.observe(0.001, "bench", "/x", "GET")
+    print("histogram observe: {:.2f} us".format((time.perf_counter() - started) / (count * 10) * 10 ** 6))
+
+    async with asgi_client() as client:
+        await client.post("/users/", params={"username": "buyer", "password": "pw"})
+        async def buy(_):
+            users_db["buyer"].balance_in_cents = 100
+            assert (await client.post("/buy", params={"product_id": 1, "quantity": 1}, auth=("buyer", "pw"))).status_code == 200
+        print_summary(await run_sequential("buy with stage timers", buy, count))
+        started = time.perf_counter()
+        size = len((await client.get("/metrics")).content)
+        print("scrape: {} bytes in {:.2f} ms".format(size, (time.perf_counter() - started) * 1000))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    asyncio.run(bench(parser.parse_args().requests))
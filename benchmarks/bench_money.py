@@ -0,0 +1,54 @@
+# buy path arithmetic with float dollar prices (before) vs integer cents (after), plus the float drift it removes
+
+import argparse
+import timeit
+
+from change import compute_change, make_change, DENOMINATIONS
+from models import User, Product, price_to_cents
+from storage import InMemoryStorage
+
+# what buy_products did with float prices: dollars * 100 * quantity, compared with and subtracted from integer cents,
+# truncated back to an int so the change table could be indexed
+def float_buy(price, quantity, balance_in_cents):
+    total_cost = price * 100 * quantity
+    if balance_in_cents < total_cost:
+        raise ValueError("Insufficient balance")
+    return total_cost, compute_change(int(balance_in_cents - total_cost))
+
+def int_buy(price_in_cents, quantity, balance_in_cents):
+    total_cost = price_in_cents * quantity
+    if balance_in_cents < total_cost:
+        raise ValueError("Insufficient balance")
+    return total_cost, compute_change(balance_in_cents - total_cost)
+
+def drift():
+    prices = [cents / 100 for cents in range(1, 10000)]
+    inexact = [p for p in prices if p * 100 != round(p * 100)]
+    wrong_change = [p for p in prices if float_buy(p, 1, 10000)[1] != int_buy(round(p * 100), 1, 10000)[1]]
+    return len(prices), len(inexact), len(wrong_change)
+
+def purchase_rate(number):
+    storage = InMemoryStorage()
+    storage.add_product(Product(id=1, name="Gum", price_in_cents=7, quantity=10 ** 9, seller="seller"))
+    storage.add_user(User(username="buyer", password="hash", balance_in_cents=10 ** 12))
+    storage.add_coins({coin: 10 ** 9 for coin in DENOMINATIONS})
+
+    def buy():
+        storage.set_balance("buyer", 100)
+        storage.purchase("buyer", 1, 3, make_change)
+
+    return number / min(timeit.repeat(buy, number=number, repeat=3))
+
+def main(number):
+    for name, fn, price in (("float dollars (before)", float_buy, 0.07), ("integer cents (after)", int_buy, price_to_cents(0.07))):
+        per_call = min(timeit.repeat(lambda: fn(price, 3, 100), number=number, repeat=5)) / number
+        print("{:<24} {:>8.3f} us per buy, total_cost={!r}".format(name, per_call * 10 ** 6, fn(price, 3, 100)[0]))
+    print("{:<24} {:>8,.0f} purchases/s".format("storage purchase (after)", purchase_rate(number // 10)))
+    count, inexact, wrong = drift()
+    print("float prices 0.01..99.99: {:,} of {:,} are not whole cents after * 100, {:,} give wrong unpaid_cents".format(
+        inexact, count, wrong))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=200000)
+    main(parser.parse_args().number)
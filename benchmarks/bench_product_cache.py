@@ -0,0 +1,64 @@
+# product reads with the response cache off and on: GET /products/{id} over a catalog, revalidation with
+# If-None-Match (304), GET /products/all, and a 50:1 read/buy mix to show the hit ratio under invalidation
+
+import argparse
+import asyncio
+
+from benchmarks.common import asgi_client, print_summary, run_sequential
+from models import Product, User
+from product_operations import products_db
+from response_cache import product_cache
+from security import hash_password
+from user_operations import users_db
+from vending_operations import coins_db
+
+def seed(products):
+    users_db.clear()
+    products_db.clear()
+    product_cache.clear()
+    products_db.load([Product(id=i, name="Item {}".format(i), price_in_cents=5 + i % 200, quantity=10 ** 9, seller="seller")
+                      for i in range(products)])
+    users_db["buyer"] = User(username="buyer", password=hash_password("pw", rounds=4))
+    coins_db.update({coin: 10 ** 6 for coin in coins_db})
+
+async def bench(products, count, catalog_count):
+    async with asgi_client() as client:
+        for enabled in (False, True):
+            seed(products)
+            product_cache.enabled = enabled
+            label = "cache on" if enabled else "cache off"
+
+            async def read(i):
+                assert (await client.get("/products/{}".format(i % products))).status_code == 200
+            await run_sequential(label, read, products)  # warm up, fills the cache
+            print_summary(await run_sequential("GET /products/{id} " + label, read, count))
+
+            etag = (await client.get("/products/0")).headers["etag"]
+            async def revalidate(i):
+                assert (await client.get("/products/0", headers={"If-None-Match": etag})).status_code == 304
+            print_summary(await run_sequential("If-None-Match 304 " + label, revalidate, count))
+
+            async def catalog(i):
+                assert (await client.get("/products/all")).status_code == 200
+            print_summary(await run_sequential("GET /products/all " + label, catalog, catalog_count))
+
+            product_cache.clear()
+            async def mixed(i):
+                if i % 51 == 50:
+                    users_db["buyer"].balance_in_cents = 1000
+                    response = await client.post("/buy", params={"product_id": i % products, "quantity": 1}, auth=("buyer", "pw"))
+                else:
+                    response = await client.get("/products/{}".format(i % products))
+                assert response.status_code == 200
+            print_summary(await run_sequential("50:1 reads/buys " + label, mixed, count))
+            if enabled:
+                print("hit ratio of the mix: {:.1%}, {}".format(product_cache.hit_ratio, product_cache.stats()))
+    product_cache.enabled = True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--products", type=int, default=1000, help="catalog size, also the size of GET /products/all")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--catalog-requests", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(bench(args.products, args.requests, args.catalog_requests))
@@ -0,0 +1,52 @@
+# purchase throughput: striped per-product/per-user locks vs a single global lock vs SQLite conditional updates
+
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from models import User, Product
+from storage import InMemoryStorage, SQLiteStorage
+
+def no_change(amount, coins):
+    return {"change_given": {"100": 0, "50": 0, "20": 0, "10": 0, "5": 0}, "unpaid_cents": amount}
+
+def run(storage, threads, purchases, products):
+    storage.add_products([Product(id=i, name="Item", price_in_cents=5, quantity=10 ** 9, seller="seller") for i in range(products)])
+    storage.add_users([User(username="buyer{}".format(t), password="hash", balance_in_cents=10 ** 12) for t in range(threads)])
+
+    def buy_loop(t):
+        for i in range(purchases):
+            storage.purchase("buyer{}".format(t), (t + i) % products, 1, no_change)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(buy_loop, range(threads)))
+    elapsed = time.perf_counter() - started
+
+    sold = sum(10 ** 9 - p.quantity for p in storage.list_products())
+    assert sold == threads * purchases, "stock not conserved"
+    return threads * purchases / elapsed
+
+def main(threads, purchases):
+    with tempfile.TemporaryDirectory() as directory:
+        engines = {
+            "memory, striped locks": lambda: InMemoryStorage(lock_stripes=64),
+            "memory, global lock": lambda: InMemoryStorage(lock_stripes=1),
+            "sqlite, conditional update": lambda: SQLiteStorage(
+                os.path.join(directory, "bench-{}.db".format(time.perf_counter_ns())), pool_size=threads),
+        }
+        for products, label in ((1, "one hot product"), (1000, "1000 products")):
+            for name, make in engines.items():
+                storage = make()
+                ops = run(storage, threads, purchases, products)
+                storage.close()
+                print("{:<28} {:<16} {:>12,.0f} purchases/s".format(name, label, ops))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--purchases", type=int, default=2000, help="purchases per thread")
+    args = parser.parse_args()
+    main(args.threads, args.purchases)
@@ -0,0 +1,65 @@
+# cost of the rate limiter: a raw bucket check with the memory and the SQLite store over many keys, and POST /deposit
+# with the limiter off vs each store (limits high enough that nothing is refused)
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from benchmarks.common import asgi_client, print_summary, run_sequential
+from models import User
+from ratelimit import MemoryBuckets, SQLiteBuckets, rate_limiter
+from security import hash_password
+from user_operations import users_db
+
+def bench_checks(store, label, keys, count):
+    start = time.perf_counter()
+    for i in range(count):
+        store.acquire("buy:user:{}".format(i % keys), rate=20.0, burst=20)
+    elapsed = time.perf_counter() - start
+    print("{}: {:.2f} us per check over {} keys, {} buckets held, {} evicted".format(
+        label, elapsed / count * 1e6, keys, len(store), store.evictions))
+
+async def bench_deposit(stores, users, count):
+    async with asgi_client() as client:
+        users_db.clear()
+        password = hash_password("pw", rounds=4)
+        for i in range(users):
+            users_db["user{}".format(i)] = User(username="user{}".format(i), password=password)
+
+        async def deposit(i):
+            response = await client.post("/deposit", json={"coins_5": 1}, auth=("user{}".format(i % users), "pw"))
+            assert response.status_code == 200
+        await run_sequential("warm up", deposit, users)  # fills the credential cache
+
+        limits, store = rate_limiter.limits, rate_limiter.store
+        rate_limiter.limits = {"deposit": {"user": (10 ** 6, 10 ** 6), "ip": (10 ** 6, 10 ** 6)}}
+        try:
+            print_summary(await run_sequential("POST /deposit limiter off", deposit, count))
+            rate_limiter.enabled = True
+            for label, bucket_store in stores:
+                rate_limiter.store = bucket_store
+                print_summary(await run_sequential("POST /deposit " + label, deposit, count))
+        finally:
+            rate_limiter.limits, rate_limiter.store = limits, store
+    users_db.clear()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--keys", type=int, default=100000, help="distinct users checked")
+    parser.add_argument("--checks", type=int, default=500000)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "limits.db")
+        bench_checks(MemoryBuckets(max_buckets=args.keys), "memory", args.keys, args.checks)
+        bench_checks(MemoryBuckets(max_buckets=args.keys // 10), "memory, max_buckets = keys / 10", args.keys, args.checks)
+        sqlite = SQLiteBuckets(path, max_idle_seconds=60)
+        bench_checks(sqlite, "sqlite", args.keys, args.checks // 10)
+        sqlite.clear()
+        asyncio.run(bench_deposit([("memory", MemoryBuckets(max_buckets=10 ** 5)), ("sqlite", sqlite)],
+                                  args.users, args.requests))
+        sqlite.close()
@@ -0,0 +1,100 @@
+# sales stats over a growing ledger: GET /sellers/{username}/stats and GET /products/{product_id}/sales at each
+# checkpoint up to 10M sales, next to recomputing the same seller totals by scanning the ledger, and the cost of a
+# purchase (ledger append and aggregates included) on an empty vs a full ledger
+#
+#   python -m benchmarks.bench_sales --sales 10000000
+#   python -m benchmarks.bench_sales --engine sqlite --sales 1000000
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from benchmarks.common import asgi_client, print_summary, run_sequential, summarize
+from change import make_change
+from models import Product, User
+from security import hash_password
+from storage import InMemoryStorage, SQLiteStorage, set_storage, memory_storage
+
+DAY = 86400
+
+# sales in time order over days, spread round robin over the products, product i belongs to seller i % sellers
+def sales(start, stop, total, products, sellers, days, now):
+    step = days * DAY / total
+    for i in range(start, stop):
+        product_id = i % products
+        yield (now - days * DAY + i * step, "buyer{}".format(i % 1000), product_id, "seller{}".format(product_id % sellers),
+               1 + i % 3, (1 + i % 3) * (5 + product_id % 200))
+
+def scan_seller(storage, seller):
+    sales = units = revenue_in_cents = 0
+    for _, sale in storage.iter_sales():
+        if sale[3] == seller:
+            sales += 1
+            units += sale[4]
+            revenue_in_cents += sale[5]
+    return sales, units, revenue_in_cents
+
+def bench_purchases(storage, label, count):
+    latencies = []
+    started = time.perf_counter()
+    for i in range(count):
+        t0 = time.perf_counter()
+        storage.purchase("buyer", i % 100, 1, make_change)
+        latencies.append(time.perf_counter() - t0)
+    print_summary(summarize("purchase_cart " + label, latencies, time.perf_counter() - started))
+
+async def bench(storage, total, products, sellers, days, queries, scan_max):
+    now = time.time()
+    password = hash_password("pw", rounds=4)
+    storage.add_users([User(username="seller0", password=password, is_seller=True),
+                       User(username="buyer", password=password, balance_in_cents=10 ** 15)])
+    storage.add_products([Product(id=i, name="Item {}".format(i), price_in_cents=5 + i % 200, quantity=10 ** 9,
+                                  seller="seller{}".format(i % sellers)) for i in range(products)])
+    bench_purchases(storage, "empty ledger", 10000)
+    set_storage(storage)
+
+    checkpoints = sorted({n for n in (10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7) if n < total} | {total})
+    filled = 0
+    async with asgi_client() as client:
+        for checkpoint in checkpoints:
+            started = time.perf_counter()
+            for chunk in range(filled, checkpoint, 10000):
+                storage.add_sales(list(sales(chunk, min(chunk + 10000, checkpoint), total, products, sellers, days, now)))
+            print("{} sales: appended {} in {:.1f} s".format(checkpoint, checkpoint - filled, time.perf_counter() - started))
+            filled = checkpoint
+
+            # the last day of sales so far, 24 hourly buckets
+            until = int(now - days * DAY + checkpoint * days * DAY / total) + 1
+            params = {"since": until - DAY, "until": until}
+            async def seller_stats(i):
+                assert (await client.get("/sellers/seller0/stats", params=params, auth=("seller0", "pw"))).status_code == 200
+            async def product_sales(i):
+                assert (await client.get("/products/0/sales", params=params, auth=("seller0", "pw"))).status_code == 200
+            print_summary(await run_sequential("  seller stats", seller_stats, queries))
+            print_summary(await run_sequential("  product sales", product_sales, queries))
+
+            stats = (await client.get("/sellers/seller0/stats", params=params, auth=("seller0", "pw"))).json()
+            if checkpoint <= scan_max:
+                started = time.perf_counter()
+                assert scan_seller(storage, "seller0") == (stats["sales"], stats["units_sold"], stats["revenue_in_cents"])
+                print("  scanning the ledger for the same totals: {:.1f} ms".format((time.perf_counter() - started) * 1000))
+    bench_purchases(storage, "full ledger", 10000)
+    set_storage(memory_storage)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--engine", choices=("memory", "sqlite"), default="memory")
+    parser.add_argument("--sales", type=int, default=10 ** 7)
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--sellers", type=int, default=50)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--scan-max", type=int, default=10 ** 7, help="largest ledger the scan comparison runs on")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        storage = InMemoryStorage() if args.engine == "memory" else SQLiteStorage(os.path.join(directory, "sales.db"))
+        asyncio.run(bench(storage, args.sales, args.products, args.sellers, args.days, args.queries, args.scan_max))
+        storage.close()
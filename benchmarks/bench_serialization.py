@@ -0,0 +1,114 @@
+# response serialization cost per route, for a small payload and a 10k-item one (list routes only): jsonable_encoder
+# plus json.dumps (routes without a response model), FastAPI validating against the response model then dump_json
+# (FAST_JSON=false) and the response model's serializer alone (fastjson.FastJSONRoute, FAST_JSON=true).
+# Lists of Product models cost the same both ways: validating a model instance is only a type check
+#
+#   python -m benchmarks.bench_serialization --items 10000
+
+import argparse
+import asyncio
+import importlib
+import time
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute, serialize_response
+
+from change import compute_change
+from fastjson import response_adapter
+from main import ROUTERS
+from models import Product
+
+def users(n):
+    return [{"username": "user{}".format(i), "is_seller": i % 2 == 0, "balance_in_cents": i} for i in range(n)]
+
+def products(n):
+    return [Product(id=i, name="Item {}".format(i), price_in_cents=150 + i, quantity=10, seller="seller") for i in range(n)]
+
+def cart(n):
+    return {"message": "Cart purchased successfully",
+            "items": [{"product_id": i, "quantity_purchased": 1, "cost": 150} for i in range(n)],
+            "total_cost": 150 * n, "change": compute_change(35)}
+
+def import_report(n):
+    return {"message": "Imported 0 product(s), {} row(s) failed".format(n), "imported": 0, "failed": n,
+            "errors": [{"line": i + 2, "errors": ["price: Input should be greater than 0"]} for i in range(n)],
+            "errors_truncated": False}
+
+def stats(n):
+    return {"seller": "seller", "sales": n, "units_sold": n, "revenue_in_cents": 150 * n, "revenue": "1.50",
+            "bucket_seconds": 3600, "since": 0, "until": 3600 * n,
+            "buckets": [{"start": 3600 * i, "sales": 1, "units_sold": 1, "revenue_in_cents": 150} for i in range(n)]}
+
+def jobs(n):
+    return [{"id": i, "action": "reset", "users": "buyers", "usernames": None, "amount_in_cents": 0, "schedule": None,
+             "status": "done", "chunks": 1000, "users_matched": 10 ** 6, "balance_before_in_cents": 10 ** 8,
+             "balance_after_in_cents": 0, "started_at": 1.7e9, "finished_at": 1.7e9 + 3, "error": None} for i in range(n)]
+
+# (method, path) -> payload with n items, FIXED routes return one object and are only measured small
+PAYLOADS = {
+    ("GET", "/users/"): users,
+    ("GET", "/users/{username}"): lambda n: users(1)[0],
+    ("POST", "/deposit"): lambda n: {"message": "Deposit successful", "balance_in_cents": 185},
+    ("POST", "/buy"): lambda n: {"message": "ProductId 1 purchased successfully", "quanity_purchased": 1,
+                                 "total_cost": 150, "change": compute_change(35)},
+    ("POST", "/buy/batch"): cart,
+    ("GET", "/products/"): lambda n: {"items": products(n), "next_cursor": str(n - 1)},
+    ("GET", "/products/all"): products,
+    ("PUT", "/products/{product_id}"): lambda n: products(1)[0],
+    ("POST", "/products/bulk"): import_report,
+    ("GET", "/sellers/{username}/stats"): stats,
+    ("GET", "/admin/jobs"): jobs,
+    ("DELETE", "/products/{product_id}"): lambda n: {"message": "ProductId 1 was deleted"},
+}
+FIXED = {("GET", "/users/{username}"), ("POST", "/deposit"), ("POST", "/buy"), ("PUT", "/products/{product_id}"),
+         ("DELETE", "/products/{product_id}")}
+
+def routes():
+    found = {}
+    for module, router, _ in ROUTERS:
+        for route in getattr(importlib.import_module(module), router).routes:
+            if isinstance(route, APIRoute):
+                for method in route.methods:
+                    found[(method, route.path)] = route
+    return found
+
+async def per_call_us(serialize, content, number):
+    best = None
+    for _ in range(5):
+        started = time.perf_counter()
+        for _ in range(number):
+            await serialize(content)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best / number * 10 ** 6
+
+async def bench(items, number):
+    found = routes()
+    print("{:<36} {:>7} {:>18} {:>18} {:>18}".format("route", "items", "no model (old)", "validate+dump", "dump_json"))
+    for key, payload in PAYLOADS.items():
+        route = found[key]
+        adapter = response_adapter(route.response_model)
+
+        async def encoded(content):
+            return JSONResponse(jsonable_encoder(content)).body
+
+        async def validated(content):
+            return await serialize_response(field=route.response_field, response_content=content, dump_json=True)
+
+        async def fast(content):
+            return adapter.dump_json(content)
+
+        for n in ((1,) if key in FIXED else (1, items)):
+            content = payload(n)
+            assert await validated(content) == await fast(content)
+            calls = max(1, number // n)
+            timings = [await per_call_us(serialize, content, calls) for serialize in (encoded, validated, fast)]
+            print("{:<36} {:>7} {:>15.1f} us {:>15.1f} us {:>15.1f} us".format(" ".join(key), n, *timings))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=10000, help="items of the large payloads")
+    parser.add_argument("--number", type=int, default=20000, help="calls per measurement, divided by the payload size")
+    args = parser.parse_args()
+    asyncio.run(bench(args.items, args.number))
@@ -0,0 +1,57 @@
+# p99 latency of unauthenticated GET /products/{id} before and during a signup storm
+
+import argparse
+import asyncio
+import time
+
+from benchmarks.common import asgi_client, print_summary, summarize
+from product_operations import products_db
+from security import hashing_pool
+from user_operations import users_db
+
+async def read_loop(client, duration):
+    latencies = []
+    started = time.perf_counter()
+    while time.perf_counter() - started < duration:
+        t0 = time.perf_counter()
+        response = await client.get("/products/1")
+        assert response.status_code == 200, response.text
+        latencies.append(time.perf_counter() - t0)
+        await asyncio.sleep(0.001)  # keep a steady request rate instead of starving the storm
+    return latencies, time.perf_counter() - started
+
+async def signup_storm(client, signups, concurrency):
+    statuses = {}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def signup(i):
+        async with semaphore:
+            response = await client.post("/users/", params={"username": "storm{}".format(i), "password": "pw"})
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    await asyncio.gather(*(signup(i) for i in range(signups)))
+    return statuses
+
+async def bench(duration, signups, concurrency):
+    users_db.clear()
+    products_db.clear()
+    async with asgi_client() as client:
+        await client.post("/users/", params={"username": "seller", "password": "pw", "is_seller": True})
+        await client.post("/products/", params={"id": 1, "name": "Soda", "price": 1.0, "quantity": 10},
+                          auth=("seller", "pw"))
+
+        latencies, elapsed = await read_loop(client, duration)
+        print_summary(summarize("read, idle", latencies, elapsed))
+
+        storm = asyncio.ensure_future(signup_storm(client, signups, concurrency))
+        latencies, elapsed = await read_loop(client, duration)
+        print_summary(summarize("read, during signup storm", latencies, elapsed))
+        print("signup responses:", await storm, "rejected by pool:", hashing_pool.rejected)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--duration", type=float, default=3.0)
+    parser.add_argument("--signups", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=64)
+    args = parser.parse_args()
+    asyncio.run(bench(args.duration, args.signups, args.concurrency))
@@ -0,0 +1,76 @@
+# time to first successful request: `python main.py` is started on a seeded SQLite file and polled until it answers
+# GET /products/1 (no bcrypt) or POST /deposit (bcrypt on a cold pool) with 200, eager vs LAZY_STARTUP=true.
+# Every sample is a fresh process, medians over --runs
+#
+#   python -m benchmarks.bench_startup --runs 10
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.common import percentile
+from models import Product, User
+from security import hash_password
+from storage import SQLiteStorage
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REQUESTS = {
+    "GET /products/1": lambda client: client.get("/products/1"),
+    "POST /deposit": lambda client: client.post("/deposit", json={"coins_100": 1}, auth=("buyer", "pw")),
+}
+
+def seed(path, rounds):
+    storage = SQLiteStorage(path, pool_size=1)
+    try:
+        storage.add_users([User(username="buyer", password=hash_password("pw", rounds=rounds))])
+        storage.add_products([Product(id=1, name="Soda", price_in_cents=100, quantity=10, seller="seller")])
+    finally:
+        storage.close()
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+# seconds from spawning the server to the first 200 of request
+def first_success(request, url, lazy):
+    port = free_port()
+    env = dict(os.environ, STORAGE_URL=url, PORT=str(port), LOG_LEVEL="warning", RATE_LIMIT_ENABLED="false",
+               LAZY_STARTUP="true" if lazy else "false")
+    started = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "main.py"], cwd=ROOT, env=env)
+    try:
+        with httpx.Client(base_url="http://127.0.0.1:{}".format(port)) as client:
+            while time.perf_counter() - started < 30:
+                try:
+                    response = request(client)
+                except httpx.TransportError:
+                    time.sleep(0.002)
+                    continue
+                if response.status_code != 200:
+                    raise RuntimeError("{} {}: {}".format(response.status_code, response.request.url, response.text))
+                return time.perf_counter() - started
+        raise RuntimeError("server did not answer within 30 s")
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--rounds", type=int, default=10, help="bcrypt cost of the seeded password")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "startup.db")
+        seed(path, args.rounds)
+        for name, request in REQUESTS.items():
+            for lazy in (False, True):
+                samples = [first_success(request, "sqlite:///" + path, lazy) for _ in range(args.runs)]
+                print("{:<16} LAZY_STARTUP={:<5}: first 200 after p50 {:.0f} ms, min {:.0f} ms, max {:.0f} ms".format(
+                    name, str(lazy).lower(), percentile(samples, 50) * 1000, min(samples) * 1000, max(samples) * 1000))
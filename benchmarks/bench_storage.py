@@ -0,0 +1,60 @@
+# in-memory vs SQLite engine on create, read and buy at 1, 4 and 8 worker threads
+
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from models import User, Product
+from storage import InMemoryStorage, SQLiteStorage
+
+def create_op(storage, worker, i):
+    storage.add_product(Product(id=worker * 10 ** 7 + i, name="Item", price_in_cents=100, quantity=10, seller="seller"))
+
+def read_op(storage, worker, i):
+    storage.get_product(i % 1000)
+
+def no_change(amount, coins):
+    return {"change_given": {"100": 0, "50": 0, "20": 0, "10": 0, "5": 0}, "unpaid_cents": amount}
+
+def buy_op(storage, worker, i):
+    storage.purchase("buyer{}".format(worker), i % 1000, 1, no_change)
+
+def seed(storage, workers):
+    storage.add_products([Product(id=i, name="Item", price_in_cents=100, quantity=10 ** 9, seller="seller") for i in range(1000)])
+    storage.add_users([User(username="buyer{}".format(w), password="hash", balance_in_cents=10 ** 12) for w in range(workers)])
+
+def run(storage, op, workers, ops_per_worker):
+    def worker_loop(worker):
+        for i in range(ops_per_worker):
+            op(storage, worker, i)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(worker_loop, range(workers)))
+    return workers * ops_per_worker / (time.perf_counter() - started)
+
+def make_engine(name, directory, pool_size):
+    if name == "memory":
+        return InMemoryStorage()
+    return SQLiteStorage(os.path.join(directory, "bench-{}.db".format(time.perf_counter_ns())), pool_size=pool_size)
+
+def main(ops_per_worker, worker_counts):
+    with tempfile.TemporaryDirectory() as directory:
+        print("{:<8} {:<7} {:>8} {:>14}".format("engine", "op", "workers", "ops/s"))
+        for engine in ("memory", "sqlite"):
+            for workers in worker_counts:
+                for name, op in (("create", create_op), ("read", read_op), ("buy", buy_op)):
+                    storage = make_engine(engine, directory, pool_size=workers)
+                    seed(storage, workers)
+                    ops = run(storage, op, workers, ops_per_worker)
+                    storage.close()
+                    print("{:<8} {:<7} {:>8} {:>14,.0f}".format(engine, name, workers, ops))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ops", type=int, default=2000, help="operations per worker")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8])
+    args = parser.parse_args()
+    main(args.ops, args.workers)
@@ -0,0 +1,45 @@
+# SHARED HELPERS FOR THE BENCHMARK SCRIPTS
+# run every benchmark from the repository root, e.g. `python -m benchmarks.bench_auth_cache`
+
+import time
+
+import httpx
+
+from main import app
+from ratelimit import rate_limiter
+
+# load generators send everything from one address and a handful of users, so the rate limiter is turned off
+# for them (bench_ratelimit measures the limiter itself)
+def asgi_client(base_url="http://bench"):
+    rate_limiter.enabled = False
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url=base_url)
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def summarize(name, latencies, elapsed):
+    return {
+        "name": name,
+        "requests": len(latencies),
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+def print_summary(result):
+    print("{name:<32} {requests:>7} req {rps:>10} rps  p50 {p50_ms:>8} ms  p95 {p95_ms:>8} ms  p99 {p99_ms:>8} ms".format(**result))
+
+# time a coroutine factory sequentially, returns the summary dict
+async def run_sequential(name, make_request, count):
+    latencies = []
+    started = time.perf_counter()
+    for i in range(count):
+        t0 = time.perf_counter()
+        await make_request(i)
+        latencies.append(time.perf_counter() - t0)
+    return summarize(name, latencies, time.perf_counter() - started)
@@ -0,0 +1,277 @@
+# LOAD-TESTING HARNESS FOR THE WHOLE API
+# drives main.app in-process through an ASGI client, or a local uvicorn server, with a scripted mix of
+# signup, deposit, buy, catalog reads and reset, and compares the JSON results with a saved baseline.
+#
+#   python -m benchmarks.harness --mix mixed --requests 5000 --concurrency 32
+#   python -m benchmarks.harness --target uvicorn --workers 1 --save-baseline
+#   STORAGE_URL=sqlite:///bench.db python -m benchmarks.harness --target uvicorn --workers 4
+#   python -m benchmarks.harness --baseline benchmarks/results/mixed-asgi.baseline.json --threshold 0.1
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import httpx
+
+from benchmarks.common import asgi_client, summarize, print_summary
+import settings
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+# operation -> weight, every run draws the same sequence for the same seed
+MIXES = {
+    "mixed": {"catalog": 40, "product": 25, "buy": 20, "deposit": 10, "reset": 4, "signup": 1},
+    "read-heavy": {"catalog": 60, "product": 38, "buy": 2},
+    "buy-heavy": {"buy": 70, "deposit": 20, "product": 10},
+    "signup": {"signup": 100},
+}
+
+SELLER = ("bench_seller", "pw")
+BUYERS = 64
+PRODUCTS = 200
+
+def buyer(i):
+    return ("bench_buyer{}".format(i % BUYERS), "pw")
+
+def reset_user(i):
+    return ("bench_reset{}".format(i % BUYERS), "pw")
+
+# one timed request per operation, i is the position in the scripted sequence.
+# PREPARE runs untimed before it: a buy spends the whole balance (the rest comes back as change),
+# so every buyer tops up first, like a customer at the machine
+async def prepare_buy(client, i):
+    await client.post("/deposit", json={"coins_100": 1}, auth=buyer(i))
+
+async def prepare_reset(client, i):
+    await client.post("/deposit", json={"coins_5": 1}, auth=reset_user(i))
+
+async def op_catalog(client, i):
+    return await client.get("/products/", params={"limit": 50, "min_price": "0.05", "max_price": "1.00", "in_stock": True})
+
+async def op_product(client, i):
+    return await client.get("/products/{}".format(i % PRODUCTS))
+
+async def op_buy(client, i):
+    return await client.post("/buy", params={"product_id": i % PRODUCTS, "quantity": 1}, auth=buyer(i))
+
+async def op_deposit(client, i):
+    return await client.post("/deposit", json={"coins_100": 1}, auth=buyer(i))
+
+async def op_reset(client, i):
+    return await client.post("/reset/{}".format(reset_user(i)[0]), auth=reset_user(i))
+
+SIGNUP_IDS = itertools.count()
+
+async def op_signup(client, i):
+    username = "bench_signup{}_{}".format(os.getpid(), next(SIGNUP_IDS))
+    return await client.post("/users/", params={"username": username, "password": "pw"})
+
+OPERATIONS = {"catalog": op_catalog, "product": op_product, "buy": op_buy, "deposit": op_deposit,
+              "reset": op_reset, "signup": op_signup}
+PREPARE = {"buy": prepare_buy, "reset": prepare_reset}
+
+def script(mix, requests, seed):
+    weights = MIXES[mix]
+    return random.Random(seed).choices(list(weights), weights=list(weights.values()), k=requests)
+
+# users, products and balances every mix relies on, created through the API like real traffic
+async def seed_data(client):
+    users = [SELLER] + [buyer(i) for i in range(BUYERS)] + [reset_user(i) for i in range(BUYERS)]
+    for username, password in users:
+        await client.post("/users/", params={"username": username, "password": password, "is_seller": (username, password) == SELLER})
+    for product_id in range(PRODUCTS):
+        await client.post("/products/", auth=SELLER, params={
+            "id": product_id, "name": "Item {}".format(product_id), "price": "{:.2f}".format(0.05 * (1 + product_id % 20)),
+            "quantity": 10 ** 9})
+    # the machine's float for paying out change
+    response = await client.post("/deposit", auth=SELLER, json={"coins_5": 10 ** 5, "coins_10": 10 ** 5, "coins_20": 10 ** 5, "coins_50": 10 ** 5})
+    assert response.status_code == 200, response.text
+    # first authenticated request of every user, so the runs measure a warm credential cache
+    for i in range(BUYERS):
+        await prepare_buy(client, i)
+        await prepare_reset(client, i)
+
+async def run_script(client, operations, concurrency):
+    latencies = {name: [] for name in set(operations)}
+    errors = {name: 0 for name in set(operations)}
+    position = iter(range(len(operations)))
+
+    async def worker():
+        for i in position:
+            name = operations[i]
+            if name in PREPARE:
+                await PREPARE[name](client, i)
+            t0 = time.perf_counter()
+            response = await OPERATIONS[name](client, i)
+            latencies[name].append(time.perf_counter() - t0)
+            if response.status_code >= 400:
+                errors[name] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    results = {}
+    for name in sorted(latencies):
+        results[name] = summarize(name, latencies[name], elapsed)
+        results[name]["errors"] = errors[name]
+    total = summarize("total", [t for samples in latencies.values() for t in samples], elapsed)
+    total["errors"] = sum(errors.values())
+    return results, total
+
+# bytes allocated while serving one request (tracemalloc peak above the starting point), in-process only
+async def measure_allocations(client, operations, samples):
+    allocations = {}
+    tracemalloc.start()
+    try:
+        for name in sorted(set(operations)):
+            sizes = []
+            for i in range(samples):
+                if name in PREPARE:
+                    await PREPARE[name](client, i)
+                before, _ = tracemalloc.get_traced_memory()
+                tracemalloc.reset_peak()
+                await OPERATIONS[name](client, i)
+                sizes.append(tracemalloc.get_traced_memory()[1] - before)
+            allocations[name] = round(sorted(sizes)[len(sizes) // 2] / 1024, 1)
+    finally:
+        tracemalloc.stop()
+    return allocations
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+# local server started like a deployment (python main.py) in a child process, the rest of the environment
+# (STORAGE_URL, BCRYPT_ROUNDS...) is inherited; several workers need STORAGE_URL=sqlite:///...
+class UvicornServer:
+    def __init__(self, workers):
+        self.workers = workers
+        self.port = free_port()
+        self.process = None
+
+    async def __aenter__(self):
+        env = dict(os.environ, WORKERS=str(self.workers), PORT=str(self.port), LOG_LEVEL="warning", RATE_LIMIT_ENABLED="false")
+        self.process = subprocess.Popen([sys.executable, "main.py"], env=env)
+        url = "http://127.0.0.1:{}".format(self.port)
+        async with httpx.AsyncClient(base_url=url) as client:
+            for _ in range(200):
+                if self.process.poll() is not None:
+                    raise RuntimeError("uvicorn exited with code {}".format(self.process.returncode))
+                try:
+                    await client.get("/products/", params={"limit": 1})
+                    return url
+                except httpx.TransportError:
+                    await asyncio.sleep(0.05)
+        raise RuntimeError("uvicorn did not start on port {}".format(self.port))
+
+    async def __aexit__(self, *exc_info):
+        self.process.terminate()
+        self.process.wait(timeout=10)
+
+def reset_in_process_state():
+    from storage import get_storage
+    from security import credential_cache
+    get_storage().clear()
+    credential_cache.clear()
+
+async def bench(args):
+    operations = script(args.mix, args.requests, args.seed)
+    meta = {"target": args.target, "mix": args.mix, "requests": args.requests, "concurrency": args.concurrency,
+            "seed": args.seed, "workers": args.workers if args.target == "uvicorn" else None,
+            "storage_url": settings.STORAGE_URL, "bcrypt_rounds": settings.BCRYPT_ROUNDS,
+            "python": platform.python_version(), "cpus": os.cpu_count()}
+
+    if args.target == "asgi":
+        reset_in_process_state()
+        async with asgi_client() as client:
+            await seed_data(client)
+            await run_script(client, operations[:args.requests // 10], args.concurrency)  # warm up
+            results, total = await run_script(client, operations, args.concurrency)
+            allocations = await measure_allocations(client, operations, args.alloc_samples)
+    else:
+        async with UvicornServer(args.workers) as url:
+            limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+            async with httpx.AsyncClient(base_url=url, limits=limits) as client:
+                await seed_data(client)
+                await run_script(client, operations[:args.requests // 10], args.concurrency)
+                results, total = await run_script(client, operations, args.concurrency)
+        allocations = {}  # the server lives in another process
+
+    for name, result in results.items():
+        result["alloc_kib"] = allocations.get(name)
+    return {"meta": meta, "results": results, "total": total}
+
+# a result regresses when its rps drops, or its p95/p99 grows, by more than threshold (a fraction)
+def compare(current, baseline, threshold):
+    regressions = []
+    rows = [("total", current["total"], baseline.get("total"))]
+    rows += [(name, result, baseline["results"].get(name)) for name, result in current["results"].items()]
+    for name, result, base in rows:
+        if base is None:
+            continue
+        checks = (("rps", base["rps"] - result["rps"]), ("p95_ms", result["p95_ms"] - base["p95_ms"]),
+                  ("p99_ms", result["p99_ms"] - base["p99_ms"]))
+        for field, worse_by in checks:
+            if base[field] and worse_by / base[field] > threshold:
+                regressions.append("{} {}: {} -> {} ({:+.1%})".format(name, field, base[field], result[field],
+                                                                      (result[field] - base[field]) / base[field]))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--target", choices=("asgi", "uvicorn"), default="asgi")
+    parser.add_argument("--mix", choices=sorted(MIXES), default="mixed")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--alloc-samples", type=int, default=50)
+    parser.add_argument("--output", help="results file, default benchmarks/results/<mix>-<target>.json")
+    parser.add_argument("--baseline", help="baseline file, default benchmarks/results/<mix>-<target>.baseline.json")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed slowdown as a fraction")
+    args = parser.parse_args()
+
+    stem = os.path.join(RESULTS_DIR, "{}-{}".format(args.mix, args.target))
+    output = args.output or stem + ".json"
+    baseline_path = args.baseline or stem + ".baseline.json"
+
+    report = asyncio.run(bench(args))
+    for result in report["results"].values():
+        print_summary(result)
+        allocated = "" if result["alloc_kib"] is None else "  {} KiB allocated per request".format(result["alloc_kib"])
+        print("{:<32} {:>7} errors{}".format("", result["errors"], allocated))
+    print_summary(report["total"])
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print("results written to", output)
+
+    if args.save_baseline:
+        with open(baseline_path, "w") as f:
+            json.dump(report, f, indent=2)
+        print("baseline written to", baseline_path)
+    elif os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        if regressions:
+            print("regressions against {} (threshold {:.0%}):".format(baseline_path, args.threshold))
+            for line in regressions:
+                print("  " + line)
+            sys.exit(1)
+        print("no regressions against {} (threshold {:.0%})".format(baseline_path, args.threshold))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+# BULK PRODUCT IMPORT AND EXPORT
+# request bodies are parsed line by line as they arrive and written in chunks, so a file is never held in memory
+
+import codecs
+import csv
+import io
+import json
+from decimal import Decimal, InvalidOperation
+from typing import List
+
+from pydantic import TypeAdapter, ValidationError
+
+import settings
+from models import Product, checked_cents, is_whole_cents, format_cents
+
+FORMATS = ("csv", "ndjson")
+CSV_COLUMNS = ("id", "name", "price", "quantity")  # export adds seller, the import takes the seller from the login
+EXPORT_COLUMNS = CSV_COLUMNS + ("seller",)
+PRODUCT_LIST = TypeAdapter(List[Product])
+
+# (line number, text) for every non-empty line of a byte stream, decoded incrementally
+async def iter_lines(chunks):
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    pending = ""
+    line_number = 0
+    async for chunk in chunks:
+        lines = (pending + decoder.decode(chunk)).split("\n")
+        pending = lines.pop()
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                yield line_number, line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending.strip():
+        yield line_number + 1, pending.rstrip("\r")
+
+async def iter_batches(lines, size):
+    batch = []
+    async for line in lines:
+        batch.append(line)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+# parsers turn a batch of (line number, text) into (line number, dict of fields) and {line number: [errors]}
+def parse_ndjson(batch, header=None):
+    rows, errors = [], {}
+    for line_number, text in batch:
+        try:
+            data = json.loads(text)
+        except ValueError:
+            errors[line_number] = ["Invalid JSON"]
+            continue
+        if not isinstance(data, dict):
+            errors[line_number] = ["Row must be a JSON object"]
+            continue
+        rows.append((line_number, data))
+    return rows, errors
+
+def parse_csv_header(text):
+    header = [column.strip().lower() for column in next(csv.reader([text]))]
+    missing = [column for column in CSV_COLUMNS if column not in header]
+    if missing:
+        raise ValueError("CSV header is missing column(s): {}".format(", ".join(missing)))
+    return header
+
+def parse_csv(batch, header):
+    rows, errors = [], {}
+    for (line_number, _), values in zip(batch, csv.reader(text for _, text in batch)):
+        if len(values) != len(header):
+            errors[line_number] = ["Expected {} columns, got {}".format(len(header), len(values))]
+            continue
+        rows.append((line_number, dict(zip(header, values))))
+    return rows, errors
+
+def parse_price(price):
+    if price is None or price == "":
+        raise ValueError("price: Field required")
+    try:
+        value = Decimal(str(price).strip())
+    except InvalidOperation:
+        raise ValueError("price: Input should be a valid decimal")
+    if not value.is_finite() or value <= 0:
+        raise ValueError("Price must be greater than 0")
+    cents = checked_cents(value, "Price")
+    if not is_whole_cents(value):
+        raise ValueError("Price must be a whole number of cents")
+    return cents
+
+# validates a batch with the Product model in one call, returns ([(line number, Product)], {line number: [errors]}).
+# when some rows fail, the remaining ones are validated again so the good rows of the batch still get written
+def validate_rows(rows, seller):
+    candidates, errors = [], {}
+    for line_number, data in rows:
+        try:
+            price_in_cents = parse_price(data.get("price"))
+        except ValueError as e:
+            errors[line_number] = [str(e)]
+            continue
+        candidates.append((line_number, {"id": data.get("id"), "name": data.get("name"), "price_in_cents": price_in_cents,
+                                         "quantity": data.get("quantity"), "seller": seller}))
+    try:
+        products = PRODUCT_LIST.validate_python([data for _, data in candidates])
+    except ValidationError as e:
+        failed = {}
+        for error in e.errors():
+            index, field = error["loc"][0], ".".join(str(part) for part in error["loc"][1:])
+            failed.setdefault(index, []).append("{}: {}".format(field, error["msg"]) if field else error["msg"])
+        for index, messages in failed.items():
+            errors[candidates[index][0]] = messages
+        candidates = [candidate for index, candidate in enumerate(candidates) if index not in failed]
+        products = PRODUCT_LIST.validate_python([data for _, data in candidates])
+    return [(line_number, product) for (line_number, _), product in zip(candidates, products)], errors
+
+# Error report of an import: every failed row is counted, the first max_errors are listed
+class ImportReport:
+    def __init__(self, max_errors):
+        self.max_errors = max_errors
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+
+    def add_errors(self, errors):
+        self.failed += len(errors)
+        for line_number in sorted(errors):
+            if len(self.errors) >= self.max_errors:
+                return
+            self.errors.append({"line": line_number, "errors": errors[line_number]})
+
+    def as_dict(self):
+        return {"imported": self.imported, "failed": self.failed, "errors": self.errors,
+                "errors_truncated": self.failed > len(self.errors)}
+
+# streams chunks (an async iterator of bytes) into storage.upsert_products, chunk_rows rows at a time
+async def import_products(storage, chunks, format, seller, chunk_rows=None, max_errors=None):
+    report = ImportReport(settings.BULK_MAX_REPORTED_ERRORS if max_errors is None else max_errors)
+    parse = parse_csv if format == "csv" else parse_ndjson
+    header = None
+    async for batch in iter_batches(iter_lines(chunks), chunk_rows or settings.BULK_CHUNK_ROWS):
+        if format == "csv" and header is None:
+            header = parse_csv_header(batch.pop(0)[1])
+        rows, errors = parse(batch, header)
+        products, invalid = validate_rows(rows, seller)
+        errors.update(invalid)
+        if products:
+            rejected = storage.upsert_products([product for _, product in products], seller)
+            for line_number, product in products:
+                if product.id in rejected:
+                    errors[line_number] = ["User is not seller of productId: {}".format(product.id)]
+            report.imported += len(products) - sum(1 for _, product in products if product.id in rejected)
+        report.add_errors(errors)
+    return report
+
+# CSV export with the import's columns, so an export can be edited and imported again (NDJSON: product_operations.product_lines)
+def export_csv(storage, page_size, **filters):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(EXPORT_COLUMNS)
+    for page in storage.iter_product_pages(page_size=page_size, **filters):
+        writer.writerows((p.id, p.name, format_cents(p.price_in_cents), p.quantity, p.seller) for p in page)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
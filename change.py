@@ -0,0 +1,71 @@
+# CHANGE MAKING FOR THE VENDING MACHINE
+
+from array import array
+
+DENOMINATIONS = (100, 50, 20, 10, 5)
+DENOMINATION_KEYS = tuple(str(coin) for coin in DENOMINATIONS)  # response keys, built once
+COIN_UNIT = 5  # every denomination is a multiple of it, smaller remainders can never be paid
+
+# greedy coins for every remainder below the largest coin: (counts without the largest coin, unpaid cents)
+def _build_remainder_table():
+    table = []
+    for amount in range(DENOMINATIONS[0]):
+        counts = []
+        for coin in DENOMINATIONS[1:]:
+            count, amount = divmod(amount, coin)
+            counts.append(count)
+        table.append((tuple(counts), amount))
+    return tuple(table)
+
+_REMAINDER_TABLE = _build_remainder_table()
+
+def _as_change(counts, unpaid_cents):
+    return {"change_given": dict(zip(DENOMINATION_KEYS, counts)), "unpaid_cents": unpaid_cents}
+
+# change for an amount with an unlimited supply of coins: one divmod plus a table lookup
+def compute_change(amount):
+    largest, rest = divmod(amount, DENOMINATIONS[0])
+    counts, unpaid_cents = _REMAINDER_TABLE[rest]
+    return _as_change((largest,) + counts, unpaid_cents)
+
+# change limited by the coins in the machine (available maps denomination -> count).
+# pays as much of the amount as the coins allow, what cannot be paid stays as unpaid_cents
+def make_change(amount, available):
+    counts = []
+    rest = amount
+    for coin in DENOMINATIONS:
+        count = min(rest // coin, available.get(coin, 0))
+        counts.append(count)
+        rest -= count * coin
+    if rest < COIN_UNIT:
+        return _as_change(counts, rest)
+    # greedy got stuck on a missing coin (e.g. 60 with one 50 and three 20s), search all combinations
+    return solve_bounded_change(amount, available)
+
+# Optimal bounded-coin solver: the largest payable amount <= amount, preferring larger coins among the ways to pay it.
+# Reachability DP over sums in COIN_UNIT steps, one layer per denomination (largest first) recording how many
+# of that coin reach each sum, so the cost is O(len(DENOMINATIONS) * payable / COIN_UNIT).
+def solve_bounded_change(amount, available):
+    total = sum(coin * available.get(coin, 0) for coin in DENOMINATIONS)
+    limit = min(amount, total) // COIN_UNIT
+    reachable = bytearray(limit + 1)
+    reachable[0] = 1
+    layers = []
+    for coin in DENOMINATIONS:
+        step = coin // COIN_UNIT
+        supply = available.get(coin, 0)
+        used = array("l", [0]) * (limit + 1)
+        if supply:
+            for target in range(step, limit + 1):
+                if not reachable[target] and reachable[target - step] and used[target - step] < supply:
+                    reachable[target] = 1
+                    used[target] = used[target - step] + 1
+        layers.append(used)
+
+    best = reachable.rindex(1)
+    counts = [0] * len(DENOMINATIONS)
+    target = best
+    for i in range(len(DENOMINATIONS) - 1, -1, -1):
+        counts[i] = layers[i][target]
+        target -= counts[i] * (DENOMINATIONS[i] // COIN_UNIT)
+    return _as_change(counts, amount - best * COIN_UNIT)
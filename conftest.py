@@ -0,0 +1,34 @@
+import bcrypt
+import httpx
+import pytest
+from main import app
+from storage import memory_storage
+from response_cache import product_cache
+from security import credential_cache
+from idempotency import idempotency_store
+from ratelimit import rate_limiter
+from admin import balance_jobs, scheduler
+
+HASHED = bcrypt.hashpw(b"pw", bcrypt.gensalt(4)).decode()  # password "pw" at the lowest bcrypt cost
+
+# Empty every per-process store: the default engine (users, products, coins, sales) and the caches kept next to it
+def reset_stores():
+    memory_storage.clear()
+    product_cache.clear()
+    credential_cache.clear()
+    idempotency_store.clear()
+    rate_limiter.store.clear()
+    scheduler.schedules.clear()
+    balance_jobs.clear()
+
+@pytest.fixture
+# Fresh stores before and after a test
+def stores():
+    reset_stores()
+    yield
+    reset_stores()
+
+@pytest.fixture
+# Client for main.app on fresh stores, test modules override it to add their users and products
+def client(stores):
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
@@ -0,0 +1,209 @@
+# INVENTORY EVENTS AND THE SERVER-SENT EVENTS STREAM
+# Handlers that change stock publish to an in-process bus: purchases, product creation, updates and deletes.
+# GET /events/inventory streams them as Server-Sent Events, optionally for one seller only, so dashboards stop
+# polling GET /products/all.
+#
+# Each subscriber has its own low-stock threshold, and the bus tells it what a change means for that threshold:
+# low_stock (fell to or below it), out_of_stock, restocked (back above it), deleted, or a plain stock change.
+# Publishing never waits for a subscriber. Every subscriber has a bounded queue:
+#   coalesce - one pending event per product, the latest quantity with the net change since the last read
+#   drop     - the oldest pending event is dropped
+# and the stream tells the client how many events it missed ("dropped"), so it can re-read the catalog.
+# The bus is per process: with several workers a subscriber only sees the changes handled by its own worker.
+
+import asyncio
+import json
+from collections import OrderedDict, deque
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, status
+from fastapi.responses import StreamingResponse
+
+import settings
+from metrics import CallbackCounter, CallbackGauge
+
+events_router = APIRouter()
+POLICIES = ("coalesce", "drop")
+
+# one stock transition, quantity is None for a deleted product and previous is None for a new one
+class InventoryEvent:
+    __slots__ = ("product_id", "seller", "quantity", "previous")
+
+    def __init__(self, product_id, seller, quantity, previous):
+        self.product_id = product_id
+        self.seller = seller
+        self.quantity = quantity
+        self.previous = previous
+
+# what a transition means for a threshold
+def classify(event, threshold):
+    quantity, previous = event.quantity, event.previous
+    if quantity is None:
+        return "deleted"
+    if quantity <= 0:
+        return "out_of_stock" if previous is None or previous > 0 else "stock"
+    if quantity <= threshold and (previous is None or previous > threshold):
+        return "low_stock"
+    if quantity > threshold and previous is not None and previous <= threshold:
+        return "restocked"
+    return "stock"
+
+class Subscriber:
+    def __init__(self, seller, threshold, policy, max_queue, alerts_only=False):
+        self.seller = seller
+        self.threshold = threshold
+        self.policy = policy
+        self.max_queue = max_queue
+        self.alerts_only = alerts_only
+        self.dropped = 0  # since the last read
+        self._pending = OrderedDict() if policy == "coalesce" else deque()
+        self._wakeup = asyncio.Event()
+
+    def __len__(self):
+        return len(self._pending)
+
+    # called by the bus, never blocks; returns the number of events dropped to make room
+    def offer(self, event):
+        if self.policy == "coalesce":
+            pending = self._pending.pop(event.product_id, None)
+            if pending is not None:  # merge into the net change since the last read
+                event = InventoryEvent(event.product_id, event.seller, event.quantity, pending.previous)
+            if self.alerts_only and classify(event, self.threshold) == "stock":
+                return 0
+            self._pending[event.product_id] = event
+        else:
+            if self.alerts_only and classify(event, self.threshold) == "stock":
+                return 0
+            self._pending.append(event)
+        self._wakeup.set()
+        if len(self._pending) <= self.max_queue:
+            return 0
+        if self.policy == "coalesce":
+            self._pending.popitem(last=False)
+        else:
+            self._pending.popleft()
+        self.dropped += 1
+        return 1
+
+    # waits for the next event, returns (event type, event)
+    async def get(self):
+        while not self._pending:
+            self._wakeup.clear()
+            await self._wakeup.wait()
+        if self.policy == "coalesce":
+            event = self._pending.popitem(last=False)[1]
+        else:
+            event = self._pending.popleft()
+        return classify(event, self.threshold), event
+
+# Subscribers are indexed by seller, so a publish only visits the ones that want that seller's products
+class EventBus:
+    def __init__(self, max_subscribers):
+        self.max_subscribers = max_subscribers
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+        self._by_seller = {}  # seller -> set of Subscriber
+        self._all = set()  # subscribers without a seller filter
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    # None when max_subscribers are already connected
+    def subscribe(self, seller=None, threshold=None, policy=None, max_queue=None, alerts_only=False):
+        if self._count >= self.max_subscribers:
+            return None
+        subscriber = Subscriber(seller,
+                                settings.EVENTS_LOW_STOCK_THRESHOLD if threshold is None else threshold,
+                                policy or settings.EVENTS_POLICY,
+                                max_queue or settings.EVENTS_QUEUE_SIZE,
+                                alerts_only)
+        (self._all if seller is None else self._by_seller.setdefault(seller, set())).add(subscriber)
+        self._count += 1
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        if subscriber.seller is None:
+            found = subscriber in self._all
+            self._all.discard(subscriber)
+        else:
+            subscribers = self._by_seller.get(subscriber.seller, ())
+            found = subscriber in subscribers
+            if found:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._by_seller[subscriber.seller]
+        if found:
+            self._count -= 1
+
+    # handlers check this before building events, so an idle bus costs nothing
+    def wants(self, seller):
+        return bool(self._all) or seller in self._by_seller
+
+    def publish(self, product_id, seller, quantity, previous):
+        event = InventoryEvent(product_id, seller, quantity, previous)
+        self.published += 1
+        for subscribers in (self._all, self._by_seller.get(seller, ())):
+            for subscriber in subscribers:
+                self.dropped += subscriber.offer(event)
+                self.delivered += 1
+
+event_bus = EventBus(settings.EVENTS_MAX_SUBSCRIBERS)
+
+# called by the handlers after a write (on the event loop, like the bus itself)
+def publish_stock(product_id, seller, quantity, previous):
+    if event_bus.wants(seller):
+        event_bus.publish(product_id, seller, quantity, previous)
+
+# stock after a purchase: purchased maps product_id -> units bought, stock the (seller, quantity) the storage engine
+# read in the purchase step, so a concurrent purchase finishing first cannot shift them
+def publish_purchase(purchased, stock):
+    for product_id, quantity in purchased.items():
+        seller, remaining = stock[product_id]
+        publish_stock(product_id, seller, remaining, remaining + quantity)
+
+def format_event(kind, event, threshold):
+    data = {"type": kind, "product_id": event.product_id, "seller": event.seller, "quantity": event.quantity,
+            "previous_quantity": event.previous, "threshold": threshold}
+    return "event: {}\ndata: {}\n\n".format(kind, json.dumps(data, separators=(",", ":")))
+
+async def event_stream(subscriber, keepalive_seconds):
+    try:
+        yield ": subscribed\n\n"
+        while True:
+            try:
+                kind, event = await asyncio.wait_for(subscriber.get(), keepalive_seconds)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"  # lets proxies and clients notice a dead connection
+                continue
+            if subscriber.dropped:
+                dropped, subscriber.dropped = subscriber.dropped, 0
+                yield "event: dropped\ndata: {}\n\n".format(json.dumps({"count": dropped}))
+            yield format_event(kind, event, subscriber.threshold)
+    finally:
+        event_bus.unsubscribe(subscriber)
+
+# Server-Sent Events of stock changes. low_stock overrides EVENTS_LOW_STOCK_THRESHOLD, alerts_only leaves out plain
+# stock changes, policy and queue_size override EVENTS_POLICY and EVENTS_QUEUE_SIZE
+@events_router.get("/events/inventory")
+async def stream_inventory(seller: Optional[str] = None, low_stock: Optional[int] = None, alerts_only: bool = False,
+                           policy: Optional[str] = None, queue_size: Optional[int] = None):
+    if policy is not None and policy not in POLICIES:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Policy must be coalesce or drop")
+    if low_stock is not None and low_stock < 0:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="low_stock must be 0 or more")
+    if queue_size is not None and not 1 <= queue_size <= settings.EVENTS_QUEUE_SIZE:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST,
+                            detail="queue_size must be between 1 and {}".format(settings.EVENTS_QUEUE_SIZE))
+    subscriber = event_bus.subscribe(seller, low_stock, policy, queue_size, alerts_only)
+    if subscriber is None:
+        raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, detail="Too many subscribers, retry later",
+                            headers={"Retry-After": str(settings.EVENTS_KEEPALIVE_SECONDS)})
+    return StreamingResponse(event_stream(subscriber, settings.EVENTS_KEEPALIVE_SECONDS), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+CallbackGauge("vending_event_subscribers", "Connected inventory event subscribers", lambda: len(event_bus))
+CallbackCounter("vending_events_published_total", "Inventory events published", lambda: event_bus.published)
+CallbackCounter("vending_events_delivered_total", "Inventory events offered to a subscriber queue", lambda: event_bus.delivered)
+CallbackCounter("vending_events_dropped_total", "Inventory events dropped from a full subscriber queue", lambda: event_bus.dropped)
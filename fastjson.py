@@ -0,0 +1,48 @@
+# FAST-PATH JSON RESPONSES
+# Every route declares a response_model (see the response models in models.py). FastAPI validates what an endpoint
+# returns against it, building a second copy of the result, and only then serializes that copy. The results of these
+# endpoints are built from models and storage rows that were validated on the way in, so FastJSONRoute skips that pass:
+# the result goes once through the pydantic-core serializer of the response model, straight to JSON bytes, without
+# jsonable_encoder or intermediate dicts. A change dict from change.py or a page of Product models is written as it is.
+#
+# Endpoints returning a Response (cached bodies, streams) are passed through. With FAST_JSON=false the routes use
+# FastAPI's validating path, which also reports a result that does not match its model as a 500.
+
+import functools
+import inspect
+
+from fastapi import Response
+from fastapi.datastructures import DefaultPlaceholder
+from fastapi.routing import APIRoute
+from pydantic import TypeAdapter
+
+import settings
+
+MEDIA_TYPE = "application/json"
+
+# serializer of a response model, one per model type
+@functools.lru_cache(maxsize=None)
+def response_adapter(response_model):
+    return TypeAdapter(response_model)
+
+def render(adapter, content, status_code=200):
+    return Response(adapter.dump_json(content), status_code=status_code, media_type=MEDIA_TYPE)
+
+# the endpoint with its result rendered by adapter. functools.wraps keeps the signature FastAPI reads the parameters
+# from and the attributes of the endpoint (idempotency.idempotent)
+def fast_endpoint(endpoint, adapter, status_code):
+    @functools.wraps(endpoint)
+    async def rendered(*args, **kwargs):
+        content = await endpoint(*args, **kwargs)
+        if isinstance(content, Response):
+            return content
+        return render(adapter, content, status_code)
+    return rendered
+
+class FastJSONRoute(APIRoute):
+    def __init__(self, path, endpoint, **kwargs):
+        response_model = kwargs.get("response_model")
+        if (settings.FAST_JSON and response_model is not None and not isinstance(response_model, DefaultPlaceholder)
+                and inspect.iscoroutinefunction(endpoint)):
+            endpoint = fast_endpoint(endpoint, response_adapter(response_model), kwargs.get("status_code") or 200)
+        super().__init__(path, endpoint, **kwargs)
@@ -0,0 +1,178 @@
+# IDEMPOTENCY KEYS FOR RETRIED WRITES
+# Endpoints marked @idempotent accept an Idempotency-Key header. The first request with a key runs normally and its
+# response is kept; a retry with the same key gets that response back (marked Idempotent-Replayed: true) without
+# running the handler, its dependencies (authentication, so no bcrypt) or the rate limiter. A duplicate that arrives
+# while the first request is still running waits for it instead of running too.
+#
+# Keys are scoped per route and username. A retry must send the same Authorization header and the same request
+# (query and body), compared by keyed digests: other credentials get 401, another request with a used key gets 422.
+# Server errors, 401, 409 and 429 are not kept, the next attempt runs again.
+# The store is per process: with several workers a retry that reaches another worker runs again.
+
+import asyncio
+import base64
+import binascii
+import hashlib
+import os
+import time
+from collections import OrderedDict
+
+from fastapi import HTTPException, Response, status
+from fastapi.responses import JSONResponse
+
+import settings
+from fastjson import FastJSONRoute
+from metrics import CallbackCounter, CallbackGauge, IDEMPOTENT_REPLAYS, timed_route_class
+
+MAX_KEY_LENGTH = 255
+RETRYABLE_STATUSES = (401, 409, 429)  # never kept, along with 5xx
+
+# marks an endpoint of a router using idempotent_route_class
+def idempotent(endpoint):
+    endpoint.idempotent = True
+    return endpoint
+
+# username of a Basic Authorization header, not verified
+def basic_username(authorization):
+    scheme, _, credentials = (authorization or "").partition(" ")
+    if scheme.lower() != "basic":
+        return None
+    try:
+        username, separator, _ = base64.b64decode(credentials).decode("ascii").partition(":")
+    except (ValueError, UnicodeDecodeError, binascii.Error):
+        return None
+    return username if separator else None
+
+# (status_code, body, headers) to replay, None for responses that are not kept
+def _kept(response):
+    if response.status_code >= 500 or response.status_code in RETRYABLE_STATUSES:
+        return None
+    return (response.status_code, bytes(response.body),
+            {name: value for name, value in response.headers.items() if name != "content-length"})
+
+class IdempotencyEntry:
+    __slots__ = ("fingerprint", "credentials", "expires_at", "response", "done")
+
+    def __init__(self, fingerprint, credentials, expires_at):
+        self.fingerprint = fingerprint
+        self.credentials = credentials
+        self.expires_at = expires_at
+        self.response = None  # (status_code, body, headers) once finished
+        self.done = asyncio.Event()
+
+# Entries in insertion order, which is also expiry order: expired ones are dropped from the front as keys come in,
+# the oldest goes when max_entries is reached. Only touched from the event loop, so there is no lock
+class IdempotencyStore:
+    def __init__(self, max_entries, ttl_seconds, enabled=True):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        self.evictions = 0
+        self._secret = os.urandom(32)  # digests are useless outside this process
+        self._entries = OrderedDict()  # (route, username, key) -> IdempotencyEntry
+
+    def __len__(self):
+        return len(self._entries)
+
+    def digest(self, *parts):
+        h = hashlib.blake2b(key=self._secret, digest_size=16)
+        for part in parts:
+            h.update(len(part).to_bytes(8, "little"))
+            h.update(part)
+        return h.digest()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        return entry
+
+    def start(self, key, fingerprint, credentials):
+        now = time.monotonic()
+        while self._entries:
+            oldest = next(iter(self._entries.values()))
+            if oldest.expires_at > now and len(self._entries) < self.max_entries:
+                break
+            self._entries.popitem(last=False)  # a waiter still holds its entry and is woken as usual
+            self.evictions += 1
+        entry = self._entries[key] = IdempotencyEntry(fingerprint, credentials, now + self.ttl_seconds)
+        return entry
+
+    # keeps the response, or forgets the key when there is none to keep, and wakes the duplicates waiting on it
+    def finish(self, key, entry, response):
+        entry.response = response
+        if response is None and self._entries.get(key) is entry:
+            del self._entries[key]
+        entry.done.set()
+
+    def clear(self):
+        self._entries.clear()
+        self.evictions = 0
+
+    async def run(self, request, handler, route):
+        key = request.headers.get("idempotency-key")
+        authorization = request.headers.get("authorization")
+        username = basic_username(authorization)
+        if not self.enabled or key is None or username is None:
+            return await handler(request)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            raise HTTPException(status.HTTP_400_BAD_REQUEST,
+                                detail="Idempotency-Key must be 1 to {} characters".format(MAX_KEY_LENGTH))
+
+        scoped = (route, username, key)
+        fingerprint = self.digest(request.method.encode(), request.url.query.encode(), await request.body())
+        credentials = self.digest(authorization.encode())
+        while True:
+            entry = self.get(scoped)
+            if entry is None:
+                break
+            if entry.credentials != credentials:
+                raise HTTPException(status.HTTP_401_UNAUTHORIZED, detail="Invalid username or password",
+                                    headers={"WWW-Authenticate": "Basic"})
+            if entry.fingerprint != fingerprint:
+                raise HTTPException(422, detail="Idempotency-Key was already used for a different request")
+            if entry.response is None:
+                await entry.done.wait()
+                continue  # finished, or dropped without a response to keep: look again
+            IDEMPOTENT_REPLAYS.inc(route)
+            status_code, body, headers = entry.response
+            return Response(body, status_code=status_code, headers={**headers, "Idempotent-Replayed": "true"})
+
+        entry = self.start(scoped, fingerprint, credentials)
+        kept = None
+        try:
+            response = await handler(request)
+            kept = _kept(response)
+            return response
+        except HTTPException as e:  # kept as the JSON body FastAPI's exception handler answers with
+            kept = _kept(JSONResponse({"detail": e.detail}, status_code=e.status_code, headers=e.headers))
+            raise
+        finally:
+            self.finish(scoped, entry, kept)
+
+idempotency_store = IdempotencyStore(
+    max_entries=settings.IDEMPOTENCY_MAX_ENTRIES,
+    ttl_seconds=settings.IDEMPOTENCY_TTL_SECONDS,
+    enabled=settings.IDEMPOTENCY_ENABLED,
+)
+
+# Routes whose endpoint is marked @idempotent go through idempotency_store before their dependencies run
+class IdempotentRoute(FastJSONRoute):
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        if not getattr(self.endpoint, "idempotent", False):
+            return handler
+        route = self.path
+
+        async def idempotent_handler(request):
+            return await idempotency_store.run(request, handler, route)
+        return idempotent_handler
+
+# timed_route_class on top of IdempotentRoute, so replays are timed and counted like any other response
+def idempotent_route_class(router):
+    return timed_route_class(router, base=IdempotentRoute)
+
+CallbackGauge("vending_idempotency_keys", "Idempotency keys held", lambda: len(idempotency_store))
+CallbackCounter("vending_idempotency_evictions_total", "Idempotency keys dropped before their TTL to stay under the bound",
+                lambda: idempotency_store.evictions)
@@ -0,0 +1,258 @@
+# WRITE-AHEAD JOURNAL AND SNAPSHOTS FOR THE IN-MEMORY ENGINE
+# STORAGE_URL=journal:///path/to/dir keeps the dict engine but logs every mutation to append-only segment files,
+# writes periodic snapshots and rebuilds the state from the newest snapshot plus the journal tail on startup.
+#
+# A record is a JSON line [seq, effect, effect, ...]. Effects are absolute post-states of what one storage call
+# changed (["b", username, balance], ["q", product_id, quantity], ...), written while the call still holds its locks,
+# so replaying them in seq order is idempotent and a record is applied whole or not at all.
+
+import asyncio
+import fcntl
+import json
+import os
+import threading
+
+FSYNC_POLICIES = ("always", "interval", "never")
+_decode = json.JSONDecoder().decode  # json.loads minus the per-call encoding detection, recovery parses every line
+
+def _segment_name(first_seq):
+    return "journal-{:020d}.log".format(first_seq)
+
+def _snapshot_name(seq):
+    return "snapshot-{:020d}.jsonl".format(seq)
+
+def _seq_of(name):
+    return int(name.rsplit("-", 1)[1].split(".")[0])
+
+def _fsync_directory(directory):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+# Group commit: append() only queues the record, a writer thread writes everything queued with one write() and,
+# depending on the fsync policy, one fsync:
+#   always   - the writer runs as soon as records are queued, wait_durable() returns after their fsync
+#   interval - queued records are written and fsynced every fsync_interval seconds, nobody waits
+#   never    - written every fsync_interval seconds, the OS decides when they reach the disk
+class Journal:
+    def __init__(self, directory, fsync="interval", fsync_interval=0.05, snapshot_every=1000000):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError("Unknown journal fsync policy: {}".format(fsync))
+        self.directory = directory
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.snapshot_every = snapshot_every
+        self.snapshots = 0
+        self._seq = 0  # last appended
+        self._durable_seq = 0  # last written (and fsynced under "always")
+        self._pending = []
+        self._waiters = []  # (seq, loop, future) of wait_durable() calls
+        self._cond = threading.Condition()
+        self._writer_idle = False
+        self._closing = False
+        self._since_snapshot = 0
+        self._snapshot_thread = None
+        self._file = None
+        self._writer = None
+        self._snapshot_state = None
+        os.makedirs(directory, exist_ok=True)
+        # the state lives in one process: a second one (another uvicorn worker) would replay and append on its own
+        self._lock_file = open(os.path.join(directory, "LOCK"), "a")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock_file.close()
+            raise RuntimeError("Journal directory {} is in use by another process, "
+                               "several workers need STORAGE_URL=sqlite:///...".format(directory))
+
+    def _files(self, prefix):
+        return sorted(name for name in os.listdir(self.directory) if name.startswith(prefix) and not name.endswith(".tmp"))
+
+    # loads the newest snapshot, then replays every later record through apply(effect); returns the records replayed
+    def recover(self, apply, load_snapshot):
+        snapshot_seq = 0
+        snapshots = self._files("snapshot-")
+        if snapshots:
+            snapshot_seq = _seq_of(snapshots[-1])
+            with open(os.path.join(self.directory, snapshots[-1])) as f:
+                load_snapshot(json.loads(line) for line in f)
+        self._seq = snapshot_seq
+
+        replayed = 0
+        segments = self._files("journal-")
+        for i, name in enumerate(segments):
+            path = os.path.join(self.directory, name)
+            with open(path, "rb") as f:
+                offset = 0
+                for line in f:
+                    try:
+                        if not line.endswith(b"\n"):
+                            raise ValueError("torn record")
+                        record = _decode(line.decode())
+                    except ValueError:
+                        if i != len(segments) - 1:
+                            raise ValueError("Corrupt journal record in {} at byte {}".format(name, offset))
+                        break  # a record cut short by a crash, only possible at the very end
+                    offset += len(line)
+                    if record[0] <= snapshot_seq:
+                        continue
+                    for effect in record[1:]:
+                        apply(effect)
+                    self._seq = record[0]
+                    replayed += 1
+            if os.path.getsize(path) != offset:
+                with open(path, "r+b") as f:
+                    f.truncate(offset)
+        self._durable_seq = self._seq
+        self._since_snapshot = replayed
+        return replayed
+
+    # starts a new segment and the writer thread, snapshot_state() returns an iterable of snapshot effects
+    def start(self, snapshot_state):
+        self._snapshot_state = snapshot_state
+        self._open_segment(self._seq + 1)
+        self._writer = threading.Thread(target=self._write_loop, name="journal-writer", daemon=True)
+        self._writer.start()
+
+    def _open_segment(self, first_seq):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+        self._file = open(os.path.join(self.directory, _segment_name(first_seq)), "ab")
+        _fsync_directory(self.directory)
+
+    # called by the storage engine while it holds the locks of what the effects describe
+    def append(self, effects):
+        with self._cond:
+            self._seq += 1
+            self._pending.append((self._seq, effects))
+            if self._writer_idle and self.fsync == "always":
+                self._cond.notify()
+            self._since_snapshot += 1
+            if self._since_snapshot >= self.snapshot_every and self._snapshot_thread is None:
+                self._since_snapshot = 0
+                self._snapshot_thread = threading.Thread(target=self.snapshot, name="journal-snapshot", daemon=True)
+                self._snapshot_thread.start()
+            return self._seq
+
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                if self.fsync == "always":
+                    while not self._pending and not self._closing:
+                        self._writer_idle = True
+                        self._cond.wait()
+                elif not self._closing:
+                    self._writer_idle = True
+                    self._cond.wait(self.fsync_interval)
+                self._writer_idle = False
+                batch, self._pending = self._pending, []
+                closing = self._closing
+
+            last_seq = self._write_batch(batch)
+            if batch and self.fsync != "never":
+                os.fsync(self._file.fileno())
+            if last_seq:
+                self._mark_durable(last_seq)
+            if closing:
+                with self._cond:
+                    if not self._pending:
+                        return
+
+    # pending items are (seq, effects), or (seq, None) to start a new segment with the records after seq
+    def _write_batch(self, batch):
+        last_seq = 0
+        lines = []
+        for seq, effects in batch:
+            if effects is None:
+                self._file.write("".join(lines).encode())
+                lines = []
+                self._open_segment(seq + 1)
+                continue
+            lines.append(json.dumps([seq, *effects], separators=(",", ":")) + "\n")
+            last_seq = seq
+        if lines:
+            self._file.write("".join(lines).encode())
+            self._file.flush()
+        return last_seq
+
+    def _mark_durable(self, seq):
+        with self._cond:
+            self._durable_seq = seq
+            ready = [waiter for waiter in self._waiters if waiter[0] <= seq]
+            self._waiters = [waiter for waiter in self._waiters if waiter[0] > seq]
+            self._cond.notify_all()
+        for _, loop, future in ready:
+            loop.call_soon_threadsafe(_resolve, future)
+
+    # returns once every record appended so far is on disk (only waits under fsync=always)
+    async def wait_durable(self):
+        if self.fsync != "always":
+            return
+        with self._cond:
+            seq = self._seq
+            if self._durable_seq >= seq:
+                return
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._waiters.append((seq, loop, future))
+        await future
+
+    # blocking version of wait_durable for threads, waits for the write under every policy
+    def flush(self):
+        with self._cond:
+            seq = self._seq
+            self._cond.notify()
+            while self._durable_seq < seq and self._writer is not None and self._writer.is_alive():
+                self._cond.wait(0.1)
+
+    # Fuzzy snapshot: the segment is rotated first, so every record up to seq is covered by the state read
+    # afterwards (a value that changed meanwhile is set again by its later record on replay).
+    def snapshot(self):
+        try:
+            with self._cond:
+                seq = self._seq
+                self._pending.append((seq, None))
+                self._cond.notify()
+            tmp_path = os.path.join(self.directory, _snapshot_name(seq) + ".tmp")
+            with open(tmp_path, "w") as f:
+                for effect in self._snapshot_state():
+                    f.write(json.dumps(effect, separators=(",", ":")) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, os.path.join(self.directory, _snapshot_name(seq)))
+            _fsync_directory(self.directory)
+            self.flush()  # the rotation is written before older segments go away
+            for name in self._files("snapshot-"):
+                if _seq_of(name) < seq:
+                    os.remove(os.path.join(self.directory, name))
+            segments = self._files("journal-")
+            for name, following in zip(segments, segments[1:]):
+                if _seq_of(following) <= seq + 1:  # every record of this segment is <= seq
+                    os.remove(os.path.join(self.directory, name))
+            self.snapshots += 1
+        finally:
+            self._snapshot_thread = None
+
+    def close(self):
+        snapshot_thread = self._snapshot_thread
+        if snapshot_thread is not None:
+            snapshot_thread.join()
+        with self._cond:
+            self._closing = True
+            self._cond.notify()
+        if self._writer is not None:
+            self._writer.join()
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+        self._lock_file.close()
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
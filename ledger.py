@@ -0,0 +1,120 @@
+# SALES LEDGER AND INCREMENTAL SALES AGGREGATES
+# Every purchase appends one sale per product line to an append-only ledger and, in the same step, adds it to running
+# totals per product and per seller, overall and per time bucket of settings.SALES_BUCKET_SECONDS. Stats are read from
+# those totals (one lookup plus a binary search over the buckets of the product or seller), never by scanning the ledger.
+#
+# This is the ledger of the in-memory engines, the SQLite engine keeps the same data in tables (see storage.py).
+
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+
+import settings
+
+# a sale is (sold_at, buyer, product_id, seller, quantity, revenue_in_cents), sold_at in seconds since the epoch
+def bucket_of(sold_at, bucket_seconds=None):
+    bucket_seconds = bucket_seconds or settings.SALES_BUCKET_SECONDS
+    return int(sold_at // bucket_seconds) * bucket_seconds
+
+# Totals of one product or seller. Buckets are parallel arrays ordered by bucket start: sales arrive in time order,
+# so a sale almost always lands in the last bucket or opens a new one at the end.
+class SalesTotals:
+    __slots__ = ("seller", "sales", "units", "revenue_in_cents", "starts", "bucket_sales", "bucket_units", "bucket_revenue")
+
+    def __init__(self, seller):
+        self.seller = seller
+        self.sales = 0
+        self.units = 0
+        self.revenue_in_cents = 0
+        self.starts = array("q")
+        self.bucket_sales = array("q")
+        self.bucket_units = array("q")
+        self.bucket_revenue = array("q")
+
+    def add(self, bucket, quantity, revenue_in_cents):
+        self.sales += 1
+        self.units += quantity
+        self.revenue_in_cents += revenue_in_cents
+        starts = self.starts
+        i = len(starts) - 1
+        if i < 0 or starts[i] != bucket:
+            i = bisect_left(starts, bucket)
+            if i == len(starts) or starts[i] != bucket:
+                for column in (starts, self.bucket_sales, self.bucket_units, self.bucket_revenue):
+                    column.insert(i, 0)
+                starts[i] = bucket
+        self.bucket_sales[i] += 1
+        self.bucket_units[i] += quantity
+        self.bucket_revenue[i] += revenue_in_cents
+
+    # (bucket start, sales, units, revenue_in_cents) of the buckets starting in [since, until)
+    def buckets(self, since, until):
+        low, high = bisect_left(self.starts, since), bisect_left(self.starts, until)
+        return list(zip(self.starts[low:high], self.bucket_sales[low:high],
+                        self.bucket_units[low:high], self.bucket_revenue[low:high]))
+
+# The ledger itself is kept as columns (arrays of numbers, interned names) rather than one tuple per sale,
+# a sale id is its position
+class SalesLedger:
+    def __init__(self, bucket_seconds=None):
+        self.bucket_seconds = bucket_seconds or settings.SALES_BUCKET_SECONDS
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.sold_at = array("d")
+        self.buyers = []
+        self.product_ids = array("q")
+        self.sellers = []
+        self.quantities = array("q")
+        self.revenues = array("q")
+        self.by_product = {}  # product_id -> SalesTotals
+        self.by_seller = {}  # seller -> SalesTotals
+
+    def __len__(self):
+        return len(self.sold_at)
+
+    # appends a sale and returns its id
+    def append(self, sale):
+        with self._lock:
+            return self._append(sale)
+
+    # recovery: sales already in the ledger (a fuzzy snapshot may hold them) are skipped, so replay stays idempotent
+    def restore(self, sale_id, sale):
+        with self._lock:
+            if sale_id >= len(self.sold_at):
+                self._append(sale)
+
+    def _append(self, sale):
+        sold_at, buyer, product_id, seller, quantity, revenue_in_cents = sale
+        buyer, seller = sys.intern(buyer), sys.intern(seller)
+        self.sold_at.append(sold_at)
+        self.buyers.append(buyer)
+        self.product_ids.append(product_id)
+        self.sellers.append(seller)
+        self.quantities.append(quantity)
+        self.revenues.append(revenue_in_cents)
+        bucket = bucket_of(sold_at, self.bucket_seconds)
+        for table, key in ((self.by_product, product_id), (self.by_seller, seller)):
+            totals = table.get(key)
+            if totals is None or totals.seller != seller:  # a deleted product id reused by another seller starts over
+                totals = table[key] = SalesTotals(seller)
+            totals.add(bucket, quantity, revenue_in_cents)
+        return len(self.sold_at) - 1
+
+    def sale(self, sale_id):
+        return (self.sold_at[sale_id], self.buyers[sale_id], self.product_ids[sale_id], self.sellers[sale_id],
+                self.quantities[sale_id], self.revenues[sale_id])
+
+    # kind is "product" or "seller", returns (seller, sales, units, revenue_in_cents, buckets) or None without sales
+    def totals(self, kind, key, since, until):
+        with self._lock:
+            totals = (self.by_product if kind == "product" else self.by_seller).get(key)
+            if totals is None:
+                return None
+            return totals.seller, totals.sales, totals.units, totals.revenue_in_cents, totals.buckets(since, until)
+
+    def clear(self):
+        with self._lock:
+            self._reset()
@@ -1,11 +1,115 @@
+import asyncio
+import importlib
+import time
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
-from user_operations import user_router
-from product_operations import product_router
-from vending_operations import vending_router
 
-app = FastAPI()
+import settings
+from storage import get_storage, prepare_for_workers
+from admin import scheduler
+
+# (module, router, path prefixes it serves), included in this order
+ROUTERS = (
+    ("user_operations", "user_router", ("/users",)),
+    ("product_operations", "product_router", ("/products",)),
+    ("vending_operations", "vending_router", ("/deposit", "/buy", "/reset")),
+    ("sales_operations", "sales_router", ("/sellers", "/products")),
+    ("metrics", "metrics_router", ("/metrics",)), # GET /metrics, Prometheus text format
+    ("events", "events_router", ("/events",)), # GET /events/inventory, Server-Sent Events
+    ("admin_operations", "admin_router", ("/admin",)), # bulk balance jobs and schedules, see admin.py
+)
+# the schema and the metrics of every router
+LOAD_ALL_PATHS = ("/docs", "/redoc", "/openapi.json", "/metrics")
+
+# Imports the router modules and includes their routers, timing both (startup_profile.py reports the timings)
+class RouterLoader:
+    def __init__(self, app):
+        self.app = app
+        self.pending = list(ROUTERS)
+        self.timings = []  # {"module", "import_seconds", "include_seconds", "deferred"}
+
+    def load(self, entry, deferred=False):
+        module_name, router_name, _ = entry
+        started = time.perf_counter()
+        module = importlib.import_module(module_name)
+        imported = time.perf_counter()
+        self.app.include_router(getattr(module, router_name))
+        self.timings.append({"module": module_name, "import_seconds": imported - started,
+                             "include_seconds": time.perf_counter() - imported, "deferred": deferred})
+        self.pending.remove(entry)
+
+    def load_all(self, deferred=False):
+        for entry in list(self.pending):
+            self.load(entry, deferred)
+
+    # routers serving path, in the order of ROUTERS
+    def load_for(self, path):
+        if path.startswith(LOAD_ALL_PATHS):
+            self.load_all(deferred=True)
+            return
+        for entry in [entry for entry in self.pending if path.startswith(entry[2])]:
+            self.load(entry, deferred=True)
+
+# LAZY_STARTUP: includes the routers a request needs before routing it. Nothing is awaited while loading,
+# so two requests cannot include the same router
+class LazyRouterMiddleware:
+    def __init__(self, app, loader):
+        self.app = app
+        self.loader = loader
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] in ("http", "websocket") and self.loader.pending:
+            self.loader.load_for(scope["path"])
+        await self.app(scope, receive, send)
+
+# Runs in the background once the server accepts requests, one step per event loop turn. Failures are left to the
+# request that needs the same thing
+async def prewarm(loader):
+    while loader.pending:
+        await asyncio.sleep(0)
+        loader.load(loader.pending[0], deferred=True)
+    from security import hashing_pool, warm_up
+    await hashing_pool.run(warm_up)
+    from product_operations import catalog_body
+    from response_cache import ALL_PRODUCTS, cached_body, cache_used
+    if cache_used():
+        cached_body(ALL_PRODUCTS, catalog_body)
+
+# Starts the admin job scheduler. With LAZY_STARTUP the storage engine (journal recovery, SQLite pool) is also opened
+# before the first request instead of by it, and the rest is warmed by prewarm
+@asynccontextmanager
+async def lifespan(app):
+    task = None
+    if app.state.lazy:
+        get_storage()
+        task = asyncio.create_task(prewarm(app.state.routers))
+    scheduler.start()
+    yield
+    await scheduler.stop()
+    if task is not None:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+def create_app(lazy=None):
+    lazy = settings.LAZY_STARTUP if lazy is None else lazy
+    app = FastAPI(lifespan=lifespan)
+    app.state.lazy = lazy
+    app.state.routers = RouterLoader(app)
+    if lazy:
+        app.add_middleware(LazyRouterMiddleware, loader=app.state.routers)
+    else:
+        app.state.routers.load_all()
+    return app
+
+app = create_app()
+
+# python main.py: uvicorn with settings.WORKERS processes on HOST:PORT, workers share users, products,
+# balances and coins through the SQLite store
+def serve():
+    import uvicorn # only needed to serve, `uvicorn main:app` has it imported already
+    prepare_for_workers(settings.STORAGE_URL, settings.WORKERS)
+    uvicorn.run("main:app", host=settings.HOST, port=settings.PORT, workers=settings.WORKERS, log_level=settings.LOG_LEVEL)
 
-# Include routers
-app.include_router(user_router)
-app.include_router(product_router)
-app.include_router(vending_router)
+if __name__ == "__main__":
+    serve()
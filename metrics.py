@@ -0,0 +1,209 @@
+# PROMETHEUS-STYLE METRICS
+# in-process counters, gauges and histograms rendered in the Prometheus text format on GET /metrics
+
+import threading
+import time
+from bisect import bisect_left
+
+from fastapi import APIRouter, HTTPException
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import Response
+
+import settings
+from fastjson import FastJSONRoute
+
+metrics_router = APIRouter()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# seconds, from a cached credential check up to a slow bcrypt on a busy pool
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, _escape(value)) for name, value in zip(names, values)) + "}"
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+# Base class: one value per tuple of label values, updated under a per-metric lock
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help, labelnames=(), registry=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        (REGISTRY if registry is None else registry).append(self)
+
+    def value(self, *labels):
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items(), key=lambda item: tuple(str(label) for label in item[0]))
+        for labels, value in items:
+            yield self.name, self.labelnames, labels, value
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value):
+        with self._lock:
+            self._values[labels] = value
+
+# Gauge read from a callback at scrape time, for state other modules already track (pool queue, cache size)
+class CallbackGauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name, help, callback, registry=None):
+        super().__init__(name, help, registry=registry)
+        self.callback = callback
+
+    def value(self, *labels):
+        return self.callback()
+
+    def samples(self):
+        yield self.name, (), (), self.callback()
+
+# Counter read from a callback at scrape time, for totals other modules already keep and only ever increase
+# (cache hits, dropped events), so rate() works on them
+class CallbackCounter(CallbackGauge):
+    kind = "counter"
+
+# Fixed buckets: an observation is one bisect and two additions, cumulative counts are built at scrape time
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS, registry=None):
+        super().__init__(name, help, labelnames, registry)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)  # first bucket with value <= le
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def count(self, *labels):
+        with self._lock:
+            state = self._values.get(labels)
+            return sum(state[0]) if state else 0
+
+    def samples(self):
+        with self._lock:
+            items = sorted((labels, (list(state[0]), state[1])) for labels, state in self._values.items())
+        bucket_labelnames = self.labelnames + ("le",)
+        for labels, (counts, total) in items:
+            cumulative = 0
+            for le, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                yield self.name + "_bucket", bucket_labelnames, labels + (le,), cumulative
+            yield self.name + "_sum", self.labelnames, labels, total
+            yield self.name + "_count", self.labelnames, labels, cumulative
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+REGISTRY = []
+
+def render(registry=None):
+    lines = []
+    for metric in REGISTRY if registry is None else registry:
+        lines.append("# HELP {} {}".format(metric.name, metric.help))
+        lines.append("# TYPE {} {}".format(metric.name, metric.kind))
+        for name, labelnames, labels, value in metric.samples():
+            lines.append("{}{} {}".format(name, _format_labels(labelnames, labels), _format_value(value)))
+    return "\n".join(lines) + "\n"
+
+# HTTP metrics, labelled by router (users, products, vending) and route template so ids never become labels
+REQUESTS = Counter("vending_http_requests_total", "HTTP requests handled", ("router", "route", "method", "status"))
+IN_FLIGHT = Gauge("vending_http_requests_in_flight", "HTTP requests being handled", ("router", "route", "method"))
+LATENCY = Histogram("vending_http_request_duration_seconds", "HTTP request latency", ("router", "route", "method"))
+
+# time spent in the expensive stages of a request
+STAGE_SECONDS = Histogram("vending_stage_duration_seconds", "Latency of request stages (bcrypt includes waiting for a pool worker)", ("stage",))
+
+# business counters
+COINS_DEPOSITED = Counter("vending_coins_deposited_total", "Coins deposited, per denomination in cents", ("coin",))
+UNITS_SOLD = Counter("vending_units_sold_total", "Units sold, per product", ("product_id",))
+STOCK_OUTS = Counter("vending_stock_outs_total", "Purchases refused because the product did not have enough units", ("product_id",))
+RATE_LIMITED = Counter("vending_rate_limited_total", "Requests refused with 429, per limited route and bucket kind (user or ip)",
+                       ("route", "key"))
+IDEMPOTENT_REPLAYS = Counter("vending_idempotent_replays_total", "Retries answered with the stored response of their Idempotency-Key",
+                             ("route",))
+
+# Route class for the routers (APIRouter(route_class=timed_route_class("users"))): wraps the request handler,
+# which covers dependencies (authentication), the endpoint and response serialization.
+# The route template is the label, so product ids and usernames never become label values.
+# base is the route class to time, e.g. idempotency.IdempotentRoute
+def timed_route_class(router, base=FastJSONRoute):
+    class TimedRoute(base):
+        def get_route_handler(self):
+            handler = super().get_route_handler()
+            if not settings.METRICS_ENABLED:
+                return handler
+            route = self.path
+
+            async def timed_handler(request):
+                method = request.method
+                status_code = 500  # an exception that is not an HTTPException
+                IN_FLIGHT.inc(router, route, method)
+                start = time.perf_counter()
+                try:
+                    response = await handler(request)
+                    status_code = response.status_code
+                    return response
+                except HTTPException as e:
+                    status_code = e.status_code
+                    raise
+                except RequestValidationError:
+                    status_code = 422
+                    raise
+                finally:
+                    LATENCY.observe(time.perf_counter() - start, router, route, method)
+                    IN_FLIGHT.dec(router, route, method)
+                    REQUESTS.inc(router, route, method, status_code)
+            return timed_handler
+    return TimedRoute
+
+@metrics_router.get("/metrics", include_in_schema=False)
+async def read_metrics():
+    return Response(render(), media_type=CONTENT_TYPE)
@@ -1,21 +1,198 @@
-from pydantic import BaseModel, conint, confloat
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Dict, List, Literal, Optional
+from typing_extensions import TypedDict # typing.TypedDict is not accepted by pydantic before Python 3.12
+from pydantic import BaseModel, conint, confloat, computed_field, model_validator
+
+CENT = Decimal("0.01")
+MAX_INTEGER = 2 ** 63 - 1  # largest SQLite INTEGER
+MAX_CENTS = MAX_INTEGER
+
+# ids, quantities and times from requests: sqlite3 raises OverflowError for integers it cannot bind, so every engine
+# answers 422 for them instead
+StorableInt = conint(ge=-MAX_INTEGER - 1, le=MAX_INTEGER)
+
+# money is stored as integer cents, decimal strings like "1.50" only exist at the API edge
+def price_to_cents(price):
+    return int(Decimal(str(price)).quantize(CENT, rounding=ROUND_HALF_UP) * 100)
+
+def is_whole_cents(price):
+    return Decimal(str(price)) == Decimal(str(price)).quantize(CENT)
+
+# price_to_cents for amounts from requests: ValueError instead of the InvalidOperation of an amount with too many
+# digits to quantize, and for amounts no engine can store. Once it passes, is_whole_cents is safe to call
+def checked_cents(amount, name="Amount"):
+    try:
+        cents = price_to_cents(amount)
+    except ArithmeticError:
+        raise ValueError("{} is too large".format(name))
+    if abs(cents) > MAX_CENTS:
+        raise ValueError("{} is too large".format(name))
+    return cents
+
+def format_cents(cents):
+    return "{}{}.{:02d}".format("-" if cents < 0 else "", *divmod(abs(cents), 100))
 
 class User(BaseModel):
     username: str
     password: str
     is_seller: bool = False
-    balance_in_cents: int = 0 
+    balance_in_cents: int = 0
 
 class Product(BaseModel):
-    id: int
+    id: StorableInt
     name: str
-    price: confloat(gt=0)
-    quantity: conint(gt=0)
+    price_in_cents: conint(gt=0)
+    quantity: conint(gt=0, le=MAX_INTEGER)
     seller: str
 
+    # decimal view of the price for API responses
+    @computed_field
+    @property
+    def price(self) -> str:
+        return format_cents(self.price_in_cents)
+
+    # migration path for records written before prices were integer cents: {"price": 1.5} -> price_in_cents=150
+    @model_validator(mode="before")
+    @classmethod
+    def migrate_float_price(cls, data):
+        if isinstance(data, dict) and "price_in_cents" not in data and "price" in data:
+            data = dict(data)
+            data["price_in_cents"] = price_to_cents(data.pop("price"))
+        return data
+
 class Deposit(BaseModel):
     coins_5: conint(ge=0) = 0
     coins_10: conint(ge=0) = 0
     coins_20: conint(ge=0) = 0
     coins_50: conint(ge=0) = 0
-    coins_100: conint(ge=0) = 0 
\ No newline at end of file
+    coins_100: conint(ge=0) = 0
+
+    # the deposit has to fit in a balance
+    @model_validator(mode="after")
+    def check_total(self):
+        if 5 * self.coins_5 + 10 * self.coins_10 + 20 * self.coins_20 + 50 * self.coins_50 + 100 * self.coins_100 > MAX_CENTS:
+            raise ValueError("Deposit is too large")
+        return self
+
+class CartItem(BaseModel):
+    product_id: StorableInt
+    quantity: conint(gt=0, le=MAX_INTEGER)
+
+# admin balance job over every user, the sellers or the buyers (users), optionally only the listed usernames.
+# reset sets balances to 0, set to amount, add adds amount (negative to take money off, never below 0),
+# report only totals them
+class BalanceOperation(BaseModel):
+    action: Literal["reset", "set", "add", "report"]
+    users: Literal["all", "sellers", "buyers"] = "all"
+    usernames: Optional[List[str]] = None
+    amount: Decimal = Decimal(0)
+
+# recurring admin job, every every_seconds or daily at daily_at ("HH:MM" UTC)
+class Schedule(BalanceOperation):
+    every_seconds: Optional[confloat(gt=0)] = None
+    daily_at: Optional[str] = None
+
+# RESPONSE MODELS
+# the shapes the endpoints return, declared as response_model on every route. Endpoints build plain dicts (and Product
+# models), so these are TypedDicts: fastjson.FastJSONRoute serializes the dicts with them as they are, without
+# building a model per response
+
+class Message(TypedDict):
+    message: str
+
+class UserInfo(TypedDict):
+    username: str
+    is_seller: bool
+    balance_in_cents: int
+
+class SellerStatus(TypedDict):
+    username: str
+    is_seller: bool
+
+class DepositResult(TypedDict):
+    message: str
+    balance_in_cents: int
+
+# change.compute_change / make_change: coins paid back per denomination ("100", "50", ...) and what could not be paid
+class Change(TypedDict):
+    change_given: Dict[str, int]
+    unpaid_cents: int
+
+class PurchaseResult(TypedDict):
+    message: str
+    quanity_purchased: int
+    total_cost: int
+    change: Change
+
+class CartLine(TypedDict):
+    product_id: int
+    quantity_purchased: int
+    cost: int
+
+class CartResult(TypedDict):
+    message: str
+    items: List[CartLine]
+    total_cost: int
+    change: Change
+
+class ProductPage(TypedDict):
+    items: List[Product]
+    next_cursor: Optional[str]
+
+class RowErrors(TypedDict):
+    line: int
+    errors: List[str]
+
+class ImportResult(TypedDict):
+    message: str
+    imported: int
+    failed: int
+    errors: List[RowErrors]
+    errors_truncated: bool
+
+class SalesBucket(TypedDict):
+    start: int
+    sales: int
+    units_sold: int
+    revenue_in_cents: int
+
+class SalesStats(TypedDict):
+    seller: str
+    sales: int
+    units_sold: int
+    revenue_in_cents: int
+    revenue: str
+    bucket_seconds: int
+    since: int
+    until: int
+    buckets: List[SalesBucket]
+
+class ProductSales(SalesStats):
+    product_id: int
+
+class BalanceJobInfo(TypedDict):
+    id: int
+    action: str
+    users: str
+    usernames: Optional[List[str]]
+    amount_in_cents: int
+    schedule: Optional[str]
+    status: str
+    chunks: int
+    users_matched: int
+    balance_before_in_cents: int
+    balance_after_in_cents: int
+    started_at: float
+    finished_at: Optional[float]
+    error: Optional[str]
+
+class ScheduleInfo(TypedDict):
+    name: str
+    action: str
+    users: str
+    usernames: Optional[List[str]]
+    amount_in_cents: int
+    every_seconds: Optional[float]
+    daily_at: Optional[str]
+    next_run: float
+    last_job: Optional[int]
@@ -1,60 +1,189 @@
 # CRUD OPERATIONS FOR PRODUCTS
 
-from fastapi import APIRouter, HTTPException, Depends, status
-from user_operations import users_db, get_current_user
-from models import Product, User
+from decimal import Decimal
+from typing import Annotated, List, Optional
+from fastapi import APIRouter, HTTPException, Depends, Header, Request, status
+from fastapi.responses import StreamingResponse
+from user_operations import get_current_user
+from models import Product, User, Message, ProductPage, ImportResult, checked_cents, is_whole_cents, StorableInt, MAX_INTEGER
+from storage import get_storage, memory_storage
+from bulk import FORMATS, PRODUCT_LIST, import_products, export_csv
+from metrics import timed_route_class
+from response_cache import ALL_PRODUCTS, product_cache, cached_body, json_response, invalidate_products
+from events import publish_stock
 
-product_router = APIRouter()
-products_db = {} #using a dictionary for this task, but for production apps would use a real DB
+product_router = APIRouter(route_class=timed_route_class("products"))
+products_db = memory_storage.products # tables of the default in-memory engine, see storage.py for the other engines
+MAX_PAGE_SIZE = 1000
+EXPORT_PAGE_SIZE = 1000
+
+# checked_cents for the price parameters, a 400 for amounts that do not fit in cents
+def price_in_cents(price, name="Price"):
+    try:
+        return checked_cents(price, name)
+    except ValueError as e:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+# cursors are the sort key of the last product of a page: "<id>" or, when filtering by price, "<price_in_cents>:<id>"
+def encode_cursor(key):
+    if key is None:
+        return None
+    return "{}:{}".format(*key) if isinstance(key, tuple) else str(key)
+
+def decode_cursor(cursor, by_price):
+    if cursor is None:
+        return None
+    if by_price:
+        price_in_cents, product_id = cursor.split(":")
+        key = (int(price_in_cents), int(product_id))
+    else:
+        key = (int(cursor),)
+    if not all(-MAX_INTEGER - 1 <= part <= MAX_INTEGER for part in key):
+        raise ValueError("Cursor out of range")
+    return key if by_price else key[0]
+
+# NDJSON export, one storage page at a time
+def product_lines(storage, **filters):
+    for page in storage.iter_product_pages(page_size=EXPORT_PAGE_SIZE, **filters):
+        yield "".join(product.model_dump_json() + "\n" for product in page)
 
 #CREATE
 @product_router.post("/products/", response_model=Product)
-async def create_product(id: int, name: str, price: float, quantity: int, current_user: User = Depends(get_current_user)):
-    if not current_user.is_seller: 
+async def create_product(id: StorableInt, name: str, price: Decimal, quantity: StorableInt, current_user: User = Depends(get_current_user)):
+    storage = get_storage()
+    if not current_user.is_seller:
         raise HTTPException(status.HTTP_401_UNAUTHORIZED, detail="User must be a seller")
-    if id in products_db:
+    if storage.get_product(id) is not None:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="ProductId already exists")
     if price <= 0:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Price must be greater than 0")
+    cents = price_in_cents(price)
+    if not is_whole_cents(price):
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Price must be a whole number of cents")
     if quantity <= 0:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Quantity must be greater than 0")
 
-    product = Product(id=id, name=name, price=price, quantity=quantity, seller=current_user.username)
-    products_db[id] = product
+    product = Product(id=id, name=name, price_in_cents=cents, quantity=quantity, seller=current_user.username)
+    if not storage.add_product(product):
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="ProductId already exists")
+    invalidate_products((id,))
+    await storage.sync()
+    publish_stock(id, product.seller, product.quantity, None)
     return product
 
+# Create or update many products from a streamed CSV (id,name,price,quantity header) or NDJSON body.
+# Rows are validated and written in chunks as they arrive, the response reports every row that was not imported
+@product_router.post("/products/bulk", response_model=ImportResult)
+async def import_products_bulk(request: Request, format: Optional[str] = None, current_user: User = Depends(get_current_user)):
+    if not current_user.is_seller:
+        raise HTTPException(status.HTTP_401_UNAUTHORIZED, detail="User must be a seller")
+    if format is None:
+        format = "ndjson" if "json" in request.headers.get("content-type", "") else "csv"
+    if format not in FORMATS:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Format must be csv or ndjson")
+
+    storage = get_storage()
+    try:
+        report = await import_products(storage, request.stream(), format, current_user.username)
+    except ValueError as e:  # unusable CSV header (nothing written yet) or a body that is not UTF-8
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=str(e))
+    finally:
+        product_cache.invalidate_all()  # chunks may have been written before a failure
+    await storage.sync()
+    return {"message": "Imported {} product(s), {} row(s) failed".format(report.imported, report.failed), **report.as_dict()}
+
 #READ
-@product_router.get("/products/all") #created for testing/debugging purposes
-async def read_products():
-    return list(products_db.values())
+@product_router.get("/products/", response_model=ProductPage)
+async def read_products_page(cursor: Optional[str] = None, limit: int = 50, seller: Optional[str] = None,
+                             min_price: Optional[Decimal] = None, max_price: Optional[Decimal] = None,
+                             in_stock: Optional[bool] = None):
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Limit must be between 1 and {}".format(MAX_PAGE_SIZE))
+    by_price = min_price is not None or max_price is not None
+    try:
+        after = decode_cursor(cursor, by_price)
+    except ValueError:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+    items, next_key = get_storage().query_products(
+        seller=seller, in_stock=in_stock, after=after, limit=limit,
+        min_price_in_cents=price_in_cents(min_price, "min_price") if min_price is not None else None,
+        max_price_in_cents=price_in_cents(max_price, "max_price") if max_price is not None else None)
+    return {"items": items, "next_cursor": encode_cursor(next_key)}
+
+# JSON of GET /products/all and GET /products/{product_id}, served from the response cache
+def catalog_body():
+    return PRODUCT_LIST.dump_json(get_storage().list_products())
+
+def product_body(product_id):
+    product = get_storage().get_product(product_id)
+    return None if product is None else product.model_dump_json().encode()
+
+@product_router.get("/products/all", response_model=List[Product]) #created for testing/debugging purposes, format=ndjson streams a full export
+async def read_products(format: str = "json", if_none_match: Annotated[Optional[str], Header()] = None):
+    if format == "ndjson":
+        return StreamingResponse(product_lines(get_storage()), media_type="application/x-ndjson")
+    if format != "json":
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Format must be json or ndjson")
+    return json_response(cached_body(ALL_PRODUCTS, catalog_body), if_none_match)
+
+@product_router.get("/products/export")
+async def export_products(format: str = "csv", seller: Optional[str] = None):
+    if format not in FORMATS:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Format must be csv or ndjson")
+    if format == "csv":
+        return StreamingResponse(export_csv(get_storage(), EXPORT_PAGE_SIZE, seller=seller), media_type="text/csv")
+    return StreamingResponse(product_lines(get_storage(), seller=seller), media_type="application/x-ndjson")
 
 @product_router.get("/products/{product_id}", response_model=Product)
-async def read_product(product_id: int):
-    if product_id not in products_db:
+async def read_product(product_id: StorableInt, if_none_match: Annotated[Optional[str], Header()] = None):
+    entry = cached_body(product_id, lambda: product_body(product_id))
+    if entry is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Product not found")
-    return products_db[product_id]
+    return json_response(entry, if_none_match)
 
 #UPDATE
 @product_router.put("/products/{product_id}", response_model=Product)
-async def update_product(product_id: int, name: str, price: float, quantity: int, current_user: User = Depends(get_current_user)):
-    if product_id not in products_db:
+async def update_product(product_id: StorableInt, name: str, price: Decimal, quantity: StorableInt, current_user: User = Depends(get_current_user)):
+    storage = get_storage()
+    product = storage.get_product(product_id)
+    if product is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Product not found")
-    if products_db[product_id].seller != current_user.username:
+    if product.seller != current_user.username:
         raise HTTPException(status.HTTP_401_UNAUTHORIZED, detail="User is not seller of productId: {}".format(product_id))
 
-    products_db[product_id].name = name
-    products_db[product_id].price = price
-    products_db[product_id].quantity = quantity
+    if price <= 0:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Price must be greater than 0")
+    cents = price_in_cents(price)
+    if not is_whole_cents(price):
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Price must be a whole number of cents")
+    if quantity < 0:  # 0 takes the product out of stock
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Quantity must not be negative")
+
+    previous = product.quantity
+    product.name = name
+    product.price_in_cents = cents
+    product.quantity = quantity
+    storage.save_product(product)
+    invalidate_products((product_id,))
+    await storage.sync()
+    if quantity != previous:
+        publish_stock(product_id, product.seller, quantity, previous)
 
-    return products_db[product_id]
+    return product
 
 #DELETE
-@product_router.delete("/products/{product_id}")
-async def delete_product(product_id: int, current_user: User = Depends(get_current_user)):
-    if product_id not in products_db:
+@product_router.delete("/products/{product_id}", response_model=Message)
+async def delete_product(product_id: StorableInt, current_user: User = Depends(get_current_user)):
+    storage = get_storage()
+    product = storage.get_product(product_id)
+    if product is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Product not found")
-    if products_db[product_id].seller != current_user.username:
+    if product.seller != current_user.username:
         raise HTTPException(status.HTTP_401_UNAUTHORIZED, detail="User is not seller of productId: {}".format(product_id))
-    
-    del products_db[product_id]
+
+    storage.delete_product(product_id)
+    invalidate_products((product_id,))
+    await storage.sync()
+    publish_stock(product_id, product.seller, None, product.quantity)
     return {"message": "ProductId {} was deleted".format(product_id)}
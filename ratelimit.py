@@ -0,0 +1,209 @@
+# TOKEN BUCKET RATE LIMITING PER USER AND PER CLIENT IP
+# Every limited route has a bucket per username and/or per client address: it holds up to `burst` tokens, refills at
+# `rate` tokens per second and a request takes one. Auth failures only spend a token when a check fails, per username
+# and client address, and once that budget is gone attempts that would run bcrypt are answered with 429 (see
+# user_operations.get_current_user).
+#
+# Buckets live in this process (memory://) or, for several workers, in a SQLite file shared by all of them
+# (RATE_LIMIT_STORAGE_URL=sqlite:///path/to/file.db).
+
+import math
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from fastapi import HTTPException, status
+
+import settings
+from metrics import CallbackCounter, CallbackGauge, RATE_LIMITED
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600}
+
+# "20/minute" -> (rate per second, burst), an empty spec means no limit
+def parse_limit(spec):
+    if not spec or not spec.strip():
+        return None
+    count, _, period = spec.strip().partition("/")
+    if period not in PERIODS or int(count) <= 0:
+        raise ValueError("Invalid rate limit: {!r}, expected <count>/second|minute|hour".format(spec))
+    return int(count) / PERIODS[period], int(count)
+
+# Buckets of this process: a dict in least recently used order, so a check is one lookup plus a move to the end.
+# A bucket that has refilled completely is the same as a missing one, so idle buckets are dropped from the front as
+# checks come in, and the least recently used one goes when max_buckets is reached.
+class MemoryBuckets:
+    def __init__(self, max_buckets):
+        self.max_buckets = max_buckets
+        self.evictions = 0
+        self._buckets = OrderedDict()  # key -> [tokens, updated, full_at]
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    # takes cost tokens when at least max(cost, 1) are left, returns 0.0 or the seconds until there would be
+    def acquire(self, key, rate, burst, cost=1):
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if cost == 0:
+                    return 0.0  # a full bucket, nothing worth storing
+                tokens = burst
+                self._evict(now)
+            else:
+                tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                self._buckets.move_to_end(key)
+            need = max(cost, 1)
+            if tokens < need:
+                return (need - tokens) / rate
+            tokens -= cost
+            self._buckets[key] = [tokens, now, now + (burst - tokens) / rate]
+            return 0.0
+
+    def _evict(self, now):
+        for _ in range(2):  # a couple per new bucket keeps eviction O(1) and still outpaces insertion
+            if not self._buckets:
+                return
+            oldest = next(iter(self._buckets.values()))
+            if oldest[2] > now and len(self._buckets) < self.max_buckets:
+                return
+            self._buckets.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+    def close(self):
+        pass
+
+RATE_LIMIT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+) WITHOUT ROWID
+"""
+# refill, check and take in one statement: no row comes back when the bucket is short of :need tokens
+ACQUIRE_TOKENS = """
+INSERT INTO rate_limit_buckets (key, tokens, updated) VALUES (:key, :burst - :cost, :now)
+ON CONFLICT (key) DO UPDATE SET tokens = MIN(:burst, tokens + (:now - updated) * :rate) - :cost, updated = :now
+WHERE MIN(:burst, tokens + (:now - updated) * :rate) >= :need
+RETURNING tokens
+"""
+SELECT_TOKENS = "SELECT MIN(:burst, tokens + (:now - updated) * :rate) FROM rate_limit_buckets WHERE key = :key"
+DELETE_IDLE_BUCKETS = "DELETE FROM rate_limit_buckets WHERE updated < ?"
+
+# Buckets shared by every worker through a SQLite file, timed by the wall clock since processes do not share a
+# monotonic one. Buckets untouched for longer than max_idle_seconds (the slowest full refill) are deleted every
+# cleanup_every checks.
+class SQLiteBuckets:
+    def __init__(self, path, max_idle_seconds, cleanup_every=1000):
+        self.max_idle_seconds = max_idle_seconds
+        self.cleanup_every = cleanup_every
+        self.evictions = 0
+        self._checks = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(RATE_LIMIT_SCHEMA)
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM rate_limit_buckets").fetchone()[0]
+
+    def acquire(self, key, rate, burst, cost=1):
+        now = time.time()
+        params = {"key": key, "rate": rate, "burst": burst, "cost": cost, "need": max(cost, 1), "now": now}
+        with self._lock:
+            self._checks += 1
+            if self._checks % self.cleanup_every == 0:
+                self.evictions += self._conn.execute(DELETE_IDLE_BUCKETS, (now - self.max_idle_seconds,)).rowcount
+            if cost and self._conn.execute(ACQUIRE_TOKENS, params).fetchone() is not None:
+                return 0.0
+            row = self._conn.execute(SELECT_TOKENS, params).fetchone()
+        tokens = row[0] if row else burst
+        return 0.0 if tokens >= params["need"] else (params["need"] - tokens) / rate
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM rate_limit_buckets")
+
+    def close(self):
+        self._conn.close()
+
+# limits map route -> {"user": (rate, burst), "ip": (rate, burst), "user_ip": (rate, burst)}, a missing key kind is
+# not limited. user_ip is the pair, so a budget spent from one address leaves the user alone everywhere else
+class RateLimiter:
+    def __init__(self, limits, store, enabled=True):
+        self.limits = limits
+        self.store = store
+        self.enabled = enabled
+
+    def _acquire(self, route, user, ip, cost):
+        retry_after = 0.0
+        for kind, value in (("user", user), ("ip", ip), ("user_ip", None if user is None else "{}@{}".format(user, ip))):
+            limit = self.limits.get(route, {}).get(kind)
+            if limit is None or value is None:
+                continue
+            wait = self.store.acquire("{}:{}:{}".format(route, kind, value), limit[0], limit[1], cost)
+            if wait:
+                RATE_LIMITED.inc(route, kind)
+                retry_after = max(retry_after, wait)
+        return retry_after
+
+    def _reject(self, retry_after):
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many requests, retry later",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+
+    # takes a token from every bucket of the request, 429 when one of them is empty
+    def check(self, route, user=None, ip=None):
+        if self.enabled:
+            retry_after = self._acquire(route, user, ip, 1)
+            if retry_after:
+                self._reject(retry_after)
+
+    # 429 when a bucket has no token left, without taking one (see spend)
+    def check_budget(self, route, user=None, ip=None):
+        if self.enabled:
+            retry_after = self._acquire(route, user, ip, 0)
+            if retry_after:
+                self._reject(retry_after)
+
+    # takes a token after the fact, e.g. for a failed login
+    def spend(self, route, user=None, ip=None):
+        if self.enabled:
+            self._acquire(route, user, ip, 1)
+
+def client_ip(request):
+    return request.client.host if request is not None and request.client is not None else None
+
+LIMITS = {
+    "auth_failure": {"user_ip": parse_limit(settings.RATE_LIMIT_AUTH_FAILURES_PER_USER),
+                     "ip": parse_limit(settings.RATE_LIMIT_AUTH_FAILURES_PER_IP)},
+    "signup": {"ip": parse_limit(settings.RATE_LIMIT_SIGNUP_PER_IP)},
+    "buy": {"user": parse_limit(settings.RATE_LIMIT_BUY_PER_USER), "ip": parse_limit(settings.RATE_LIMIT_BUY_PER_IP)},
+    "deposit": {"user": parse_limit(settings.RATE_LIMIT_DEPOSIT_PER_USER), "ip": parse_limit(settings.RATE_LIMIT_DEPOSIT_PER_IP)},
+}
+
+# "memory://" or "sqlite:///path/to/file.db"
+def create_bucket_store(url, limits):
+    if url == "memory://":
+        return MemoryBuckets(settings.RATE_LIMIT_MAX_BUCKETS)
+    if url.startswith("sqlite:///"):
+        refills = [burst / rate for kinds in limits.values() for rate, burst in filter(None, kinds.values())]
+        return SQLiteBuckets(url[len("sqlite:///"):], max_idle_seconds=max(refills, default=3600))
+    raise ValueError("Unsupported RATE_LIMIT_STORAGE_URL: {}".format(url))
+
+rate_limiter = RateLimiter(LIMITS, create_bucket_store(settings.RATE_LIMIT_STORAGE_URL, LIMITS), enabled=settings.RATE_LIMIT_ENABLED)
+
+CallbackGauge("vending_rate_limit_buckets", "Rate limit buckets held", lambda: len(rate_limiter.store))
+CallbackCounter("vending_rate_limit_evictions_total", "Idle or least recently used rate limit buckets dropped",
+                lambda: rate_limiter.store.evictions)
@@ -0,0 +1,141 @@
+# PRE-SERIALIZED RESPONSE CACHE FOR PRODUCT READS
+# GET /products/{product_id} and GET /products/all keep their JSON body as bytes with an ETag, so a hit skips the
+# storage lookup, the model and the serialization, and a client sending the ETag back in If-None-Match gets a 304.
+# Writes invalidate precisely: the products they touched plus the full catalog (see invalidate_products).
+#
+# Invalidation is in-process, so the cache is only used when the storage engine is too (Storage.process_local:
+# memory:// and journal://). On a sqlite:// file shared with other processes, however they were started (WORKERS,
+# uvicorn --workers, gunicorn), a write handled by one of them would leave the others serving stale bodies.
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+from fastapi import Response
+
+import settings
+from metrics import CallbackCounter, CallbackGauge
+from storage import get_storage
+
+ALL_PRODUCTS = "all"  # key of the GET /products/all body, product ids are the other keys
+
+def make_etag(body):
+    return '"{}"'.format(hashlib.blake2b(body, digest_size=12).hexdigest())
+
+# If-None-Match holds "*" or a comma separated list of (possibly weak, W/"...") ETags
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+# Bounded LRU cache of response bodies, sized by the bytes it holds rather than by entries:
+# one full catalog weighs as much as thousands of single products. Bodies larger than max_bytes are not stored.
+class ResponseCache:
+    def __init__(self, max_bytes, enabled=True):
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = 0  # bytes of the cached bodies
+        self._entries = OrderedDict()  # key -> (body, etag)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    # returns the (body, etag) entry, cached when it fits
+    def put(self, key, body):
+        entry = (body, make_etag(body))
+        if not self.enabled or len(body) > self.max_bytes:
+            return entry
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = entry
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+        return entry
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[0])
+
+    def invalidate(self, keys):
+        with self._lock:
+            for key in keys:
+                self._remove(key)
+
+    def invalidate_all(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    @property
+    def hit_ratio(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "entries": len(self._entries), "bytes": self.size}
+
+product_cache = ResponseCache(
+    max_bytes=settings.PRODUCT_CACHE_MAX_BYTES,
+    enabled=settings.PRODUCT_CACHE_ENABLED,
+)
+
+def cache_used():
+    return product_cache.enabled and get_storage().process_local
+
+# cached (body, etag) of key, build() returns the body bytes or None when there is nothing to serve.
+# No await between build() and put(), so a write on the event loop cannot slip in between and get cached over
+def cached_body(key, build):
+    if not cache_used():
+        body = build()
+        return None if body is None else (body, make_etag(body))
+    entry = product_cache.get(key)
+    if entry is None:
+        body = build()
+        if body is None:
+            return None
+        entry = product_cache.put(key, body)
+    return entry
+
+def json_response(entry, if_none_match=None):
+    body, etag = entry
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(body, media_type="application/json", headers={"ETag": etag})
+
+# called by every handler that creates, changes (stock included) or deletes products
+def invalidate_products(product_ids):
+    product_cache.invalidate([*product_ids, ALL_PRODUCTS])
+
+CallbackCounter("vending_product_cache_hits_total", "Product reads answered from the response cache", lambda: product_cache.hits)
+CallbackCounter("vending_product_cache_misses_total", "Product reads that had to be serialized", lambda: product_cache.misses)
+CallbackGauge("vending_product_cache_hit_ratio", "Share of product reads answered from the response cache",
+              lambda: product_cache.hit_ratio)
+CallbackCounter("vending_product_cache_evictions_total", "Cached product responses evicted to stay under the size bound",
+                lambda: product_cache.evictions)
+CallbackGauge("vending_product_cache_bytes", "Bytes of cached product responses", lambda: product_cache.size)
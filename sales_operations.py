@@ -0,0 +1,70 @@
+# SALES STATS FOR SELLERS
+# Served from the running totals of the sales ledger (see ledger.py): a request costs one lookup plus the buckets it
+# returns, however many sales the ledger holds
+
+import time
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Depends, status
+import settings
+from models import User, SalesStats, ProductSales, StorableInt, format_cents
+from user_operations import get_current_user
+from storage import get_storage
+from ledger import bucket_of
+from metrics import timed_route_class
+
+sales_router = APIRouter(route_class=timed_route_class("sales"))
+DEFAULT_BUCKETS = 24  # without since, the last 24 buckets (a day of hourly buckets)
+MAX_BUCKETS = 1000
+
+# since/until are seconds since the epoch, the response lists the buckets starting in [bucket_of(since), until)
+def bucket_range(since, until):
+    width = settings.SALES_BUCKET_SECONDS
+    if until is None:
+        until = int(time.time()) + 1
+    since = bucket_of(until - 1) - (DEFAULT_BUCKETS - 1) * width if since is None else bucket_of(since)
+    if since >= until:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="since must be before until")
+    if (until - since) > MAX_BUCKETS * width:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Range must cover at most {} buckets".format(MAX_BUCKETS))
+    return since, until
+
+def stats_response(totals, since, until):
+    seller, sales, units, revenue_in_cents, buckets = totals
+    return {"seller": seller,
+            "sales": sales,
+            "units_sold": units,
+            "revenue_in_cents": revenue_in_cents,
+            "revenue": format_cents(revenue_in_cents),
+            "bucket_seconds": settings.SALES_BUCKET_SECONDS,
+            "since": since,
+            "until": until,
+            "buckets": [{"start": start, "sales": bucket_sales, "units_sold": bucket_units, "revenue_in_cents": bucket_revenue}
+                        for start, bucket_sales, bucket_units, bucket_revenue in buckets]}
+
+# Revenue and units of a seller, overall and per bucket
+@sales_router.get("/sellers/{username}/stats", response_model=SalesStats)
+async def read_seller_stats(username: str, since: Optional[StorableInt] = None, until: Optional[StorableInt] = None,
+                            current_user: User = Depends(get_current_user)):
+    if current_user.username != username:
+        raise HTTPException(status.HTTP_401_UNAUTHORIZED, detail="Cannot access other seller's stats")
+    since, until = bucket_range(since, until)
+    totals = get_storage().sales_totals("seller", username, since, until)
+    return stats_response(totals or (username, 0, 0, 0, []), since, until)
+
+# Revenue and units of a product, only for its seller. Sales of a deleted product stay readable
+@sales_router.get("/products/{product_id}/sales", response_model=ProductSales)
+async def read_product_sales(product_id: StorableInt, since: Optional[StorableInt] = None, until: Optional[StorableInt] = None,
+                             current_user: User = Depends(get_current_user)):
+    since, until = bucket_range(since, until)
+    storage = get_storage()
+    totals = storage.sales_totals("product", product_id, since, until)
+    # no sales yet, or only sales of a previous seller of a reused id: the current product's seller sees zeros
+    if totals is None or totals[0] != current_user.username:
+        product = storage.get_product(product_id)
+        if product is None and totals is None:
+            raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Product not found")
+        if product is not None and product.seller == current_user.username:
+            totals = (product.seller, 0, 0, 0, [])
+    if totals[0] != current_user.username:
+        raise HTTPException(status.HTTP_401_UNAUTHORIZED, detail="User is not seller of productId: {}".format(product_id))
+    return {"product_id": product_id, **stats_response(totals, since, until)}
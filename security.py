@@ -1,9 +1,190 @@
-import bcrypt
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-def hash_password(password):
-    salt = bcrypt.gensalt()
+from fastapi import HTTPException, status
+
+import settings
+from metrics import STAGE_SECONDS, CallbackCounter, CallbackGauge
+
+# bcrypt module, imported by load_bcrypt: at import time, or on first use with LAZY_STARTUP
+bcrypt = None
+
+def load_bcrypt():
+    global bcrypt
+    if bcrypt is None:
+        import bcrypt as module
+        bcrypt = module
+    return bcrypt
+
+def hash_password(password, rounds=None):
+    bcrypt = load_bcrypt()
+    salt = bcrypt.gensalt(rounds=rounds or settings.BCRYPT_ROUNDS)
     hashed_password = bcrypt.hashpw(password.encode("utf-8"), salt)
     return hashed_password.decode("utf-8")
 
 def verify_password(plain_password, hashed_password):
-    return bcrypt.checkpw(plain_password.encode("utf-8"), hashed_password.encode("utf-8"))
+    return load_bcrypt().checkpw(plain_password.encode("utf-8"), hashed_password.encode("utf-8"))
+
+# Bounded worker pool for bcrypt so hashing never runs on the event loop.
+# Jobs beyond max_pending (queued + running) are rejected with 503 instead of piling up.
+class HashingPool:
+    def __init__(self, kind, workers, max_pending, retry_after_seconds=1):
+        if kind not in ("thread", "process"):
+            raise ValueError("Unknown security pool kind: {}".format(kind))
+        self.kind = kind
+        self.workers = workers
+        self.max_pending = max_pending
+        self.retry_after_seconds = retry_after_seconds
+        self.pending = 0
+        self.rejected = 0
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        return self._executor
+
+    async def run(self, fn, *args):
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Server is busy, try again later",
+                    headers={"Retry-After": str(self.retry_after_seconds)},
+                )
+            self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+if not settings.LAZY_STARTUP:
+    load_bcrypt()
+
+hashing_pool = HashingPool(
+    kind=settings.SECURITY_POOL_KIND,
+    workers=settings.SECURITY_POOL_WORKERS,
+    max_pending=settings.SECURITY_POOL_MAX_PENDING,
+    retry_after_seconds=settings.SECURITY_POOL_RETRY_AFTER_SECONDS,
+)
+
+# run on the pool by the startup warm-up (main.prewarm): starts its workers and imports bcrypt there
+def warm_up():
+    load_bcrypt()
+
+async def hash_password_async(password):
+    with STAGE_SECONDS.time("hash_password"):
+        return await hashing_pool.run(hash_password, password, settings.BCRYPT_ROUNDS)
+
+async def verify_password_async(plain_password, hashed_password):
+    with STAGE_SECONDS.time("verify_password"):
+        return await hashing_pool.run(verify_password, plain_password, hashed_password)
+
+# Bounded LRU cache of credentials that already passed bcrypt.
+# Entries are keyed by a keyed blake2b digest of username + password (the plain password is never stored)
+# and remember the hash they were verified against, so a changed hash is always a miss.
+class CredentialCache:
+    def __init__(self, max_entries, ttl_seconds, enabled=True):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._key = os.urandom(32)  # per-process secret, digests are useless outside this process
+        self._entries = OrderedDict()  # digest -> (username, hashed_password, expires_at)
+        self._digests_by_user = {}  # username -> set of digests, used for invalidation
+        self._lock = threading.Lock()
+
+    def _digest(self, username, password):
+        data = "{}:{}{}".format(len(username), username, password).encode("utf-8")
+        return hashlib.blake2b(data, key=self._key, digest_size=16).digest()
+
+    def _remove(self, digest):
+        username, _, _ = self._entries.pop(digest)
+        digests = self._digests_by_user.get(username)
+        if digests is not None:
+            digests.discard(digest)
+            if not digests:
+                del self._digests_by_user[username]
+
+    def _lookup(self, digest, hashed_password):
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None:
+                if entry[1] == hashed_password and entry[2] > time.monotonic():
+                    self._entries.move_to_end(digest)
+                    self.hits += 1
+                    return True
+                self._remove(digest)  # expired or verified against an older hash
+            self.misses += 1
+            return False
+
+    def _store(self, digest, username, hashed_password):
+        with self._lock:
+            if digest in self._entries:
+                self._remove(digest)
+            self._entries[digest] = (username, hashed_password, time.monotonic() + self.ttl_seconds)
+            self._digests_by_user.setdefault(username, set()).add(digest)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    # True when the credentials were verified recently, without running bcrypt
+    def cached(self, username, password, hashed_password):
+        return self.enabled and self._lookup(self._digest(username, password), hashed_password)
+
+    # a miss is checked on the hashing pool and only successful verifications are cached, bcrypt runs outside the
+    # lock. lookup=False skips the cache, after cached()
+    async def verify_async(self, username, password, hashed_password, lookup=True):
+        if not self.enabled:
+            return await verify_password_async(password, hashed_password)
+        digest = self._digest(username, password)
+        if lookup and self._lookup(digest, hashed_password):
+            return True
+        if not await verify_password_async(password, hashed_password):
+            return False
+        self._store(digest, username, hashed_password)
+        return True
+
+    # drop every cached credential of a user (deleted user, changed password)
+    def invalidate(self, username):
+        with self._lock:
+            for digest in list(self._digests_by_user.get(username, ())):
+                self._remove(digest)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._digests_by_user.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+credential_cache = CredentialCache(
+    max_entries=settings.CREDENTIAL_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.CREDENTIAL_CACHE_TTL_SECONDS,
+    enabled=settings.CREDENTIAL_CACHE_ENABLED,
+)
+
+CallbackGauge("vending_hashing_pool_pending", "bcrypt jobs queued or running", lambda: hashing_pool.pending)
+CallbackCounter("vending_hashing_pool_rejected_total", "bcrypt jobs rejected with 503", lambda: hashing_pool.rejected)
+CallbackCounter("vending_credential_cache_hits_total", "Credential checks answered by the cache", lambda: credential_cache.hits)
+CallbackCounter("vending_credential_cache_misses_total", "Credential checks that needed bcrypt", lambda: credential_cache.misses)
@@ -0,0 +1,116 @@
+# DEPLOYMENT SETTINGS
+# every value can be overridden through an environment variable of the same name
+
+import os
+
+def _env_bool(name, default):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+def _env_float(name, default):
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+# cache of successfully verified Basic credentials (see security.CredentialCache)
+CREDENTIAL_CACHE_ENABLED = _env_bool("CREDENTIAL_CACHE_ENABLED", True)
+CREDENTIAL_CACHE_MAX_ENTRIES = _env_int("CREDENTIAL_CACHE_MAX_ENTRIES", 10000)
+CREDENTIAL_CACHE_TTL_SECONDS = _env_float("CREDENTIAL_CACHE_TTL_SECONDS", 300.0)
+
+# bcrypt cost factor used for new password hashes (existing hashes keep their own cost)
+BCRYPT_ROUNDS = _env_int("BCRYPT_ROUNDS", 12)
+
+# worker pool that runs bcrypt off the event loop (see security.HashingPool)
+SECURITY_POOL_KIND = os.environ.get("SECURITY_POOL_KIND", "thread")  # "thread" or "process"
+SECURITY_POOL_WORKERS = _env_int("SECURITY_POOL_WORKERS", min(32, (os.cpu_count() or 1) + 4))
+SECURITY_POOL_MAX_PENDING = _env_int("SECURITY_POOL_MAX_PENDING", 256)  # queued + running jobs before 503
+SECURITY_POOL_RETRY_AFTER_SECONDS = _env_int("SECURITY_POOL_RETRY_AFTER_SECONDS", 1)
+
+# storage engine: "memory://" (single process), "sqlite:///path/to/file.db" or "journal:///path/to/dir" (see storage.py)
+STORAGE_URL = os.environ.get("STORAGE_URL", "memory://")
+SQLITE_POOL_SIZE = _env_int("SQLITE_POOL_SIZE", 4)
+
+# per-route request counts, in-flight gauges and latency histograms on GET /metrics
+# (stage timers and business counters are always collected)
+METRICS_ENABLED = _env_bool("METRICS_ENABLED", True)
+
+# JSON responses serialized straight from the endpoint results by their response models, without FastAPI validating
+# them first (see fastjson.py)
+FAST_JSON = _env_bool("FAST_JSON", True)
+
+# POST /products/bulk: rows validated and written per chunk, and how many failed rows the report lists
+BULK_CHUNK_ROWS = _env_int("BULK_CHUNK_ROWS", 5000)
+BULK_MAX_REPORTED_ERRORS = _env_int("BULK_MAX_REPORTED_ERRORS", 1000)
+
+# journal:// engine (see journal.py): fsync policy "always" (acknowledge after fsync, group committed),
+# "interval" (fsync every JOURNAL_FSYNC_INTERVAL_SECONDS) or "never", and records between snapshots
+JOURNAL_FSYNC = os.environ.get("JOURNAL_FSYNC", "interval")
+JOURNAL_FSYNC_INTERVAL_SECONDS = _env_float("JOURNAL_FSYNC_INTERVAL_SECONDS", 0.05)
+JOURNAL_SNAPSHOT_EVERY = _env_int("JOURNAL_SNAPSHOT_EVERY", 1000000)
+
+# memory:// and journal:// keep users and products as compact slotted rows and build models only for responses;
+# false stores the pydantic models themselves (more memory per row, no conversion on reads)
+MEMORY_COMPACT_ROWS = _env_bool("MEMORY_COMPACT_ROWS", True)
+
+# python main.py: uvicorn worker processes and where they listen, more than one worker needs STORAGE_URL=sqlite:///...
+WORKERS = _env_int("WORKERS", 1)
+HOST = os.environ.get("HOST", "127.0.0.1")
+PORT = _env_int("PORT", 8000)
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "info")
+
+# cold start (see main.py): include each router on the first request for its paths and import bcrypt on first use,
+# then open the storage engine and warm routers, the bcrypt pool and the catalog cache in the lifespan hook
+LAZY_STARTUP = _env_bool("LAZY_STARTUP", False)
+
+# response cache of GET /products/{product_id} and GET /products/all (see response_cache.py), bounded by the bytes
+# of the cached bodies; only used with the memory:// and journal:// engines since invalidation is per process
+PRODUCT_CACHE_ENABLED = _env_bool("PRODUCT_CACHE_ENABLED", True)
+PRODUCT_CACHE_MAX_BYTES = _env_int("PRODUCT_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+
+# token bucket rate limits (see ratelimit.py) as "<count>/second|minute|hour": bursts of count requests, refilled at
+# that rate; an empty value turns a limit off. Buckets are kept per worker (memory://) or shared by all workers
+# through a SQLite file (RATE_LIMIT_STORAGE_URL=sqlite:///path/to/file.db)
+RATE_LIMIT_ENABLED = _env_bool("RATE_LIMIT_ENABLED", True)
+RATE_LIMIT_STORAGE_URL = os.environ.get("RATE_LIMIT_STORAGE_URL", "memory://")
+RATE_LIMIT_MAX_BUCKETS = _env_int("RATE_LIMIT_MAX_BUCKETS", 100000)
+# auth failures are counted per username and client address pair (PER_USER) and per address alone (PER_IP), which
+# bounds the bcrypt runs of one address guessing across many usernames
+RATE_LIMIT_AUTH_FAILURES_PER_USER = os.environ.get("RATE_LIMIT_AUTH_FAILURES_PER_USER", "10/minute")
+RATE_LIMIT_AUTH_FAILURES_PER_IP = os.environ.get("RATE_LIMIT_AUTH_FAILURES_PER_IP", "300/minute")
+RATE_LIMIT_SIGNUP_PER_IP = os.environ.get("RATE_LIMIT_SIGNUP_PER_IP", "20/minute")
+RATE_LIMIT_BUY_PER_USER = os.environ.get("RATE_LIMIT_BUY_PER_USER", "20/second")
+RATE_LIMIT_BUY_PER_IP = os.environ.get("RATE_LIMIT_BUY_PER_IP", "")
+RATE_LIMIT_DEPOSIT_PER_USER = os.environ.get("RATE_LIMIT_DEPOSIT_PER_USER", "20/second")
+RATE_LIMIT_DEPOSIT_PER_IP = os.environ.get("RATE_LIMIT_DEPOSIT_PER_IP", "")
+
+# width of the time buckets of the sales aggregates (see ledger.py), the aggregates keep the width they were written with
+SALES_BUCKET_SECONDS = _env_int("SALES_BUCKET_SECONDS", 3600)
+
+# Idempotency-Key on POST /deposit, /buy and /buy/batch (see idempotency.py): responses kept per route, user and key
+# for IDEMPOTENCY_TTL_SECONDS, at most IDEMPOTENCY_MAX_ENTRIES of them. The store is per worker process
+IDEMPOTENCY_ENABLED = _env_bool("IDEMPOTENCY_ENABLED", True)
+IDEMPOTENCY_MAX_ENTRIES = _env_int("IDEMPOTENCY_MAX_ENTRIES", 100000)
+IDEMPOTENCY_TTL_SECONDS = _env_float("IDEMPOTENCY_TTL_SECONDS", 86400.0)
+
+# GET /events/inventory (see events.py): default low-stock threshold, per-subscriber queue bound and what happens when it
+# is full ("coalesce" keeps the latest change per product, "drop" drops the oldest event), subscribers per worker and
+# seconds between keepalive comments
+EVENTS_LOW_STOCK_THRESHOLD = _env_int("EVENTS_LOW_STOCK_THRESHOLD", 5)
+EVENTS_QUEUE_SIZE = _env_int("EVENTS_QUEUE_SIZE", 100)
+EVENTS_POLICY = os.environ.get("EVENTS_POLICY", "coalesce")
+EVENTS_MAX_SUBSCRIBERS = _env_int("EVENTS_MAX_SUBSCRIBERS", 10000)
+EVENTS_KEEPALIVE_SECONDS = _env_int("EVENTS_KEEPALIVE_SECONDS", 15)
+
+# admin balance jobs (see admin.py): usernames allowed on /admin (comma separated, none by default), users per chunk
+# and seconds between chunks, finished jobs kept for GET /admin/jobs. Schedules only run with WORKERS=1;
+# ADMIN_NIGHTLY_RESET_AT ("HH:MM" UTC) adds a daily reset of every balance
+ADMIN_USERS = frozenset(name.strip() for name in os.environ.get("ADMIN_USERS", "").split(",") if name.strip())
+ADMIN_JOB_CHUNK_SIZE = _env_int("ADMIN_JOB_CHUNK_SIZE", 1000)
+ADMIN_JOB_PAUSE_SECONDS = _env_float("ADMIN_JOB_PAUSE_SECONDS", 0.0)
+ADMIN_MAX_JOBS = _env_int("ADMIN_MAX_JOBS", 100)
+ADMIN_NIGHTLY_RESET_AT = os.environ.get("ADMIN_NIGHTLY_RESET_AT", "")
@@ -0,0 +1,84 @@
+# STARTUP PROFILE
+# Imports main in a fresh interpreter under `python -X importtime` and reports where the cold start goes:
+# the router modules (import and include_router, see main.RouterLoader), the modules of this repository and
+# the third-party packages, by the import time spent in them. importtime adds some overhead of its own.
+#
+#   python startup_profile.py               the default eager startup
+#   python startup_profile.py --lazy        LAZY_STARTUP=true, also loads the deferred routers to show what they cost
+#   python startup_profile.py --json
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# run in the child, prints the timings as one JSON line
+CHILD = """
+import json, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+main.app.state.routers.load_all(deferred=True)
+print(json.dumps({"import_main_seconds": imported - started, "routers": main.app.state.routers.timings}))
+"""
+
+def repo_modules():
+    return {name[:-3] for name in os.listdir(ROOT) if name.endswith(".py")}
+
+# "import time: self [us] | cumulative | imported package" lines, in the order imports finish
+def parse_importtime(stderr):
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        imports.append((name.strip(), int(self_us) / 1e6, int(cumulative_us) / 1e6))
+    return imports
+
+def profile(lazy):
+    env = dict(os.environ, LAZY_STARTUP="true" if lazy else "false")
+    child = subprocess.run([sys.executable, "-X", "importtime", "-c", CHILD], cwd=ROOT, env=env,
+                           capture_output=True, text=True, check=True)
+    result = json.loads(child.stdout.strip().splitlines()[-1])
+    ours = repo_modules()
+    modules, packages = [], {}
+    for name, self_seconds, cumulative_seconds in parse_importtime(child.stderr):
+        top = name.split(".")[0]
+        if top in ours:
+            modules.append({"module": name, "self_seconds": self_seconds, "cumulative_seconds": cumulative_seconds})
+        else:
+            packages[top] = packages.get(top, 0.0) + self_seconds
+    result["lazy"] = lazy
+    result["modules"] = sorted(modules, key=lambda m: m["self_seconds"], reverse=True)
+    result["packages"] = [{"package": name, "self_seconds": seconds}
+                          for name, seconds in sorted(packages.items(), key=lambda item: item[1], reverse=True)]
+    return result
+
+def print_report(result, top):
+    ms = lambda seconds: "{:9.1f}".format(seconds * 1000)
+    print("LAZY_STARTUP={}: import main {} ms".format(str(result["lazy"]).lower(), ms(result["import_main_seconds"]).strip()))
+    print("\n{:<24} {:>9} {:>10}".format("router module", "import ms", "include ms"))
+    for timing in result["routers"]:
+        print("{:<24} {}  {}  {}".format(timing["module"], ms(timing["import_seconds"]), ms(timing["include_seconds"]),
+                                        "deferred" if timing["deferred"] else "at import"))
+    print("\n{:<24} {:>9} {:>9}".format("module", "self ms", "total ms"))
+    for module in result["modules"][:top]:
+        print("{:<24} {} {}".format(module["module"], ms(module["self_seconds"]), ms(module["cumulative_seconds"])))
+    print("\n{:<24} {:>9}".format("package", "self ms"))
+    for package in result["packages"][:top]:
+        print("{:<24} {}".format(package["package"], ms(package["self_seconds"])))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lazy", action="store_true", help="profile with LAZY_STARTUP=true")
+    parser.add_argument("--top", type=int, default=15, help="modules and packages listed")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+    result = profile(args.lazy)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result, args.top)
@@ -0,0 +1,1221 @@
+# STORAGE BACKENDS FOR USERS AND PRODUCTS
+# routers talk to get_storage() instead of module level dicts, so the engine can be swapped per deployment
+
+import json
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left, bisect_right, insort
+from contextlib import contextmanager
+
+import settings
+from change import DENOMINATIONS, DENOMINATION_KEYS
+from models import User, Product, MAX_INTEGER
+from journal import Journal
+from ledger import SalesLedger, bucket_of
+
+# Raised by Storage.purchase_cart when a purchase is rejected, carries the HTTP status the router should answer with
+# and the product the rejection is about (None for buyer level failures)
+NOT_ENOUGH_STOCK = "Not enough products available"
+
+class PurchaseError(Exception):
+    def __init__(self, status_code, detail, product_id=None):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.product_id = product_id
+
+# cart lines are (product_id, quantity) pairs, repeated products are summed so stock is checked once per product
+def merge_lines(lines):
+    merged = {}
+    for product_id, quantity in lines:
+        merged[product_id] = merged.get(product_id, 0) + quantity
+    return merged
+
+# purchase rules shared by the engines, checked on the locked/transactional view of the products and buyer.
+# products maps every product id of the cart to its Product (or None), returns (cost per product, total cost)
+def check_cart(products, buyer, username, lines):
+    for product_id, quantity in lines:
+        if products[product_id] is None:
+            raise PurchaseError(404, "Product not found", product_id)
+        if quantity <= 0:
+            raise PurchaseError(400, "Quantity must be positive integer", product_id)
+
+    costs = {}
+    for product_id, quantity in merge_lines(lines).items():
+        product = products[product_id]
+        if product.quantity < quantity:
+            raise PurchaseError(400, NOT_ENOUGH_STOCK, product_id)
+        #Assumption: Seller of product won't buy their own product but is allowed to buy other user's products
+        if product.seller == username:
+            raise PurchaseError(400, "Seller can't buy their own products", product_id)
+        costs[product_id] = product.price_in_cents * quantity
+
+    if buyer is None:
+        raise PurchaseError(404, "User not found")
+    total_cost = sum(costs.values())
+    if buyer.balance_in_cents < total_cost:
+        raise PurchaseError(400, "Insufficient balance")
+    return costs, total_cost
+
+# new balance of a user in a bulk balance job (Storage.update_balances)
+def balance_after(mode, balance, amount):
+    if mode == "set":
+        return amount
+    if mode == "add":
+        return max(0, balance + amount)
+    if mode == "report":
+        return balance
+    raise ValueError("Unknown balance mode: {}".format(mode))
+
+# Interface every engine implements, an engine missing one of the abstract methods fails when it is constructed.
+# get_* return None for unknown keys, add_* return False when the key already exists.
+class Storage(ABC):
+    # True when only this process can change the data (memory://, journal://), so caches kept in the process stay
+    # valid; False when other processes share it (sqlite://)
+    process_local = False
+
+    # users
+    @abstractmethod
+    def get_user(self, username): ...
+    @abstractmethod
+    def add_user(self, user): ...
+    @abstractmethod
+    def add_users(self, users): ...
+    @abstractmethod
+    def save_user(self, user): ...
+    @abstractmethod
+    def delete_user(self, username): ...
+    @abstractmethod
+    def list_users(self): ...
+    @abstractmethod
+    def add_to_balance(self, username, amount): ...  # returns the new balance
+    @abstractmethod
+    def set_balance(self, username, amount): ...
+    # changes only the flag, so a deposit or purchase committed since the user was read keeps its balance
+    @abstractmethod
+    def set_seller(self, username, is_seller): ...  # False for an unknown username
+    # usernames in pages for the admin jobs (see admin.py), only sellers or only buyers with is_seller
+    @abstractmethod
+    def iter_username_pages(self, page_size=1000, is_seller=None): ...
+    # one chunk of a bulk balance job in one step: mode "set" sets every balance to amount, "add" adds amount (never
+    # below 0), "report" changes nothing. Unknown usernames and users not matching is_seller are skipped.
+    # returns (users matched, their balances before, their balances after), totals in cents
+    @abstractmethod
+    def update_balances(self, usernames, mode, amount=0, is_seller=None): ...
+
+    # coin inventory of the machine, coins map denomination -> count
+    @abstractmethod
+    def deposit(self, username, coins): ...  # credits the user and stores the coins, returns the new balance
+    @abstractmethod
+    def add_coins(self, coins): ...
+    @abstractmethod
+    def coin_inventory(self): ...
+
+    # atomically take every (product_id, quantity) line of a cart and charge the buyer, all or nothing.
+    # make_change(remaining_cents, coin_inventory) returns compute_change's dict: its coins leave the inventory
+    # and its "unpaid_cents" become the new balance.
+    # returns (cost per product, total_cost, change, stock) where stock maps each product id to its (seller, quantity)
+    # right after this purchase, read in the same step; raises PurchaseError
+    @abstractmethod
+    def purchase_cart(self, username, lines, make_change): ...
+
+    # single product shortcut of purchase_cart, returns (total_cost, change, stock)
+    def purchase(self, username, product_id, quantity, make_change):
+        _, total_cost, change, stock = self.purchase_cart(username, [(product_id, quantity)], make_change)
+        return total_cost, change, stock
+
+    # sales ledger (see ledger.py): purchase_cart appends one sale per product, a
+    # (sold_at, buyer, product_id, seller, quantity, revenue_in_cents) tuple, in the same step as the stock and balance
+    # changes and adds it to the running totals of its product and seller.
+    # sales_totals reads the totals of a "product" or "seller" key: (seller, sales, units, revenue_in_cents, buckets)
+    # with the (bucket_start, sales, units, revenue_in_cents) of the buckets starting in [since, until), None without sales
+    @abstractmethod
+    def sales_totals(self, kind, key, since, until): ...
+    @abstractmethod
+    def add_sales(self, sales): ...  # already validated sales (imports, benchmarks)
+    @abstractmethod
+    def iter_sales(self): ...  # (sale_id, sale) in ledger order
+
+    # products
+    @abstractmethod
+    def get_product(self, product_id): ...
+    @abstractmethod
+    def add_product(self, product): ...
+    @abstractmethod
+    def add_products(self, products): ...
+    @abstractmethod
+    def save_product(self, product): ...
+    # writes a chunk of one seller's products, inserting new ids and replacing existing ones in one step.
+    # ids owned by another seller are left alone and returned
+    @abstractmethod
+    def upsert_products(self, products, seller): ...
+    @abstractmethod
+    def delete_product(self, product_id): ...
+    @abstractmethod
+    def list_products(self): ...
+
+    # one page of the catalog, returns (products, next_after) where next_after is None on the last page.
+    # products are ordered by id, or by (price_in_cents, id) as soon as a price bound is given;
+    # after is the sort key of the last product of the previous page (an id, or a (price_in_cents, id) tuple)
+    @abstractmethod
+    def query_products(self, seller=None, min_price_in_cents=None, max_price_in_cents=None, in_stock=None, after=None, limit=50):
+        ...
+
+    # walks the whole (filtered) catalog page by page, so exports never hold it all in memory
+    def iter_product_pages(self, page_size=1000, **filters):
+        after = None
+        while True:
+            page, after = self.query_products(after=after, limit=page_size, **filters)
+            if page:
+                yield page
+            if after is None:
+                return
+
+    @abstractmethod
+    def clear(self): ...
+    def close(self): pass
+
+    # waits until the writes made so far are durable, for engines that acknowledge writes before that (journal://)
+    async def sync(self): pass
+
+def _remove_sorted(keys, key):
+    i = bisect_left(keys, key)
+    if i < len(keys) and keys[i] == key:
+        del keys[i]
+
+# sorted keys without the removed ones and with the added ones, one linear pass instead of a memmove per key
+def _merge_sorted(keys, removed, added):
+    if removed:
+        removed = set(removed)
+        keys = [key for key in keys if key not in removed]
+    if added:
+        added = sorted(added)
+        if keys and added[0] <= keys[-1]:
+            merged, start = [], 0
+            for key in added:  # copy the runs between insertion points as slices
+                end = bisect_left(keys, key, start)
+                merged += keys[start:end]
+                merged.append(key)
+                start = end
+            merged += keys[start:]
+            keys = merged
+        else:
+            keys.extend(added)  # keys past the end, e.g. an import of ascending ids
+    return keys
+
+# Compact rows of the in-memory tables. A pydantic model carries a __dict__, its fields-set bookkeeping and
+# validation machinery per instance; a slotted record holds just the fields, and seller names are interned so all
+# products of a seller share one string. Models are built from rows only when they leave the storage (get_*, list_*,
+# query_products); rows and models share attribute names, so the purchase rules and indexes read either.
+class UserRecord:
+    __slots__ = ("username", "password", "is_seller", "balance_in_cents")
+
+    def __init__(self, username, password, is_seller=False, balance_in_cents=0):
+        self.username = username
+        self.password = password
+        self.is_seller = is_seller
+        self.balance_in_cents = balance_in_cents
+
+    @classmethod
+    def from_model(cls, user):
+        return cls(user.username, user.password, user.is_seller, user.balance_in_cents)
+
+    def to_model(self):
+        return User.model_construct(username=self.username, password=self.password, is_seller=self.is_seller,
+                                    balance_in_cents=self.balance_in_cents)
+
+class ProductRecord:
+    __slots__ = ("id", "name", "price_in_cents", "quantity", "seller")
+
+    def __init__(self, id, name, price_in_cents, quantity, seller):
+        self.id = id
+        self.name = name
+        self.price_in_cents = price_in_cents
+        self.quantity = quantity
+        self.seller = sys.intern(seller)
+
+    @classmethod
+    def from_model(cls, product):
+        return cls(product.id, product.name, product.price_in_cents, product.quantity, product.seller)
+
+    def to_model(self):
+        return Product.model_construct(id=self.id, name=self.name, price_in_cents=self.price_in_cents,
+                                       quantity=self.quantity, seller=self.seller)
+
+# Users dict of UserRecord rows, models written to it are converted.
+# compact=False stores the models themselves (the layout before compact rows, kept for comparison)
+class UserTable(dict):
+    def __init__(self, compact=True):
+        super().__init__()
+        self.compact = compact
+
+    def row(self, user):
+        return UserRecord.from_model(user) if self.compact and not isinstance(user, UserRecord) else user
+
+    def make_row(self, username, password, is_seller, balance_in_cents):
+        if self.compact:
+            return UserRecord(username, password, is_seller, balance_in_cents)
+        return User.model_construct(username=username, password=password, is_seller=is_seller, balance_in_cents=balance_in_cents)
+
+    def model(self, row):
+        return row.to_model() if self.compact and row is not None else row
+
+    def __setitem__(self, username, user):
+        super().__setitem__(username, self.row(user))
+
+    def setdefault(self, username, user):
+        if username not in self:
+            self[username] = user
+        return self[username]
+
+# Products dict that keeps its secondary indexes in step with every write: sorted lists of all ids,
+# of in-stock ids, of ids per seller and of (price_in_cents, id) pairs.
+# A row changed in place has to be written back (table[id] = product) or passed to reindex().
+# Rows are ProductRecords like in UserTable, or the models themselves with compact=False.
+class ProductTable(dict):
+    def __init__(self, compact=True):
+        super().__init__()
+        self.compact = compact
+        self._reset_indexes()
+
+    def row(self, product):
+        return ProductRecord.from_model(product) if self.compact and not isinstance(product, ProductRecord) else product
+
+    def make_row(self, id, name, price_in_cents, quantity, seller):
+        if self.compact:
+            return ProductRecord(id, name, price_in_cents, quantity, seller)
+        return Product.model_construct(id=id, name=name, price_in_cents=price_in_cents, quantity=quantity, seller=seller)
+
+    def model(self, row):
+        return row.to_model() if self.compact and row is not None else row
+
+    def _reset_indexes(self):
+        self.ids = []
+        self.in_stock_ids = []
+        self.price_index = []
+        self.seller_index = {}
+        self._indexed = {}  # id -> (seller, price_in_cents, in_stock) as currently indexed
+
+    def _index(self, product):
+        entry = self._indexed[product.id] = (product.seller, product.price_in_cents, product.quantity > 0)
+        insort(self.ids, product.id)
+        insort(self.price_index, (product.price_in_cents, product.id))
+        insort(self.seller_index.setdefault(product.seller, []), product.id)
+        if entry[2]:
+            insort(self.in_stock_ids, product.id)
+
+    def _unindex(self, product_id):
+        seller, price, in_stock = self._indexed.pop(product_id)
+        _remove_sorted(self.ids, product_id)
+        _remove_sorted(self.price_index, (price, product_id))
+        seller_ids = self.seller_index[seller]
+        _remove_sorted(seller_ids, product_id)
+        if not seller_ids:
+            del self.seller_index[seller]
+        if in_stock:
+            _remove_sorted(self.in_stock_ids, product_id)
+
+    def reindex(self, product):
+        old = self._indexed.get(product.id)
+        if old is None:
+            return self._index(product)
+        new = (product.seller, product.price_in_cents, product.quantity > 0)
+        if old == new:
+            return
+        if old[:2] != new[:2]:
+            self._unindex(product.id)
+            return self._index(product)
+        # stock only: the purchase path
+        self._indexed[product.id] = new
+        if new[2]:
+            insort(self.in_stock_ids, product.id)
+        else:
+            _remove_sorted(self.in_stock_ids, product.id)
+
+    # bulk insert that sorts the indexes once instead of inserting into them one by one
+    def load(self, products):
+        for product in products:
+            if product.id not in self:
+                super().__setitem__(product.id, self.row(product))
+        self._reset_indexes()
+        for product in self.values():
+            self._indexed[product.id] = (product.seller, product.price_in_cents, product.quantity > 0)
+            self.seller_index.setdefault(product.seller, []).append(product.id)
+        self.ids = sorted(self._indexed)
+        self.in_stock_ids = [pid for pid in self.ids if self._indexed[pid][2]]
+        self.price_index = sorted((entry[1], pid) for pid, entry in self._indexed.items())
+        for seller_ids in self.seller_index.values():
+            seller_ids.sort()
+
+    # bulk write of existing and new products: index changes are collected and merged into each sorted list once
+    def update_many(self, products):
+        # product id -> (entry indexed before this chunk, last entry of the chunk), a chunk may repeat an id
+        entries = {}
+        for product in products:
+            product = self.row(product)
+            super().__setitem__(product.id, product)
+            new = (product.seller, product.price_in_cents, product.quantity > 0)
+            old = entries[product.id][0] if product.id in entries else self._indexed.get(product.id)
+            entries[product.id] = (old, new)
+            self._indexed[product.id] = new
+        changes = [(pid, old, new) for pid, (old, new) in entries.items() if old != new]
+        if not changes:
+            return
+
+        self.ids = _merge_sorted(self.ids, (), [pid for pid, old, _ in changes if old is None])
+        self.price_index = _merge_sorted(self.price_index,
+                                         [(old[1], pid) for pid, old, new in changes if old is not None and old[1] != new[1]],
+                                         [(new[1], pid) for pid, old, new in changes if old is None or old[1] != new[1]])
+        self.in_stock_ids = _merge_sorted(self.in_stock_ids,
+                                          [pid for pid, old, new in changes if old is not None and old[2] and not new[2]],
+                                          [pid for pid, old, new in changes if new[2] and (old is None or not old[2])])
+        by_seller = {}
+        for pid, old, new in changes:
+            if old is not None and old[0] != new[0]:
+                by_seller.setdefault(old[0], ([], []))[0].append(pid)
+            if old is None or old[0] != new[0]:
+                by_seller.setdefault(new[0], ([], []))[1].append(pid)
+        for seller, (removed, added) in by_seller.items():
+            seller_ids = _merge_sorted(self.seller_index.get(seller, []), removed, added)
+            if seller_ids:
+                self.seller_index[seller] = seller_ids
+            else:
+                self.seller_index.pop(seller, None)
+
+    def __setitem__(self, product_id, product):
+        product = self.row(product)
+        super().__setitem__(product_id, product)
+        self.reindex(product)
+
+    def __delitem__(self, product_id):
+        super().__delitem__(product_id)
+        self._unindex(product_id)
+
+    def pop(self, product_id, *default):
+        if product_id not in self:
+            return super().pop(product_id, *default)
+        product = super().pop(product_id)
+        self._unindex(product_id)
+        return product
+
+    def setdefault(self, product_id, product):
+        if product_id not in self:
+            self[product_id] = product
+        return self[product_id]
+
+    def clear(self):
+        super().clear()
+        self._reset_indexes()
+
+# journal effects (see journal.py): absolute post-states of one user, product or the coin inventory
+def _user_effect(user):
+    return ("u", user.username, user.password, user.is_seller, user.balance_in_cents)
+
+def _product_effect(product):
+    return ("p", product.id, product.name, product.price_in_cents, product.quantity, product.seller)
+
+# Current behaviour: dicts in process memory holding compact rows (see UserRecord), get_*/list_*/query_products
+# return fresh models, so a changed model has to be saved like with the SQLite engine.
+# Balance and stock changes hold striped per-product and per-user locks, always taken products first then
+# users, each group in ascending stripe order, then the coin lock, so concurrent purchases cannot deadlock.
+# lock_stripes=1 degrades to a single global lock.
+# With a journal every write appends its effects while it still holds the locks (see open_journaled_storage).
+class InMemoryStorage(Storage):
+    process_local = True
+
+    def __init__(self, lock_stripes=64, journal=None, compact=None):
+        compact = settings.MEMORY_COMPACT_ROWS if compact is None else compact
+        self.users = UserTable(compact)
+        self.products = ProductTable(compact)
+        self.coins = {coin: 0 for coin in DENOMINATIONS}
+        self.sales = SalesLedger()  # appended under the coin lock, so sale ids follow the journal order
+        self.journal = journal
+        self._coin_lock = threading.Lock()
+        self._product_locks = [threading.Lock() for _ in range(lock_stripes)]
+        self._user_locks = self._product_locks if lock_stripes == 1 else [threading.Lock() for _ in range(lock_stripes)]
+
+    def _coins_effect(self):
+        return ("c", [self.coins[coin] for coin in DENOMINATIONS])
+
+    @contextmanager
+    def _locked(self, product_ids=(), usernames=()):
+        locks = [self._product_locks[i] for i in sorted({hash(pid) % len(self._product_locks) for pid in product_ids})]
+        for i in sorted({hash(name) % len(self._user_locks) for name in usernames}):
+            if self._user_locks[i] not in locks:
+                locks.append(self._user_locks[i])
+        for lock in locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    def get_user(self, username):
+        return self.users.model(self.users.get(username))
+
+    def add_user(self, user):
+        with self._locked(usernames=(user.username,)):
+            if user.username in self.users:
+                return False
+            self.users[user.username] = user
+            if self.journal is not None:
+                self.journal.append((_user_effect(user),))
+        return True
+
+    def add_users(self, users):
+        for user in users:
+            self.add_user(user)
+
+    def save_user(self, user):
+        with self._locked(usernames=(user.username,)):
+            self.users[user.username] = user
+            if self.journal is not None:
+                self.journal.append((_user_effect(user),))
+
+    def delete_user(self, username):
+        with self._locked(usernames=(username,)):
+            deleted = self.users.pop(username, None) is not None
+            if deleted and self.journal is not None:
+                self.journal.append((("du", username),))
+        return deleted
+
+    def list_users(self):
+        return [self.users.model(user) for user in list(self.users.values())]
+
+    def add_to_balance(self, username, amount):
+        with self._locked(usernames=(username,)):
+            user = self.users.get(username)
+            if user is None:
+                return None
+            user.balance_in_cents += amount
+            if self.journal is not None:
+                self.journal.append((("b", username, user.balance_in_cents),))
+            return user.balance_in_cents
+
+    def set_balance(self, username, amount):
+        with self._locked(usernames=(username,)):
+            user = self.users.get(username)
+            if user is None:
+                return False
+            user.balance_in_cents = amount
+            if self.journal is not None:
+                self.journal.append((("b", username, amount),))
+            return True
+
+    def set_seller(self, username, is_seller):
+        with self._locked(usernames=(username,)):
+            user = self.users.get(username)
+            if user is None:
+                return False
+            user.is_seller = is_seller
+            if self.journal is not None:
+                self.journal.append((_user_effect(user),))
+            return True
+
+    # pages of a snapshot of the usernames, taken once so the walk costs nothing per page
+    def iter_username_pages(self, page_size=1000, is_seller=None):
+        usernames = list(self.users)
+        for start in range(0, len(usernames), page_size):
+            page = usernames[start:start + page_size]
+            if is_seller is not None:
+                page = [name for name in page if getattr(self.users.get(name), "is_seller", None) == is_seller]
+            if page:
+                yield page
+
+    def update_balances(self, usernames, mode, amount=0, is_seller=None):
+        matched, before, after, effects = 0, 0, 0, []
+        with self._locked(usernames=usernames):
+            for username in usernames:
+                user = self.users.get(username)
+                if user is None or (is_seller is not None and user.is_seller != is_seller):
+                    continue
+                balance = user.balance_in_cents
+                new_balance = balance_after(mode, balance, amount)
+                matched, before, after = matched + 1, before + balance, after + new_balance
+                if new_balance != balance:
+                    user.balance_in_cents = new_balance
+                    effects.append(("b", username, new_balance))
+            if effects and self.journal is not None:
+                self.journal.append(effects)
+        return matched, before, after
+
+    def deposit(self, username, coins):
+        with self._locked(usernames=(username,)), self._coin_lock:
+            user = self.users.get(username)
+            if user is None:
+                return None
+            for coin, count in coins.items():
+                self.coins[coin] += count
+                user.balance_in_cents += coin * count
+            if self.journal is not None:
+                self.journal.append((("b", username, user.balance_in_cents), self._coins_effect()))
+            return user.balance_in_cents
+
+    def add_coins(self, coins):
+        with self._coin_lock:
+            for coin, count in coins.items():
+                self.coins[coin] += count
+            if self.journal is not None:
+                self.journal.append((self._coins_effect(),))
+
+    def coin_inventory(self):
+        with self._coin_lock:
+            return dict(self.coins)
+
+    def purchase_cart(self, username, lines, make_change):
+        product_ids = merge_lines(lines)
+        with self._locked(product_ids, (username,)):
+            products = {product_id: self.products.get(product_id) for product_id in product_ids}
+            buyer = self.users.get(username)
+            costs, total_cost = check_cart(products, buyer, username, lines)
+            for product_id, quantity in product_ids.items():
+                products[product_id].quantity -= quantity
+                self.products.reindex(products[product_id])
+            with self._coin_lock:
+                change = make_change(buyer.balance_in_cents - total_cost, self.coins)
+                for coin, key in zip(DENOMINATIONS, DENOMINATION_KEYS):
+                    self.coins[coin] -= change["change_given"][key]
+                buyer.balance_in_cents = change["unpaid_cents"]
+                sold_at = time.time()
+                sales = [self._sale_effect(self.sales.append(sale), sale) for sale in
+                         [(sold_at, username, product_id, products[product_id].seller, quantity, costs[product_id])
+                          for product_id, quantity in product_ids.items()]]
+                if self.journal is not None:
+                    self.journal.append([("q", product_id, products[product_id].quantity) for product_id in product_ids]
+                                        + [("b", username, buyer.balance_in_cents), self._coins_effect()] + sales)
+            stock = {product_id: (products[product_id].seller, products[product_id].quantity) for product_id in product_ids}
+        return costs, total_cost, change, stock
+
+    def _sale_effect(self, sale_id, sale):
+        return ("s", sale_id, *sale)
+
+    def sales_totals(self, kind, key, since, until):
+        return self.sales.totals(kind, key, since, until)
+
+    def add_sales(self, sales):
+        with self._coin_lock:
+            effects = [self._sale_effect(self.sales.append(sale), sale) for sale in sales]
+            if self.journal is not None:
+                for i in range(0, len(effects), 1000):
+                    self.journal.append(effects[i:i + 1000])
+
+    def iter_sales(self):
+        for sale_id in range(len(self.sales)):
+            yield sale_id, self.sales.sale(sale_id)
+
+    def get_product(self, product_id):
+        return self.products.model(self.products.get(product_id))
+
+    def add_product(self, product):
+        with self._locked((product.id,)):
+            if product.id in self.products:
+                return False
+            self.products[product.id] = product
+            if self.journal is not None:
+                self.journal.append((_product_effect(product),))
+        return True
+
+    def add_products(self, products):
+        products = [product for product in products if product.id not in self.products]
+        self.products.load(products)
+        if self.journal is not None:
+            for i in range(0, len(products), 1000):
+                self.journal.append([_product_effect(product) for product in products[i:i + 1000]])
+
+    def save_product(self, product):
+        with self._locked((product.id,)):
+            self.products[product.id] = product
+            if self.journal is not None:
+                self.journal.append((_product_effect(product),))
+
+    def upsert_products(self, products, seller):
+        with self._locked({product.id for product in products}):
+            rejected = set()
+            for product in products:
+                current = self.products.get(product.id)
+                if current is not None and current.seller != seller:
+                    rejected.add(product.id)
+            accepted = [product for product in products if product.id not in rejected]
+            self.products.update_many(accepted)
+            if accepted and self.journal is not None:
+                self.journal.append([_product_effect(product) for product in accepted])
+        return rejected
+
+    def delete_product(self, product_id):
+        with self._locked((product_id,)):
+            deleted = self.products.pop(product_id, None) is not None
+            if deleted and self.journal is not None:
+                self.journal.append((("dp", product_id),))
+        return deleted
+
+    def list_products(self):
+        return [self.products.model(product) for product in list(self.products.values())]
+
+    def query_products(self, seller=None, min_price_in_cents=None, max_price_in_cents=None, in_stock=None, after=None, limit=50):
+        table = self.products
+        by_price = min_price_in_cents is not None or max_price_in_cents is not None
+        # walk the most selective index, the remaining filters are checked per product
+        if by_price:
+            keys = table.price_index
+            low = bisect_left(keys, (min_price_in_cents,)) if min_price_in_cents is not None else 0
+            high = bisect_right(keys, (max_price_in_cents, float("inf"))) if max_price_in_cents is not None else len(keys)
+            seller_ids = table.seller_index.get(seller, []) if seller is not None else None
+            if seller_ids is not None and len(seller_ids) < high - low:
+                # fewer products for this seller than in the price range: sort just those by price
+                keys = sorted((p.price_in_cents, p.id) for p in map(table.get, seller_ids) if p is not None)
+                low = bisect_left(keys, (min_price_in_cents,)) if min_price_in_cents is not None else 0
+            start = bisect_right(keys, after) if after is not None else low
+        else:
+            keys = table.seller_index.get(seller, []) if seller is not None else table.in_stock_ids if in_stock else table.ids
+            start = bisect_right(keys, after) if after is not None else 0
+
+        page = []
+        for i in range(start, len(keys)):
+            key = keys[i]
+            if by_price and max_price_in_cents is not None and key[0] > max_price_in_cents:
+                break
+            product = table.get(key[1] if by_price else key)
+            if product is None:
+                continue
+            if seller is not None and product.seller != seller:
+                continue
+            if in_stock is not None and (product.quantity > 0) != in_stock:
+                continue
+            if min_price_in_cents is not None and product.price_in_cents < min_price_in_cents:
+                continue
+            page.append(product)
+            if len(page) > limit:
+                break
+
+        if len(page) <= limit:
+            return [table.model(product) for product in page], None
+        last = page[limit - 1]
+        return [table.model(product) for product in page[:limit]], (last.price_in_cents, last.id) if by_price else last.id
+
+    def clear(self):
+        self.users.clear()
+        self.products.clear()
+        with self._coin_lock:
+            self.coins.update((coin, 0) for coin in DENOMINATIONS)
+            self.sales.clear()
+            if self.journal is not None:
+                self.journal.append((("clear",),))
+
+    async def sync(self):
+        if self.journal is not None:
+            await self.journal.wait_durable()
+
+    def close(self):
+        if self.journal is not None:
+            self.journal.close()
+
+    # recovery: effects from the journal are applied in order, a value missing here was deleted by a later record
+    def apply_effect(self, effect):
+        kind = effect[0]
+        if kind == "u":
+            self.users[effect[1]] = self.users.make_row(*effect[1:])
+        elif kind == "du":
+            self.users.pop(effect[1], None)
+        elif kind == "b":
+            user = self.users.get(effect[1])
+            if user is not None:
+                user.balance_in_cents = effect[2]
+        elif kind == "p":
+            self.products[effect[1]] = self.products.make_row(*effect[1:])
+        elif kind == "dp":
+            self.products.pop(effect[1], None)
+        elif kind == "q":
+            product = self.products.get(effect[1])
+            if product is not None:
+                product.quantity = effect[2]
+                self.products.reindex(product)
+        elif kind == "c":
+            self.coins.update(zip(DENOMINATIONS, effect[1]))
+        elif kind == "s":
+            self.sales.restore(effect[1], tuple(effect[2:]))
+        elif kind == "clear":
+            self.clear()
+        else:
+            raise ValueError("Unknown journal effect: {}".format(kind))
+
+    # snapshot effects are loaded in bulk, products through the table's one-pass index build
+    def load_snapshot(self, effects):
+        products = []
+        for effect in effects:
+            if effect[0] == "p":
+                products.append(self.products.make_row(*effect[1:]))
+            else:
+                self.apply_effect(effect)
+        self.products.load(products)
+
+    def snapshot_effects(self):
+        with self._coin_lock:
+            yield self._coins_effect()
+        for user in list(self.users.values()):
+            yield _user_effect(user)
+        for product in list(self.products.values()):
+            yield _product_effect(product)
+        for sale_id, sale in self.iter_sales():
+            yield self._sale_effect(sale_id, sale)
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    password TEXT NOT NULL,
+    is_seller INTEGER NOT NULL DEFAULT 0,
+    balance_in_cents INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS products (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    price_in_cents INTEGER NOT NULL,
+    quantity INTEGER NOT NULL,
+    seller TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS coins (
+    denomination INTEGER PRIMARY KEY,
+    count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS products_seller_id ON products (seller, id);
+CREATE INDEX IF NOT EXISTS products_price_id ON products (price_in_cents, id);
+CREATE TABLE IF NOT EXISTS sales (
+    id INTEGER PRIMARY KEY,
+    sold_at REAL NOT NULL,
+    buyer TEXT NOT NULL,
+    product_id INTEGER NOT NULL,
+    seller TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    revenue_in_cents INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS product_sales (
+    product_id INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    seller TEXT NOT NULL,
+    sales INTEGER NOT NULL,
+    units INTEGER NOT NULL,
+    revenue_in_cents INTEGER NOT NULL,
+    PRIMARY KEY (product_id, bucket)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS seller_sales (
+    seller TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    sales INTEGER NOT NULL,
+    units INTEGER NOT NULL,
+    revenue_in_cents INTEGER NOT NULL,
+    PRIMARY KEY (seller, bucket)
+) WITHOUT ROWID;
+"""
+
+# statements are module constants so sqlite3's per-connection statement cache reuses the prepared versions
+SELECT_USER = "SELECT username, password, is_seller, balance_in_cents FROM users WHERE username = ?"
+SELECT_USERS = "SELECT username, password, is_seller, balance_in_cents FROM users"
+INSERT_USER = "INSERT OR IGNORE INTO users (username, password, is_seller, balance_in_cents) VALUES (?, ?, ?, ?)"
+UPDATE_USER = "UPDATE users SET password = ?, is_seller = ?, balance_in_cents = ? WHERE username = ?"
+DELETE_USER = "DELETE FROM users WHERE username = ?"
+ADD_TO_BALANCE = "UPDATE users SET balance_in_cents = balance_in_cents + ? WHERE username = ?"
+SELECT_BALANCE = "SELECT balance_in_cents FROM users WHERE username = ?"
+SET_BALANCE = "UPDATE users SET balance_in_cents = ? WHERE username = ?"
+SET_SELLER = "UPDATE users SET is_seller = ? WHERE username = ?"
+SELECT_ROLE_AND_BALANCE = "SELECT is_seller, balance_in_cents FROM users WHERE username = ?"
+SELECT_USERNAMES = "SELECT username FROM users WHERE username > ? ORDER BY username LIMIT ?"
+SELECT_USERNAMES_BY_ROLE = "SELECT username FROM users WHERE username > ? AND is_seller = ? ORDER BY username LIMIT ?"
+SELECT_PRODUCT = "SELECT id, name, price_in_cents, quantity, seller FROM products WHERE id = ?"
+SELECT_PRODUCTS = "SELECT id, name, price_in_cents, quantity, seller FROM products ORDER BY id"
+INSERT_PRODUCT = "INSERT OR IGNORE INTO products (id, name, price_in_cents, quantity, seller) VALUES (?, ?, ?, ?, ?)"
+UPSERT_PRODUCT = """
+INSERT INTO products (id, name, price_in_cents, quantity, seller) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (id) DO UPDATE SET name = excluded.name, price_in_cents = excluded.price_in_cents, quantity = excluded.quantity
+WHERE products.seller = excluded.seller
+"""
+SELECT_FOREIGN_PRODUCT_IDS = "SELECT id FROM products WHERE seller != ? AND id IN (SELECT value FROM json_each(?))"
+UPDATE_PRODUCT = "UPDATE products SET name = ?, price_in_cents = ?, quantity = ?, seller = ? WHERE id = ?"
+DELETE_PRODUCT = "DELETE FROM products WHERE id = ?"
+INSERT_COIN = "INSERT OR IGNORE INTO coins (denomination, count) VALUES (?, 0)"
+SELECT_COINS = "SELECT denomination, count FROM coins"
+ADD_COINS = "UPDATE coins SET count = count + ? WHERE denomination = ?"
+# purchase guards: each is a single conditional update, RETURNING needs SQLite >= 3.35
+TAKE_STOCK = "UPDATE products SET quantity = quantity - ? WHERE id = ? AND quantity >= ? AND seller != ? RETURNING price_in_cents, seller, quantity"
+CHARGE_BALANCE = "UPDATE users SET balance_in_cents = balance_in_cents - ? WHERE username = ? AND balance_in_cents >= ? RETURNING balance_in_cents"
+# sales ledger and its running totals, updated in the purchase transaction. TOTAL_BUCKET rows hold the all-time totals
+# of a product or seller, the other rows one bucket each (keyed by its start)
+TOTAL_BUCKET = -1
+INSERT_SALE = "INSERT INTO sales (sold_at, buyer, product_id, seller, quantity, revenue_in_cents) VALUES (?, ?, ?, ?, ?, ?)"
+ADD_PRODUCT_SALES = """
+INSERT INTO product_sales (product_id, bucket, seller, sales, units, revenue_in_cents) VALUES (?, ?, ?, 1, ?, ?)
+ON CONFLICT (product_id, bucket) DO UPDATE SET sales = sales + 1,
+units = units + excluded.units, revenue_in_cents = revenue_in_cents + excluded.revenue_in_cents
+"""
+# a deleted product id reused by another seller starts over, the previous seller's totals stay in seller_sales
+RESET_PRODUCT_SALES = "DELETE FROM product_sales WHERE product_id = ? AND seller != ?"
+ADD_SELLER_SALES = """
+INSERT INTO seller_sales (seller, bucket, sales, units, revenue_in_cents) VALUES (?, ?, 1, ?, ?)
+ON CONFLICT (seller, bucket) DO UPDATE SET sales = sales + 1,
+units = units + excluded.units, revenue_in_cents = revenue_in_cents + excluded.revenue_in_cents
+"""
+SELECT_PRODUCT_SALES = "SELECT seller, sales, units, revenue_in_cents FROM product_sales WHERE product_id = ? AND bucket = ?"
+SELECT_PRODUCT_SALES_BUCKETS = ("SELECT bucket, sales, units, revenue_in_cents FROM product_sales "
+                                "WHERE product_id = ? AND bucket >= ? AND bucket < ? ORDER BY bucket")
+SELECT_SELLER_SALES = "SELECT seller, sales, units, revenue_in_cents FROM seller_sales WHERE seller = ? AND bucket = ?"
+SELECT_SELLER_SALES_BUCKETS = ("SELECT bucket, sales, units, revenue_in_cents FROM seller_sales "
+                               "WHERE seller = ? AND bucket >= ? AND bucket < ? ORDER BY bucket")
+SELECT_SALES = "SELECT id, sold_at, buyer, product_id, seller, quantity, revenue_in_cents FROM sales WHERE id > ? ORDER BY id LIMIT ?"
+
+# rows come from our own writes, so models are built without re-validation
+def _user_from_row(row):
+    return User.model_construct(username=row[0], password=row[1], is_seller=bool(row[2]), balance_in_cents=row[3])
+
+def _product_from_row(row):
+    return Product.model_construct(id=row[0], name=row[1], price_in_cents=row[2], quantity=row[3], seller=row[4])
+
+# SQLite file in WAL mode, shared by every worker process that opens the same path.
+# Models are copies: callers must save_* after changing them.
+class SQLiteStorage(Storage):
+    def __init__(self, path, pool_size=4):
+        self.path = path
+        self._pool = queue.LifoQueue()
+        for _ in range(pool_size):
+            self._pool.put(self._connect())
+        with self._connection() as conn:
+            self._migrate_float_prices(conn)
+            conn.executescript(SQLITE_SCHEMA)
+            conn.executemany(INSERT_COIN, [(coin,) for coin in DENOMINATIONS])
+
+    # files written before money was integer cents have a REAL price column in dollars and may hold
+    # fractional balances, convert them in place (rounding half away from zero, like the API edge)
+    def _migrate_float_prices(self, conn):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(products)")}
+            if "price" in columns and "price_in_cents" not in columns:
+                conn.execute("DROP INDEX IF EXISTS products_price_id")
+                conn.execute("ALTER TABLE products ADD COLUMN price_in_cents INTEGER NOT NULL DEFAULT 0")
+                conn.execute("UPDATE products SET price_in_cents = CAST(ROUND(price * 100) AS INTEGER)")
+                conn.execute("ALTER TABLE products DROP COLUMN price")
+                conn.execute("UPDATE users SET balance_in_cents = CAST(ROUND(balance_in_cents) AS INTEGER) "
+                             "WHERE typeof(balance_in_cents) = 'real'")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _connect(self):
+        # isolation_level=None: autocommit, multi-statement work uses explicit BEGIN IMMEDIATE
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, cached_statements=256)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    @contextmanager
+    def _connection(self):
+        conn = self._pool.get()
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+    @contextmanager
+    def _transaction(self):
+        with self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def get_user(self, username):
+        with self._connection() as conn:
+            row = conn.execute(SELECT_USER, (username,)).fetchone()
+        return _user_from_row(row) if row else None
+
+    def add_user(self, user):
+        with self._connection() as conn:
+            cursor = conn.execute(INSERT_USER, (user.username, user.password, user.is_seller, user.balance_in_cents))
+        return cursor.rowcount == 1
+
+    def add_users(self, users):
+        rows = [(u.username, u.password, u.is_seller, u.balance_in_cents) for u in users]
+        with self._transaction() as conn:
+            conn.executemany(INSERT_USER, rows)
+
+    def save_user(self, user):
+        with self._connection() as conn:
+            conn.execute(UPDATE_USER, (user.password, user.is_seller, user.balance_in_cents, user.username))
+
+    def delete_user(self, username):
+        with self._connection() as conn:
+            return conn.execute(DELETE_USER, (username,)).rowcount == 1
+
+    def list_users(self):
+        with self._connection() as conn:
+            return [_user_from_row(row) for row in conn.execute(SELECT_USERS)]
+
+    def add_to_balance(self, username, amount):
+        with self._transaction() as conn:
+            if conn.execute(ADD_TO_BALANCE, (amount, username)).rowcount != 1:
+                return None
+            return conn.execute(SELECT_BALANCE, (username,)).fetchone()[0]
+
+    def set_balance(self, username, amount):
+        with self._connection() as conn:
+            return conn.execute(SET_BALANCE, (amount, username)).rowcount == 1
+
+    def set_seller(self, username, is_seller):
+        with self._connection() as conn:
+            return conn.execute(SET_SELLER, (is_seller, username)).rowcount == 1
+
+    # keyset pages over the primary key, a connection is only held while a page is read
+    def iter_username_pages(self, page_size=1000, is_seller=None):
+        query = SELECT_USERNAMES if is_seller is None else SELECT_USERNAMES_BY_ROLE
+        after = ""
+        while True:
+            params = (after, page_size) if is_seller is None else (after, is_seller, page_size)
+            with self._connection() as conn:
+                page = [row[0] for row in conn.execute(query, params)]
+            if page:
+                yield page
+            if len(page) < page_size:
+                return
+            after = page[-1]
+
+    def update_balances(self, usernames, mode, amount=0, is_seller=None):
+        matched, before, after, updates = 0, 0, 0, []
+        with self._transaction() as conn:
+            for username in usernames:
+                row = conn.execute(SELECT_ROLE_AND_BALANCE, (username,)).fetchone()
+                if row is None or (is_seller is not None and bool(row[0]) != is_seller):
+                    continue
+                new_balance = balance_after(mode, row[1], amount)
+                matched, before, after = matched + 1, before + row[1], after + new_balance
+                if new_balance != row[1]:
+                    updates.append((new_balance, username))
+            conn.executemany(SET_BALANCE, updates)
+        return matched, before, after
+
+    def purchase_cart(self, username, lines, make_change):
+        costs, stock = {}, {}
+        with self._transaction() as conn:
+            # every line must be positive, not only their sum per product
+            if any(quantity <= 0 for _, quantity in lines):
+                self._reject_purchase(conn, username, lines)
+            purchased = merge_lines(lines)
+            # lines summing past the largest INTEGER are more than any stock, and could not be bound
+            if any(quantity > MAX_INTEGER for quantity in purchased.values()):
+                self._reject_purchase(conn, username, lines)
+            for product_id, quantity in purchased.items():
+                row = conn.execute(TAKE_STOCK, (quantity, product_id, quantity, username)).fetchone()
+                if row is None:
+                    self._reject_purchase(conn, username, lines)
+                costs[product_id] = row[0] * quantity
+                stock[product_id] = (row[1], row[2])
+            total_cost = sum(costs.values())
+            # a cost past the largest INTEGER is more than any balance
+            row = None if total_cost > MAX_INTEGER else conn.execute(CHARGE_BALANCE, (total_cost, username, total_cost)).fetchone()
+            if row is None:
+                if conn.execute(SELECT_BALANCE, (username,)).fetchone() is None:
+                    raise PurchaseError(404, "User not found")
+                raise PurchaseError(400, "Insufficient balance")
+            change = make_change(row[0], dict(conn.execute(SELECT_COINS).fetchall()))
+            conn.executemany(ADD_COINS, [(-change["change_given"][key], coin)
+                                         for coin, key in zip(DENOMINATIONS, DENOMINATION_KEYS)])
+            conn.execute(SET_BALANCE, (change["unpaid_cents"], username))
+            sold_at = time.time()
+            self._record_sales(conn, [(sold_at, username, product_id, stock[product_id][0], quantity, costs[product_id])
+                                      for product_id, quantity in purchased.items()])
+        return costs, total_cost, change, stock
+
+    def _record_sales(self, conn, sales):
+        conn.executemany(INSERT_SALE, sales)
+        conn.executemany(RESET_PRODUCT_SALES, {(sale[2], sale[3]) for sale in sales})
+        product_rows, seller_rows = [], []
+        for sold_at, buyer, product_id, seller, quantity, revenue_in_cents in sales:
+            for bucket in (TOTAL_BUCKET, bucket_of(sold_at)):
+                product_rows.append((product_id, bucket, seller, quantity, revenue_in_cents))
+                seller_rows.append((seller, bucket, quantity, revenue_in_cents))
+        conn.executemany(ADD_PRODUCT_SALES, product_rows)
+        conn.executemany(ADD_SELLER_SALES, seller_rows)
+
+    def sales_totals(self, kind, key, since, until):
+        select, select_buckets = ((SELECT_PRODUCT_SALES, SELECT_PRODUCT_SALES_BUCKETS) if kind == "product"
+                                  else (SELECT_SELLER_SALES, SELECT_SELLER_SALES_BUCKETS))
+        with self._connection() as conn:
+            conn.execute("BEGIN")  # totals and buckets from one snapshot
+            try:
+                row = conn.execute(select, (key, TOTAL_BUCKET)).fetchone()
+                buckets = conn.execute(select_buckets, (key, max(since, 0), until)).fetchall() if row else None
+            finally:
+                conn.execute("COMMIT")
+        return None if row is None else (*row, buckets)
+
+    def add_sales(self, sales):
+        with self._transaction() as conn:
+            self._record_sales(conn, sales)
+
+    def iter_sales(self, page_size=10000):
+        after = 0
+        while True:
+            with self._connection() as conn:
+                rows = conn.execute(SELECT_SALES, (after, page_size)).fetchall()
+            for row in rows:
+                yield row[0], row[1:]
+            if len(rows) < page_size:
+                return
+            after = rows[-1][0]
+
+    def deposit(self, username, coins):
+        with self._transaction() as conn:
+            amount = sum(coin * count for coin, count in coins.items())
+            if conn.execute(ADD_TO_BALANCE, (amount, username)).rowcount != 1:
+                return None
+            conn.executemany(ADD_COINS, [(count, coin) for coin, count in coins.items()])
+            return conn.execute(SELECT_BALANCE, (username,)).fetchone()[0]
+
+    def add_coins(self, coins):
+        with self._transaction() as conn:
+            conn.executemany(ADD_COINS, [(count, coin) for coin, count in coins.items()])
+
+    def coin_inventory(self):
+        with self._connection() as conn:
+            return dict(conn.execute(SELECT_COINS).fetchall())
+
+    # a stock guard matched no row: roll back and re-read to report why
+    def _reject_purchase(self, conn, username, lines):
+        conn.execute("ROLLBACK")
+        conn.execute("BEGIN IMMEDIATE")  # _transaction rolls this one back when the error propagates
+        products = {}
+        for product_id in merge_lines(lines):
+            row = conn.execute(SELECT_PRODUCT, (product_id,)).fetchone()
+            products[product_id] = _product_from_row(row) if row else None
+        row = conn.execute(SELECT_USER, (username,)).fetchone()
+        check_cart(products, _user_from_row(row) if row else None, username, lines)
+        raise PurchaseError(409, "Purchase conflict, try again")
+
+    def get_product(self, product_id):
+        with self._connection() as conn:
+            row = conn.execute(SELECT_PRODUCT, (product_id,)).fetchone()
+        return _product_from_row(row) if row else None
+
+    def add_product(self, product):
+        with self._connection() as conn:
+            cursor = conn.execute(INSERT_PRODUCT, (product.id, product.name, product.price_in_cents, product.quantity, product.seller))
+        return cursor.rowcount == 1
+
+    def add_products(self, products):
+        rows = [(p.id, p.name, p.price_in_cents, p.quantity, p.seller) for p in products]
+        with self._transaction() as conn:
+            conn.executemany(INSERT_PRODUCT, rows)
+
+    def save_product(self, product):
+        with self._connection() as conn:
+            conn.execute(UPDATE_PRODUCT, (product.name, product.price_in_cents, product.quantity, product.seller, product.id))
+
+    def upsert_products(self, products, seller):
+        rows = [(p.id, p.name, p.price_in_cents, p.quantity, p.seller) for p in products]
+        with self._transaction() as conn:
+            ids = json.dumps([p.id for p in products])
+            rejected = {row[0] for row in conn.execute(SELECT_FOREIGN_PRODUCT_IDS, (seller, ids))}
+            conn.executemany(UPSERT_PRODUCT, rows)  # the WHERE clause skips the rejected rows
+        return rejected
+
+    def delete_product(self, product_id):
+        with self._connection() as conn:
+            return conn.execute(DELETE_PRODUCT, (product_id,)).rowcount == 1
+
+    def list_products(self):
+        with self._connection() as conn:
+            return [_product_from_row(row) for row in conn.execute(SELECT_PRODUCTS)]
+
+    def query_products(self, seller=None, min_price_in_cents=None, max_price_in_cents=None, in_stock=None, after=None, limit=50):
+        by_price = min_price_in_cents is not None or max_price_in_cents is not None
+        clauses, params = [], []
+        if seller is not None:
+            clauses.append("seller = ?")
+            params.append(seller)
+        if min_price_in_cents is not None:
+            clauses.append("price_in_cents >= ?")
+            params.append(min_price_in_cents)
+        if max_price_in_cents is not None:
+            clauses.append("price_in_cents <= ?")
+            params.append(max_price_in_cents)
+        if in_stock is not None:
+            clauses.append("quantity > 0" if in_stock else "quantity <= 0")
+        if after is not None:
+            clauses.append("(price_in_cents, id) > (?, ?)" if by_price else "id > ?")
+            params.extend(after if by_price else (after,))
+        # a handful of shapes only, so they still hit the statement cache
+        sql = "SELECT id, name, price_in_cents, quantity, seller FROM products{} ORDER BY {} LIMIT ?".format(
+            " WHERE " + " AND ".join(clauses) if clauses else "", "price_in_cents, id" if by_price else "id")
+        params.append(limit + 1)
+        with self._connection() as conn:
+            page = [_product_from_row(row) for row in conn.execute(sql, params)]
+
+        if len(page) <= limit:
+            return page, None
+        last = page[limit - 1]
+        return page[:limit], (last.price_in_cents, last.id) if by_price else last.id
+
+    def clear(self):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM users")
+            conn.execute("DELETE FROM products")
+            conn.execute("UPDATE coins SET count = 0")
+            conn.execute("DELETE FROM sales")
+            conn.execute("DELETE FROM product_sales")
+            conn.execute("DELETE FROM seller_sales")
+
+    def close(self):
+        while not self._pool.empty():
+            self._pool.get_nowait().close()
+
+memory_storage = InMemoryStorage()  # default engine, its tables are exposed as users_db / products_db
+
+# in-memory engine backed by the journal in directory: the state is recovered before the first write is accepted
+def open_journaled_storage(directory, fsync=None, fsync_interval=None, snapshot_every=None, lock_stripes=64, compact=None):
+    journal = Journal(directory,
+                      fsync=settings.JOURNAL_FSYNC if fsync is None else fsync,
+                      fsync_interval=settings.JOURNAL_FSYNC_INTERVAL_SECONDS if fsync_interval is None else fsync_interval,
+                      snapshot_every=settings.JOURNAL_SNAPSHOT_EVERY if snapshot_every is None else snapshot_every)
+    storage = InMemoryStorage(lock_stripes, compact=compact)
+    journal.recover(storage.apply_effect, storage.load_snapshot)
+    storage.journal = journal
+    journal.start(storage.snapshot_effects)
+    return storage
+
+# "memory://", "sqlite:///path/to/file.db" or "journal:///path/to/directory"
+def create_storage(url):
+    if url == "memory://":
+        return memory_storage
+    if url.startswith("sqlite:///"):
+        return SQLiteStorage(url[len("sqlite:///"):], pool_size=settings.SQLITE_POOL_SIZE)
+    if url.startswith("journal:///"):
+        return open_journaled_storage(url[len("journal:///"):])
+    raise ValueError("Unsupported STORAGE_URL: {}".format(url))
+
+# Run once before starting several worker processes (main.serve). Only sqlite:// is shared between processes,
+# memory:// and journal:// keep their state in the process that created it. The SQLite file is created and switched
+# to WAL here, instead of by every worker racing on a fresh file.
+def prepare_for_workers(url, workers):
+    if url.startswith("sqlite:///"):
+        create_storage(url).close()
+    elif workers > 1:
+        raise ValueError("STORAGE_URL={} keeps its state in one process, {} workers need "
+                         "STORAGE_URL=sqlite:///path/to/file.db".format(url, workers))
+
+_storage = None
+
+def get_storage():
+    global _storage
+    if _storage is None:
+        _storage = create_storage(settings.STORAGE_URL)
+    return _storage
+
+def set_storage(backend):
+    global _storage
+    _storage = backend
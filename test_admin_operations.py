@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+import settings
+from conftest import HASHED
+from models import User
+from user_operations import users_db
+from admin import ScheduledJob, scheduler, parse_daily_at
+
+ADMIN = ("admin", "pw")
+
+@pytest.fixture
+def client(client, monkeypatch):
+    monkeypatch.setattr(settings, "ADMIN_USERS", frozenset(["admin"]))
+    monkeypatch.setattr(settings, "ADMIN_JOB_CHUNK_SIZE", 3)
+    users_db["admin"] = User(username="admin", password=HASHED)
+    for i in range(8):
+        users_db["user{}".format(i)] = User(username="user{}".format(i), password=HASHED, is_seller=i < 2, balance_in_cents=100)
+    return client
+
+async def finished(client, job):
+    for _ in range(100):
+        job = (await client.get("/admin/jobs/{}".format(job["id"]), auth=ADMIN)).json()
+        if job["status"] != "running":
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError("job {} did not finish".format(job["id"]))
+
+# Test that only admins reach the admin routes
+@pytest.mark.asyncio
+async def test_admin_auth(client):
+    async with client:
+        users_db["user0"].password = HASHED
+        response = await client.post("/admin/balances", json={"action": "reset"}, auth=("user0", "pw"))
+        assert response.status_code == 401
+        assert (await client.get("/admin/jobs", auth=("admin", "wrong"))).status_code == 401
+        assert (await client.get("/admin/jobs", auth=ADMIN)).json() == []
+
+# Test chunked resets and adjustments by role and by username list, and the report totals
+@pytest.mark.asyncio
+async def test_balance_jobs(client):
+    async with client:
+        response = await client.post("/admin/balances", json={"action": "add", "amount": "-0.40", "users": "buyers"}, auth=ADMIN)
+        assert response.status_code == 202
+        job = await finished(client, response.json())
+        assert job["status"] == "done" and job["chunks"] == 3
+        assert (job["users_matched"], job["balance_before_in_cents"], job["balance_after_in_cents"]) == (7, 600, 360)
+        assert users_db["user0"].balance_in_cents == 100 and users_db["user5"].balance_in_cents == 60
+
+        response = await client.post("/admin/balances", json={"action": "reset", "usernames": ["user0", "user5", "nobody"]}, auth=ADMIN)
+        job = await finished(client, response.json())
+        assert (job["users_matched"], job["balance_after_in_cents"]) == (2, 0)
+        assert users_db["user0"].balance_in_cents == 0 and users_db["user1"].balance_in_cents == 100
+
+        job = await finished(client, (await client.post("/admin/balances", json={"action": "report"}, auth=ADMIN)).json())
+        assert (job["users_matched"], job["balance_before_in_cents"]) == (9, 400)
+        assert [job["action"] for job in (await client.get("/admin/jobs", auth=ADMIN)).json()] == ["add", "reset", "report"]
+
+        for body in ({"action": "set", "amount": "-1"}, {"action": "add", "amount": "0.001"}, {"action": "add", "amount": "1e30"}):
+            assert (await client.post("/admin/balances", json=body, auth=ADMIN)).status_code == 400
+        assert (await client.get("/admin/jobs/999", auth=ADMIN)).status_code == 404
+
+# Test that a schedule runs its job repeatedly until it is deleted
+@pytest.mark.asyncio
+async def test_schedules(client):
+    async with client:
+        for body in ({"action": "reset"}, {"action": "reset", "every_seconds": 1, "daily_at": "03:00"},
+                     {"action": "reset", "daily_at": "25:00"}):
+            assert (await client.put("/admin/schedules/bad", json=body, auth=ADMIN)).status_code == 400
+        response = await client.put("/admin/schedules/topup", json={"action": "add", "amount": "0.05", "users": "sellers",
+                                                                    "every_seconds": 0.02}, auth=ADMIN)
+        assert response.status_code == 200 and response.json()["every_seconds"] == 0.02
+        for _ in range(100):
+            if users_db["user0"].balance_in_cents >= 115:
+                break
+            await asyncio.sleep(0.01)
+        assert users_db["user0"].balance_in_cents >= 115 and users_db["user2"].balance_in_cents == 100
+        assert [schedule["name"] for schedule in (await client.get("/admin/schedules", auth=ADMIN)).json()] == ["topup"]
+        assert (await client.delete("/admin/schedules/topup", auth=ADMIN)).status_code == 200
+        assert (await client.delete("/admin/schedules/topup", auth=ADMIN)).status_code == 404
+        await scheduler.stop()
+
+def test_daily_schedule():
+    assert parse_daily_at("03:30") == 210
+    with pytest.raises(ValueError):
+        parse_daily_at("3:5")
+    schedule = ScheduledJob("nightly", "reset", "all", None, 0, daily_at=parse_daily_at("03:30"))
+    day = 1700006400  # a midnight UTC
+    assert schedule.following(day) == day + 210 * 60
+    assert schedule.following(day + 210 * 60) == day + 86400 + 210 * 60
+    assert schedule.to_dict()["daily_at"] == "03:30"
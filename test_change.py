@@ -0,0 +1,60 @@
+import itertools
+import random
+
+from change import DENOMINATIONS, compute_change, make_change, solve_bounded_change
+
+# reference implementation: one coin at a time
+def loop_change(amount):
+    change_in_coins = {str(coin): 0 for coin in DENOMINATIONS}
+    for coin in DENOMINATIONS:
+        while amount >= coin:
+            amount -= coin
+            change_in_coins[str(coin)] += 1
+    return {"change_given": change_in_coins, "unpaid_cents": amount}
+
+# reference implementation: every combination of the available coins
+def brute_force_paid(amount, available):
+    best = 0
+    for counts in itertools.product(*(range(available[coin] + 1) for coin in DENOMINATIONS)):
+        paid = sum(coin * count for coin, count in zip(DENOMINATIONS, counts))
+        if best < paid <= amount:
+            best = paid
+    return best
+
+def paid(change):
+    return sum(coin * change["change_given"][str(coin)] for coin in DENOMINATIONS)
+
+# Test compute_change against the coin by coin loop
+def test_compute_change_matches_loop():
+    rng = random.Random(7)
+    for amount in list(range(2000)) + [rng.randint(0, 10 ** 6) for _ in range(200)]:
+        assert compute_change(amount) == loop_change(amount)
+
+# Test make_change with a full machine behaves like compute_change
+def test_make_change_unbounded():
+    plenty = {coin: 10 ** 6 for coin in DENOMINATIONS}
+    for amount in range(0, 1000, 7):
+        assert make_change(amount, plenty) == compute_change(amount)
+
+# Property test: with short coins the paid amount is the best possible and never exceeds the inventory
+def test_make_change_bounded_against_brute_force():
+    rng = random.Random(11)
+    for _ in range(300):
+        available = {coin: rng.randint(0, 3) for coin in DENOMINATIONS}
+        amount = rng.randint(0, 400)
+        change = make_change(amount, available)
+        assert paid(change) == brute_force_paid(amount, available)
+        assert paid(change) + change["unpaid_cents"] == amount
+        assert all(change["change_given"][str(coin)] <= available[coin] for coin in DENOMINATIONS)
+
+# Test cases where greedy alone gets stuck
+def test_solve_bounded_change():
+    change = make_change(60, {100: 0, 50: 1, 20: 3, 10: 0, 5: 0})
+    assert change == {"change_given": {"100": 0, "50": 0, "20": 3, "10": 0, "5": 0}, "unpaid_cents": 0}
+
+    # dropping the 100 coin lets the smaller coins pay everything
+    change = solve_bounded_change(130, {100: 1, 50: 1, 20: 4, 10: 0, 5: 0})
+    assert change == {"change_given": {"100": 0, "50": 1, "20": 4, "10": 0, "5": 0}, "unpaid_cents": 0}
+
+    change = make_change(123, {coin: 0 for coin in DENOMINATIONS})
+    assert change["unpaid_cents"] == 123
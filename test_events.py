@@ -0,0 +1,112 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from conftest import HASHED
+from models import User, Product
+from events import InventoryEvent, Subscriber, EventBus, classify, event_bus, stream_inventory
+from user_operations import users_db
+from product_operations import products_db
+from vending_operations import coins_db
+
+@pytest.fixture
+def client(client):
+    users_db["seller"] = User(username="seller", password=HASHED, is_seller=True)
+    users_db["buyer"] = User(username="buyer", password=HASHED, balance_in_cents=10 ** 6)
+    products_db[1] = Product(id=1, name="Soda", price_in_cents=100, quantity=8, seller="seller")
+    coins_db.update({coin: 10 ** 4 for coin in coins_db})
+    return client
+
+def test_classify():
+    def kind(quantity, previous):
+        return classify(InventoryEvent(1, "s", quantity, previous), threshold=5)
+    assert kind(6, 9) == "stock"
+    assert kind(5, 6) == "low_stock"
+    assert kind(3, 4) == "stock"  # already low
+    assert kind(0, 3) == "out_of_stock"
+    assert kind(9, 0) == "restocked"
+    assert kind(2, None) == "low_stock"  # created with little stock
+    assert kind(None, 4) == "deleted"
+
+# Test that coalescing keeps the net change per product and that a full queue drops the oldest event
+@pytest.mark.asyncio
+async def test_subscriber_policies():
+    coalesce = Subscriber(None, threshold=5, policy="coalesce", max_queue=2)
+    for quantity, previous in ((7, 8), (4, 7), (3, 4)):
+        coalesce.offer(InventoryEvent(1, "s", quantity, previous))
+    assert len(coalesce) == 1
+    kind, event = await coalesce.get()
+    assert (kind, event.quantity, event.previous) == ("low_stock", 3, 8)
+    for product_id in (1, 2, 3):
+        coalesce.offer(InventoryEvent(product_id, "s", 9, 10))
+    assert coalesce.dropped == 1 and [(await coalesce.get())[1].product_id for _ in range(2)] == [2, 3]
+
+    drop = Subscriber(None, threshold=5, policy="drop", max_queue=2, alerts_only=True)
+    for quantity, previous in ((7, 8), (4, 7), (0, 4), (9, 0)):
+        drop.offer(InventoryEvent(1, "s", quantity, previous))
+    assert drop.dropped == 1
+    assert [(await drop.get())[0] for _ in range(2)] == ["out_of_stock", "restocked"]
+
+    # alerts_only with coalescing: a dip below the threshold and back is no alert at all
+    alerts = Subscriber(None, threshold=5, policy="coalesce", max_queue=2, alerts_only=True)
+    alerts.offer(InventoryEvent(1, "s", 4, 7))
+    alerts.offer(InventoryEvent(1, "s", 8, 4))
+    assert len(alerts) == 0
+
+def test_event_bus_routing():
+    bus = EventBus(max_subscribers=3)
+    everything, mine, other = bus.subscribe(), bus.subscribe("seller"), bus.subscribe("other")
+    assert bus.subscribe() is None
+    bus.publish(1, "seller", 4, 9)
+    assert (len(everything), len(mine), len(other)) == (1, 1, 0)
+    assert bus.wants("seller") and bus.wants("nobody")
+    bus.unsubscribe(everything)
+    bus.unsubscribe(everything)
+    assert len(bus) == 2 and not bus.wants("nobody")
+
+# Test that purchases, updates and deletes reach a seller's subscriber with the right meaning
+@pytest.mark.asyncio
+async def test_handlers_publish(client):
+    subscriber = event_bus.subscribe("seller", threshold=5)
+    bystander = event_bus.subscribe("other")
+    try:
+        async def next_event():
+            kind, event = await asyncio.wait_for(subscriber.get(), 1)
+            return kind, event.product_id, event.quantity
+        async with client:
+            await client.post("/buy", params={"product_id": 1, "quantity": 3}, auth=("buyer", "pw"))
+            assert await next_event() == ("low_stock", 1, 5)
+            users_db["buyer"].balance_in_cents = 10 ** 6
+            await client.post("/buy/batch", json=[{"product_id": 1, "quantity": 5}], auth=("buyer", "pw"))
+            assert await next_event() == ("out_of_stock", 1, 0)
+            await client.put("/products/1", params={"name": "Soda", "price": "1.00", "quantity": 20}, auth=("seller", "pw"))
+            assert await next_event() == ("restocked", 1, 20)
+            await client.post("/products/", params={"id": 2, "name": "Gum", "price": "0.50", "quantity": 2}, auth=("seller", "pw"))
+            await client.delete("/products/2", auth=("seller", "pw"))
+            # nobody read in between: the creation and the delete are coalesced
+            assert await next_event() == ("deleted", 2, None)
+            assert len(subscriber) == 0
+        assert len(bystander) == 0
+    finally:
+        event_bus.unsubscribe(subscriber)
+        event_bus.unsubscribe(bystander)
+
+# Test the SSE stream: subscribed on connect, events as they happen, unsubscribed when the client goes away
+@pytest.mark.asyncio
+async def test_inventory_stream():
+    with pytest.raises(HTTPException):
+        await stream_inventory(policy="newest")
+    subscribers = len(event_bus)
+    response = await stream_inventory(seller="seller", low_stock=2, policy="drop", queue_size=1)
+    assert response.media_type == "text/event-stream"
+    stream = response.body_iterator
+    assert await stream.__anext__() == ": subscribed\n\n"
+    assert len(event_bus) == subscribers + 1
+
+    event_bus.publish(1, "seller", 3, 4)
+    event_bus.publish(1, "seller", 2, 3)
+    assert await stream.__anext__() == 'event: dropped\ndata: {"count": 1}\n\n'
+    assert await asyncio.wait_for(stream.__anext__(), 1) == ('event: low_stock\ndata: {"type":"low_stock","product_id":1,'
+                                                             '"seller":"seller","quantity":2,"previous_quantity":3,"threshold":2}\n\n')
+    await stream.aclose()
+    assert len(event_bus) == subscribers
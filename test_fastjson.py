@@ -0,0 +1,74 @@
+import importlib
+
+import httpx
+import pytest
+from fastapi import APIRouter, FastAPI, Response
+from fastapi.routing import APIRoute
+import settings
+from main import ROUTERS, app
+from conftest import HASHED
+from models import User, Product, Message
+from fastjson import FastJSONRoute
+from user_operations import users_db
+from product_operations import products_db
+from vending_operations import coins_db
+
+def make_app(monkeypatch, fast):
+    monkeypatch.setattr(settings, "FAST_JSON", fast)
+    router = APIRouter(route_class=FastJSONRoute)
+
+    @router.get("/message", response_model=Message, status_code=201)
+    async def message():
+        return {"message": "hello", "internal": "not in the model"}
+
+    @router.get("/raw", response_model=Message)
+    async def raw():
+        return Response(b"raw", media_type="text/plain")
+
+    fast_app = FastAPI()
+    fast_app.include_router(router)
+    return fast_app
+
+@pytest.fixture
+def client(client):
+    coins_db.update({coin: 10 for coin in coins_db})
+    users_db["buyer"] = User(username="buyer", password=HASHED, balance_in_cents=500)
+    users_db["seller"] = User(username="seller", password=HASHED, is_seller=True)
+    for i in range(3):
+        products_db[i] = Product(id=i, name="Item {}".format(i), price_in_cents=35, quantity=10, seller="seller")
+    return client
+
+# Test that both paths render only the fields of the response model, with the route's status code,
+# and pass a Response through
+@pytest.mark.asyncio
+@pytest.mark.parametrize("fast", [True, False])
+async def test_rendering(monkeypatch, fast):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=make_app(monkeypatch, fast)), base_url="http://test") as client:
+        response = await client.get("/message")
+        assert response.status_code == 201 and response.json() == {"message": "hello"}
+        assert response.headers["content-type"] == "application/json"
+        response = await client.get("/raw")
+        assert response.text == "raw" and response.headers["content-type"].startswith("text/plain")
+
+# Test that every JSON route declares a response model, and that the wrapped endpoints keep their attributes
+def test_response_models():
+    routes = [route for module, router, _ in ROUTERS for route in getattr(importlib.import_module(module), router).routes
+              if isinstance(route, APIRoute)]
+    untyped = {route.path for route in routes if route.response_model is None}
+    assert untyped == {"/products/export", "/metrics", "/events/inventory"}  # text and streams
+    buy = next(route for route in routes if route.path == "/buy")
+    assert buy.endpoint.__wrapped__.__name__ == "buy_products" and buy.endpoint.idempotent
+    assert "PurchaseResult" in app.openapi()["components"]["schemas"]
+
+# Test the rendered bodies of the routes returning change, product pages and users
+@pytest.mark.asyncio
+async def test_bodies(client):
+    async with client:
+        response = await client.post("/buy", params={"product_id": 1, "quantity": 1}, auth=("buyer", "pw"))
+        assert response.json()["change"] == {"change_given": {"100": 4, "50": 1, "20": 0, "10": 1, "5": 1}, "unpaid_cents": 0}
+        page = (await client.get("/products/", params={"limit": 2})).json()
+        assert page["next_cursor"] == "1" and page["items"][1] == {
+            "id": 1, "name": "Item 1", "price_in_cents": 35, "quantity": 9, "seller": "seller", "price": "0.35"}
+        users = (await client.get("/users/")).json()
+        assert users == [{"username": "buyer", "is_seller": False, "balance_in_cents": 0},
+                         {"username": "seller", "is_seller": True, "balance_in_cents": 0}]
@@ -0,0 +1,97 @@
+import asyncio
+import base64
+
+import pytest
+import idempotency
+from conftest import HASHED
+from models import User, Product
+from idempotency import IdempotencyStore, basic_username
+from user_operations import users_db
+from product_operations import products_db
+from vending_operations import coins_db
+from security import credential_cache
+
+@pytest.fixture
+def client(client):
+    users_db["seller"] = User(username="seller", password=HASHED, is_seller=True)
+    users_db["buyer"] = User(username="buyer", password=HASHED, balance_in_cents=10 ** 6)
+    products_db[1] = Product(id=1, name="Soda", price_in_cents=100, quantity=1000, seller="seller")
+    return client
+
+def test_basic_username():
+    assert basic_username("Basic " + base64.b64encode(b"buyer:pw").decode()) == "buyer"
+    assert basic_username("Basic " + base64.b64encode(b"no-colon").decode()) is None
+    assert basic_username("Basic %%%") is None
+    assert basic_username("Bearer abc") is None
+    assert basic_username(None) is None
+
+# Test that keys expire after the TTL and that max_entries bounds the store
+def test_idempotency_store_eviction(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(idempotency.time, "monotonic", lambda: now[0])
+    store = IdempotencyStore(max_entries=3, ttl_seconds=10)
+    for i in range(3):
+        store.finish(i, store.start(i, b"f", b"c"), (200, b"{}", {}))
+    assert store.get(0).response == (200, b"{}", {})
+    store.finish(3, store.start(3, b"f", b"c"), (200, b"{}", {}))
+    assert store.get(0) is None and len(store) == 3 and store.evictions == 1
+    now[0] += 10
+    assert store.get(1) is None
+    store.start(4, b"f", b"c")
+    assert len(store) == 1
+    store.finish(4, store.get(4), None)  # nothing to keep: the key can be used again
+    assert store.get(4) is None
+
+# Test replays of /deposit and what a retry must match
+@pytest.mark.asyncio
+async def test_deposit_replay(client):
+    async with client:
+        headers = {"Idempotency-Key": "deposit-1"}
+        first = await client.post("/deposit", json={"coins_100": 1}, headers=headers, auth=("buyer", "pw"))
+        assert first.status_code == 200 and "idempotent-replayed" not in first.headers
+        hits, misses = credential_cache.hits, credential_cache.misses
+        retry = await client.post("/deposit", json={"coins_100": 1}, headers=headers, auth=("buyer", "pw"))
+        assert (retry.status_code, retry.content, retry.headers["idempotent-replayed"]) == (200, first.content, "true")
+        assert (credential_cache.hits, credential_cache.misses) == (hits, misses)  # no authentication at all
+        assert users_db["buyer"].balance_in_cents == 10 ** 6 + 100
+
+        changed = await client.post("/deposit", json={"coins_100": 2}, headers=headers, auth=("buyer", "pw"))
+        assert changed.status_code == 422
+        assert (await client.post("/deposit", json={"coins_100": 1}, headers=headers, auth=("buyer", "wrong"))).status_code == 401
+        # keys are per user and per route
+        users_db["other"] = User(username="other", password=HASHED)
+        assert (await client.post("/deposit", json={"coins_100": 1}, headers=headers, auth=("other", "pw"))).json()["balance_in_cents"] == 100
+        bought = await client.post("/buy", params={"product_id": 1, "quantity": 1}, headers=headers, auth=("buyer", "pw"))
+        assert bought.status_code == 200 and "idempotent-replayed" not in bought.headers
+
+        users_db["buyer"].balance_in_cents = 0
+
+        # business errors are kept, failed authentication is not
+        refused = await client.post("/buy", params={"product_id": 1, "quantity": 1}, headers={"Idempotency-Key": "broke"}, auth=("buyer", "pw"))
+        assert refused.status_code == 400
+        users_db["buyer"].balance_in_cents = 1000
+        again = await client.post("/buy", params={"product_id": 1, "quantity": 1}, headers={"Idempotency-Key": "broke"}, auth=("buyer", "pw"))
+        assert (again.status_code, again.json(), again.headers["idempotent-replayed"]) == (400, refused.json(), "true")
+        assert (await client.post("/deposit", json={"coins_5": 1}, headers={"Idempotency-Key": "k"}, auth=("buyer", "bad"))).status_code == 401
+        assert (await client.post("/deposit", json={"coins_5": 1}, headers={"Idempotency-Key": "k"}, auth=("buyer", "pw"))).status_code == 200
+
+# Test duplicate storms: every copy of a key gets the same response and the purchase runs once per key,
+# the copies arriving while the first one authenticates wait for it
+@pytest.mark.asyncio
+async def test_buy_duplicate_storm(client):
+    coins_db.update({coin: 10 ** 4 for coin in coins_db})
+    async with client:
+        async def buy(key):
+            return await client.post("/buy", params={"product_id": 1, "quantity": 1}, headers={"Idempotency-Key": key},
+                                     auth=("buyer", "pw"))
+        storm = await asyncio.gather(*[buy("same") for _ in range(50)])
+        assert {(r.status_code, r.content) for r in storm} == {(200, storm[0].content)}
+        assert sum(r.headers.get("idempotent-replayed") == "true" for r in storm) == 49
+        assert products_db[1].quantity == 999
+
+        users_db["buyer"].balance_in_cents = 10 ** 6
+        keys = ["key{}".format(i) for i in range(10)] * 20
+        storm = await asyncio.gather(*[buy(key) for key in keys])
+        assert all(r.status_code == 200 for r in storm)
+        assert len({r.content for r in storm}) <= 10
+        assert products_db[1].quantity == 989
@@ -0,0 +1,105 @@
+import asyncio
+import os
+
+import pytest
+from change import make_change
+from models import User, Product, Deposit
+from storage import open_journaled_storage, set_storage, memory_storage
+from vending_operations import deposit_coins, buy_products
+
+def state(storage):
+    users = {u.username: (u.password, u.is_seller, u.balance_in_cents) for u in storage.list_users()}
+    products = {p.id: (p.name, p.price_in_cents, p.quantity, p.seller) for p in storage.list_products()}
+    indexes = (storage.products.ids, storage.products.in_stock_ids, storage.products.price_index, storage.products.seller_index)
+    sales = list(storage.iter_sales()), storage.sales_totals("seller", "seller", 0, 2 ** 40)
+    return users, products, storage.coin_inventory(), indexes, sales
+
+def mutate(storage):
+    storage.add_users([User(username="seller", password="h1", is_seller=True), User(username="buyer", password="h2")])
+    storage.add_products([Product(id=i, name="Item {}".format(i), price_in_cents=5 * i, quantity=2, seller="seller") for i in range(1, 6)])
+    storage.deposit("buyer", {100: 3, 5: 2})
+    storage.add_coins({50: 4, 20: 4, 10: 4})
+    storage.purchase("buyer", 3, 2, make_change)
+    storage.add_to_balance("buyer", 100)
+    storage.purchase_cart("buyer", [(1, 1), (2, 1)], make_change)
+    product = storage.get_product(4)
+    product.price_in_cents = 95
+    storage.save_product(product)
+    storage.upsert_products([Product(id=5, name="Restocked", price_in_cents=25, quantity=9, seller="seller"),
+                             Product(id=6, name="New", price_in_cents=30, quantity=1, seller="seller")], "seller")
+    storage.delete_product(2)
+    storage.add_user(User(username="gone", password="h3"))
+    storage.set_balance("gone", 40)
+    storage.delete_user("gone")
+    storage.update_balances(["seller", "buyer"], "add", 15)
+    user = storage.get_user("buyer")
+    user.is_seller = True
+    storage.save_user(user)
+    storage.set_seller("seller", False)
+
+# Test that every mutation survives a restart, with and without snapshots
+@pytest.mark.parametrize("fsync,snapshot_every", [("always", 10 ** 6), ("interval", 3), ("never", 1)])
+def test_journal_recovery(tmp_path, fsync, snapshot_every):
+    storage = open_journaled_storage(str(tmp_path), fsync=fsync, fsync_interval=0.01, snapshot_every=snapshot_every)
+    mutate(storage)
+    expected = state(storage)
+    storage.close()
+    assert storage.journal.snapshots > 0 or snapshot_every > 100
+
+    recovered = open_journaled_storage(str(tmp_path), fsync=fsync)
+    assert state(recovered) == expected
+    # writes after a recovery keep going in order
+    recovered.set_balance("buyer", 7)
+    recovered.close()
+    assert open_journaled_storage(str(tmp_path)).get_user("buyer").balance_in_cents == 7
+
+# Test that snapshots drop the segments and snapshots they cover
+def test_journal_snapshot_compaction(tmp_path):
+    storage = open_journaled_storage(str(tmp_path), fsync="never", snapshot_every=10 ** 6)
+    mutate(storage)
+    storage.journal.snapshot()
+    storage.set_balance("buyer", 11)
+    storage.journal.snapshot()
+    storage.set_balance("buyer", 12)
+    expected = state(storage)
+    storage.close()
+
+    files = sorted(os.listdir(tmp_path))
+    assert len([name for name in files if name.startswith("snapshot-")]) == 1
+    assert len([name for name in files if name.startswith("journal-")]) <= 2
+    assert state(open_journaled_storage(str(tmp_path))) == expected
+
+# Test that a record cut short by a crash is dropped and the file repaired
+def test_journal_torn_tail(tmp_path):
+    storage = open_journaled_storage(str(tmp_path), fsync="always")
+    mutate(storage)
+    expected = state(storage)
+    storage.close()
+    segment = sorted(name for name in os.listdir(tmp_path) if name.startswith("journal-"))[-1]
+    with open(tmp_path / segment, "ab") as f:
+        f.write(b'[999999,["b","buyer",')
+
+    recovered = open_journaled_storage(str(tmp_path))
+    assert state(recovered) == expected
+    recovered.close()
+    assert not (tmp_path / segment).read_bytes().endswith(b",")
+
+# Test that concurrent handlers are acknowledged after one shared fsync (group commit) and survive a restart
+@pytest.mark.asyncio
+async def test_journal_group_commit(tmp_path):
+    storage = open_journaled_storage(str(tmp_path), fsync="always")
+    set_storage(storage)
+    try:
+        users = [User(username="buyer{}".format(i), password="h") for i in range(50)]
+        storage.add_users(users)
+        storage.add_product(Product(id=1, name="Soda", price_in_cents=100, quantity=100, seller="seller"))
+        await asyncio.gather(*(deposit_coins(Deposit(coins_100=2), current_user=user) for user in users))
+        await asyncio.gather(*(buy_products(product_id=1, quantity=1, current_user=user) for user in users))
+        assert storage.journal._durable_seq == storage.journal._seq
+    finally:
+        set_storage(memory_storage)
+        storage.close()
+
+    recovered = open_journaled_storage(str(tmp_path))
+    assert recovered.get_product(1).quantity == 50
+    assert recovered.coin_inventory()[100] == 50
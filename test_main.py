@@ -0,0 +1,66 @@
+import asyncio
+import os
+import subprocess
+import sys
+
+import httpx
+import pytest
+from main import ROUTERS, create_app
+from models import Product
+from product_operations import products_db
+from response_cache import ALL_PRODUCTS, product_cache
+import security
+
+def loaded(app):
+    return [timing["module"] for timing in app.state.routers.timings]
+
+@pytest.fixture
+def products():
+    products_db.clear()
+    product_cache.clear()
+    products_db[1] = Product(id=1, name="Soda", price_in_cents=100, quantity=5, seller="seller")
+    yield
+    products_db.clear()
+    product_cache.clear()
+
+# Test that the eager app includes every router at construction
+def test_eager_app():
+    app = create_app(lazy=False)
+    assert loaded(app) == [module for module, _, _ in ROUTERS]
+    assert not any(timing["deferred"] for timing in app.state.routers.timings)
+
+# Test that a lazy app includes only the routers a request needs, and all of them for the schema
+@pytest.mark.asyncio
+async def test_lazy_routers(products):
+    app = create_app(lazy=True)
+    assert loaded(app) == []
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        assert (await client.get("/products/1")).json()["name"] == "Soda"
+        assert loaded(app) == ["product_operations", "sales_operations"]
+        assert (await client.get("/users/")).status_code == 200
+        assert loaded(app) == ["product_operations", "sales_operations", "user_operations"]
+        assert (await client.get("/nothing")).status_code == 404
+        assert len(loaded(app)) == 3
+        schema = (await client.get("/openapi.json")).json()
+    assert "/buy" in schema["paths"] and "/events/inventory" in schema["paths"]
+    assert len(loaded(app)) == len(ROUTERS) and app.state.routers.pending == []
+
+# Test that the lifespan hook loads the remaining routers and warms the bcrypt pool and the catalog cache
+@pytest.mark.asyncio
+async def test_lazy_prewarm(products):
+    app = create_app(lazy=True)
+    async with app.router.lifespan_context(app):
+        for _ in range(100):
+            if product_cache.get(ALL_PRODUCTS) is not None:
+                break
+            await asyncio.sleep(0.01)
+        assert app.state.routers.pending == []
+        assert b'"Soda"' in product_cache.get(ALL_PRODUCTS)[0]
+    assert security.bcrypt is not None
+
+# Test that LAZY_STARTUP leaves bcrypt unimported until it is first used
+def test_lazy_bcrypt():
+    code = ("import sys, main, security; assert 'bcrypt' not in sys.modules; "
+            "security.verify_password('pw', security.hash_password('pw', rounds=4)); assert 'bcrypt' in sys.modules")
+    subprocess.run([sys.executable, "-c", code], check=True, env=dict(os.environ, LAZY_STARTUP="true"),
+                   cwd=os.path.dirname(os.path.abspath(__file__)))
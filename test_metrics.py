@@ -0,0 +1,111 @@
+import httpx
+import pytest
+from fastapi import HTTPException
+from main import app
+from metrics import Counter, CallbackGauge, CallbackCounter, Histogram, render, COINS_DEPOSITED, UNITS_SOLD, STOCK_OUTS, STAGE_SECONDS, REQUESTS, LATENCY
+from models import User, Product, Deposit
+from vending_operations import deposit_coins, buy_products, coins_db
+from user_operations import users_db
+from product_operations import products_db
+from response_cache import product_cache
+
+buyer = User(username="buyer", password="xyz", is_seller=False, balance_in_cents=0)
+
+@pytest.fixture
+def clean_db():
+    users_db.clear()
+    products_db.clear()
+    product_cache.clear()
+    coins_db.update({coin: 10 for coin in coins_db})
+    yield
+    users_db.clear()
+    products_db.clear()
+    product_cache.clear()
+    coins_db.update({coin: 0 for coin in coins_db})
+
+# Test the text format of counters and cumulative histogram buckets
+def test_render():
+    registry = []
+    counter = Counter("test_total", "Test counter", ("kind",), registry=registry)
+    histogram = Histogram("test_seconds", "Test histogram", buckets=(0.1, 1.0), registry=registry)
+    counter.inc("a")
+    counter.inc("a", amount=2)
+    counter.inc('say "hi"')
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value)
+
+    assert render(registry).splitlines() == [
+        "# HELP test_total Test counter",
+        "# TYPE test_total counter",
+        'test_total{kind="a"} 3',
+        'test_total{kind="say \\"hi\\""} 1',
+        "# HELP test_seconds Test histogram",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{le="0.1"} 2',
+        'test_seconds_bucket{le="1.0"} 3',
+        'test_seconds_bucket{le="+Inf"} 4',
+        "test_seconds_sum 3.65",
+        "test_seconds_count 4",
+    ]
+
+# Test that callback metrics read their value at scrape time and render with their own type
+def test_render_callbacks():
+    registry = []
+    state = {"size": 2, "hits": 5}
+    CallbackGauge("test_size", "Test gauge", lambda: state["size"], registry=registry)
+    CallbackCounter("test_hits_total", "Test callback counter", lambda: state["hits"], registry=registry)
+    state["hits"] += 1
+
+    assert render(registry).splitlines() == [
+        "# HELP test_size Test gauge",
+        "# TYPE test_size gauge",
+        "test_size 2",
+        "# HELP test_hits_total Test callback counter",
+        "# TYPE test_hits_total counter",
+        "test_hits_total 6",
+    ]
+
+# Test the business counters and the compute_change stage timer
+@pytest.mark.asyncio
+async def test_business_counters(clean_db):
+    users_db["buyer"] = buyer.model_copy()
+    products_db[1] = Product(id=1, name="Soda", price_in_cents=150, quantity=2, seller="seller")
+    fives, hundreds = COINS_DEPOSITED.value("5"), COINS_DEPOSITED.value("100")
+    sold, stock_outs, change_timings = UNITS_SOLD.value("1"), STOCK_OUTS.value("1"), STAGE_SECONDS.count("compute_change")
+
+    await deposit_coins(Deposit(coins_5=2, coins_100=4), current_user=buyer)
+    assert (COINS_DEPOSITED.value("5") - fives, COINS_DEPOSITED.value("100") - hundreds) == (2, 4)
+
+    await buy_products(product_id=1, quantity=2, current_user=buyer)
+    assert UNITS_SOLD.value("1") - sold == 2
+    assert STAGE_SECONDS.count("compute_change") - change_timings == 1
+
+    with pytest.raises(HTTPException):
+        await buy_products(product_id=1, quantity=1, current_user=buyer)
+    assert STOCK_OUTS.value("1") - stock_outs == 1
+    assert UNITS_SOLD.value("1") - sold == 2
+
+# Test that requests are counted per route template and served on /metrics
+@pytest.mark.asyncio
+async def test_metrics_endpoint(clean_db):
+    labels = ("products", "/products/{product_id}", "GET")
+    not_found, timings = REQUESTS.value(*labels, 404), LATENCY.count(*labels)
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        for product_id in range(3):
+            assert (await client.get("/products/{}".format(product_id))).status_code == 404
+        response = await client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert REQUESTS.value(*labels, 404) - not_found == 3
+    assert LATENCY.count(*labels) - timings == 3
+    assert 'vending_http_request_duration_seconds_bucket{router="products",route="/products/{product_id}",method="GET",le="+Inf"}' in response.text
+    assert "# TYPE vending_credential_cache_hits_total counter" in response.text
+    assert "# TYPE vending_credential_cache_misses_total counter" in response.text
+    assert "# TYPE vending_product_cache_hits_total counter" in response.text
+    assert "# TYPE vending_product_cache_evictions_total counter" in response.text
+    assert "# TYPE vending_events_dropped_total counter" in response.text
+    assert "# TYPE vending_event_subscribers gauge" in response.text
+    assert "# TYPE vending_rate_limit_evictions_total counter" in response.text
+    assert "# TYPE vending_idempotency_evictions_total counter" in response.text
@@ -1,7 +1,17 @@
+import json
+from decimal import Decimal
+
+import bcrypt
+import httpx
 import pytest
-from models import User
+from models import User, Product
 from fastapi import HTTPException, status
-from product_operations import create_product, read_products, read_product, update_product, delete_product, products_db
+from main import app
+from product_operations import create_product, read_products, read_products_page, read_product, update_product, delete_product, products_db
+from user_operations import users_db
+from storage import memory_storage
+from bulk import import_products
+from response_cache import product_cache
 
 # Create dummy users
 test_user = User(username='test_user', password='abc', is_seller=True, balance=0)
@@ -11,8 +21,10 @@ unauthorized_user = User(username='unauth_user', password='123', is_seller=False
 # Clean up products_db before and after each test
 def clean_products_db():
     products_db.clear()
+    product_cache.clear()
     yield
     products_db.clear()
+    product_cache.clear()
 
 # Test create_product function
 @pytest.mark.asyncio
@@ -21,7 +33,8 @@ async def test_create_product(clean_products_db):
     product = await create_product(id=1, name="Test Product", price=10.0, quantity=5, current_user=test_user)
     assert product.id == 1
     assert product.name == "Test Product"
-    assert product.price == 10.0
+    assert product.price_in_cents == 1000
+    assert product.price == "10.00"
     assert product.quantity == 5
     assert product.seller == "test_user"
     assert len(products_db) == 1  
@@ -36,6 +49,11 @@ async def test_create_product(clean_products_db):
         await create_product(id=2, name="Negative Price Product", price=-5.0, quantity=3, current_user=test_user)
     assert exc_info.value.status_code == status.HTTP_400_BAD_REQUEST
 
+    # Test fractions of a cent
+    with pytest.raises(HTTPException) as exc_info:
+        await create_product(id=2, name="Sub-cent Product", price=Decimal("0.075"), quantity=3, current_user=test_user)
+    assert exc_info.value.status_code == status.HTTP_400_BAD_REQUEST
+
     # Test zero quantity
     with pytest.raises(HTTPException) as exc_info:
         await create_product(id=3, name="Zero Quantity Product", price=10.0, quantity=0, current_user=test_user)
@@ -50,13 +68,13 @@ async def test_create_product(clean_products_db):
 @pytest.mark.asyncio
 async def test_read_products(clean_products_db):
     # Test empty products_db
-    products = await read_products()
+    products = json.loads((await read_products()).body)
     assert len(products) == 0
 
     # Test non-empty products_db
     await create_product(id=1, name="Product 1", price=10.0, quantity=5, current_user=test_user)
     await create_product(id=2, name="Product 2", price=20.0, quantity=3, current_user=test_user)
-    products = await read_products()
+    products = json.loads((await read_products()).body)
     assert len(products) == 2
 
 # Test read_product function
@@ -69,10 +87,11 @@ async def test_read_product(clean_products_db):
 
     # Test valid case
     await create_product(id=1, name="Product 1", price=10.0, quantity=5, current_user=test_user)
-    product = await read_product(1)
+    product = Product.model_validate_json((await read_product(1)).body)
     assert product.id == 1
     assert product.name == "Product 1"
-    assert product.price == 10.0
+    assert product.price_in_cents == 1000
+    assert product.price == "10.00"
     assert product.quantity == 5
     assert product.seller == "test_user"
 
@@ -94,10 +113,21 @@ async def test_update_product(clean_products_db):
     updated_product = await update_product(1, name="Updated Product", price=15.0, quantity=3, current_user=test_user)
     assert updated_product.id == 1
     assert updated_product.name == "Updated Product"
-    assert updated_product.price == 15.0
+    assert updated_product.price_in_cents == 1500
+    assert updated_product.price == "15.00"
     assert updated_product.quantity == 3
     assert updated_product.seller == "test_user"
 
+    # Test invalid price and quantity, the product is left as it was
+    for price, quantity in ((-1, 3), (0, 3), (15.0, -1)):
+        with pytest.raises(HTTPException) as exc_info:
+            await update_product(1, name="Updated Product", price=price, quantity=quantity, current_user=test_user)
+        assert exc_info.value.status_code == status.HTTP_400_BAD_REQUEST
+    assert (products_db[1].price_in_cents, products_db[1].quantity) == (1500, 3)
+
+    # Test that a product can be taken out of stock
+    assert (await update_product(1, name="Updated Product", price=15.0, quantity=0, current_user=test_user)).quantity == 0
+
 # Test delete_product function
 @pytest.mark.asyncio
 async def test_delete_product(clean_products_db):
@@ -116,3 +146,161 @@ async def test_delete_product(clean_products_db):
     response = await delete_product(1, current_user=test_user)
     assert response == {"message": "ProductId 1 was deleted"}
     assert len(products_db) == 0
+
+# Test that prices are exact integer cents
+@pytest.mark.asyncio
+async def test_product_price_in_cents(clean_products_db):
+    product = await create_product(id=1, name="Gum", price=Decimal("0.07"), quantity=5, current_user=test_user)
+    assert product.price_in_cents == 7
+    assert product.model_dump()["price"] == "0.07"
+
+    product = await update_product(1, name="Gum", price=0.29, quantity=5, current_user=test_user)
+    assert product.price_in_cents == 29
+
+    # legacy float prices are migrated when a record is loaded
+    legacy = Product(**{"id": 2, "name": "Old", "price": 0.07, "quantity": 1, "seller": "test_user"})
+    assert legacy.price_in_cents == 7
+
+# Test read_products_page function
+@pytest.mark.asyncio
+async def test_read_products_page(clean_products_db):
+    for i in range(1, 8):
+        await create_product(id=i, name="Product {}".format(i), price=float(8 - i), quantity=5, current_user=test_user)
+    other_seller = User(username='other_seller', password='abc', is_seller=True)
+    await create_product(id=8, name="Product 8", price=3.5, quantity=5, current_user=other_seller)
+
+    # Test cursor pagination in id order
+    page = await read_products_page(limit=3)
+    assert [p.id for p in page["items"]] == [1, 2, 3]
+    page = await read_products_page(cursor=page["next_cursor"], limit=3)
+    assert [p.id for p in page["items"]] == [4, 5, 6]
+    page = await read_products_page(cursor=page["next_cursor"], limit=3)
+    assert [p.id for p in page["items"]] == [7, 8]
+    assert page["next_cursor"] is None
+
+    # Test price range pages are ordered by price
+    page = await read_products_page(min_price=2.0, max_price=4.0, limit=2)
+    assert [p.id for p in page["items"]] == [6, 5]
+    page = await read_products_page(cursor=page["next_cursor"], min_price=2.0, max_price=4.0, limit=2)
+    assert [p.id for p in page["items"]] == [8, 4]
+
+    # Test seller filter follows updates
+    await update_product(8, name="Product 8", price=3.5, quantity=5, current_user=other_seller)
+    page = await read_products_page(seller="other_seller")
+    assert [p.id for p in page["items"]] == [8]
+    await delete_product(8, current_user=other_seller)
+    assert (await read_products_page(seller="other_seller"))["items"] == []
+
+    # Test invalid limit and cursor
+    with pytest.raises(HTTPException) as exc_info:
+        await read_products_page(limit=0)
+    assert exc_info.value.status_code == status.HTTP_400_BAD_REQUEST
+    with pytest.raises(HTTPException) as exc_info:
+        await read_products_page(cursor="abc")
+    assert exc_info.value.status_code == status.HTTP_400_BAD_REQUEST
+
+# Test NDJSON export of read_products
+@pytest.mark.asyncio
+async def test_read_products_ndjson(clean_products_db):
+    for i in range(1, 4):
+        await create_product(id=i, name="Product {}".format(i), price=1.0, quantity=5, current_user=test_user)
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.get("/products/all", params={"format": "ndjson"})
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert [json.loads(line)["id"] for line in response.text.splitlines()] == [1, 2, 3]
+
+async def body(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+# Test bulk import: chunked upsert, split lines, and the per-row error report
+@pytest.mark.asyncio
+async def test_import_products(clean_products_db):
+    products_db[2] = Product(id=2, name="Old", price_in_cents=100, quantity=1, seller="test_user")
+    products_db[9] = Product(id=9, name="Other", price_in_cents=100, quantity=1, seller="other_seller")
+    csv_body = (b"id,name,price,quantity\n1,Soda,1.50,10\n2,Chips,0.7", b"5,3\r\n3,Bad,1.005,1\n4,Zero,1.00,0\n",
+                b"x,Bad id,1.00,1\n9,Stolen,1.00,1\n5,Short\n6,\"Gum, mint\",0.05,100\n")
+    report = await import_products(memory_storage, body(*csv_body), "csv", "test_user", chunk_rows=3)
+
+    assert (report.imported, report.failed) == (3, 5)
+    assert report.errors == [
+        {"line": 4, "errors": ["Price must be a whole number of cents"]},
+        {"line": 5, "errors": ["quantity: Input should be greater than 0"]},
+        {"line": 6, "errors": ["id: Input should be a valid integer, unable to parse string as an integer"]},
+        {"line": 7, "errors": ["User is not seller of productId: 9"]},
+        {"line": 8, "errors": ["Expected 4 columns, got 2"]},
+    ]
+    assert products_db[2].name == "Chips" and products_db[2].price_in_cents == 75 and products_db[2].quantity == 3
+    assert products_db[6].name == "Gum, mint"
+    assert products_db[9].name == "Other"
+    # the secondary indexes see the bulk writes
+    page = await read_products_page(min_price=0.5, max_price=2.0)
+    assert [p.id for p in page["items"]] == [2, 9, 1]
+
+    ndjson_body = b'{"id": 1, "name": "Soda", "price": "2.00", "quantity": 5}\nnot json\n[1]\n'
+    report = await import_products(memory_storage, body(ndjson_body), "ndjson", "test_user")
+    assert (report.imported, report.failed) == (1, 2)
+    assert products_db[1].price_in_cents == 200
+
+    # an id repeated in one chunk keeps its last row, in the price index too
+    ndjson_body = b'{"id": 1, "name": "Soda", "price": "3.00", "quantity": 5}\n{"id": 1, "name": "Soda", "price": "1.50", "quantity": 5}\n'
+    report = await import_products(memory_storage, body(ndjson_body), "ndjson", "test_user")
+    assert (report.imported, report.failed) == (2, 0)
+    assert [p.id for p in (await read_products_page(min_price=0))["items"]].count(1) == 1
+    assert [p.price_in_cents for p in (await read_products_page(max_price=1.5))["items"] if p.id == 1] == [150]
+    assert [p.id for p in (await read_products_page(min_price=2.5))["items"]] == []
+
+    # a price too large for cents fails its row, the rows around it are still imported
+    csv_body = b"id,name,price,quantity\n7,Gold,1e30,1\n8,Tea,1.00,1\n"
+    report = await import_products(memory_storage, body(csv_body), "csv", "test_user")
+    assert (report.imported, report.errors) == (1, [{"line": 2, "errors": ["Price is too large"]}])
+
+    # only the first max_errors rows are listed
+    report = await import_products(memory_storage, body(b"x\n" * 5), "ndjson", "test_user", max_errors=2)
+    assert report.as_dict()["failed"] == 5 and len(report.errors) == 2 and report.as_dict()["errors_truncated"]
+
+    with pytest.raises(ValueError):
+        await import_products(memory_storage, body(b"id,name\n1,Soda\n"), "csv", "test_user")
+
+# Test POST /products/bulk and a CSV export that imports back unchanged
+@pytest.mark.asyncio
+async def test_bulk_endpoints(clean_products_db):
+    users_db.clear()
+    users_db["test_user"] = User(username="test_user", password=bcrypt.hashpw(b"abc", bcrypt.gensalt(4)).decode(), is_seller=True)
+    rows = "".join('{{"id": {0}, "name": "Product {0}", "price": "1.{0:02d}", "quantity": 5}}\n'.format(i) for i in range(1, 31))
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.post("/products/bulk", content=rows, auth=("test_user", "abc"),
+                                     headers={"content-type": "application/x-ndjson"})
+        assert response.status_code == 200
+        assert (response.json()["imported"], response.json()["failed"]) == (30, 0)
+
+        export = await client.get("/products/export", params={"format": "csv", "seller": "test_user"})
+        assert export.headers["content-type"].startswith("text/csv")
+        lines = export.text.splitlines()
+        assert lines[0] == "id,name,price,quantity,seller" and lines[1] == "1,Product 1,1.01,5,test_user" and len(lines) == 31
+
+        response = await client.post("/products/bulk", params={"format": "csv"}, content=export.text, auth=("test_user", "abc"))
+        assert (response.json()["imported"], response.json()["failed"]) == (30, 0)
+
+        response = await client.post("/products/bulk", params={"format": "csv"}, content="id,price\n", auth=("test_user", "abc"))
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        response = await client.post("/products/bulk", params={"format": "xml"}, content="", auth=("test_user", "abc"))
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+    users_db.clear()
+
+# Test that prices with too many digits for cents are a 400, not a 500
+@pytest.mark.asyncio
+async def test_price_out_of_range(clean_products_db):
+    users_db.clear()
+    users_db["test_user"] = User(username="test_user", password=bcrypt.hashpw(b"abc", bcrypt.gensalt(4)).decode(), is_seller=True)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        for price in ("1e30", "1e17"):  # cannot be quantized / does not fit in an SQLite INTEGER
+            response = await client.post("/products/", params={"id": 1, "name": "Gold", "price": price, "quantity": 1},
+                                         auth=("test_user", "abc"))
+            assert (response.status_code, response.json()["detail"]) == (400, "Price is too large")
+        response = await client.get("/products/", params={"min_price": "1e30"})
+        assert (response.status_code, response.json()["detail"]) == (400, "min_price is too large")
+    assert len(products_db) == 0
+    users_db.clear()
@@ -0,0 +1,121 @@
+import httpx
+import pytest
+import ratelimit
+from main import app
+from conftest import HASHED
+from models import User, Product
+from ratelimit import MemoryBuckets, SQLiteBuckets, parse_limit, rate_limiter
+from user_operations import users_db
+from product_operations import products_db
+from security import credential_cache
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ratelimit.time, "monotonic", lambda: now[0])
+    return now
+
+@pytest.fixture
+# Small limits on a fresh store for the duration of a test
+def limits(monkeypatch, stores):
+    monkeypatch.setattr(rate_limiter, "enabled", True)
+    monkeypatch.setattr(rate_limiter, "store", MemoryBuckets(1000))
+    monkeypatch.setattr(rate_limiter, "limits", {
+        "auth_failure": {"user_ip": (1 / 60, 3), "ip": (1 / 60, 5)},
+        "signup": {"ip": (1 / 60, 2)},
+        "buy": {"user": (1.0, 2)},
+    })
+
+def test_parse_limit():
+    assert parse_limit("20/minute") == (20 / 60, 20)
+    assert parse_limit("5/second") == (5, 5)
+    assert parse_limit("") is None
+    with pytest.raises(ValueError):
+        parse_limit("5/fortnight")
+
+# Test bursts, refill and the wait reported for an empty bucket
+def test_memory_buckets(clock):
+    buckets = MemoryBuckets(max_buckets=100)
+    assert [buckets.acquire("k", rate=1.0, burst=3) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert buckets.acquire("k", rate=1.0, burst=3) == pytest.approx(1.0)
+    assert buckets.acquire("k", rate=1.0, burst=3, cost=0) == pytest.approx(1.0)
+    clock[0] += 1.5
+    assert buckets.acquire("k", rate=1.0, burst=3) == 0.0
+    assert buckets.acquire("k", rate=1.0, burst=3) == pytest.approx(0.5)
+    # budget checks of unknown keys store nothing
+    assert buckets.acquire("other", rate=1.0, burst=3, cost=0) == 0.0
+    assert len(buckets) == 1
+
+# Test that refilled buckets are dropped as new ones come in and that max_buckets bounds the store
+def test_memory_buckets_eviction(clock):
+    buckets = MemoryBuckets(max_buckets=10)
+    for i in range(5):
+        buckets.acquire("idle{}".format(i), rate=1.0, burst=1)
+    clock[0] += 2  # every idle bucket is full again
+    for i in range(5):
+        buckets.acquire("new{}".format(i), rate=1.0, burst=1)
+    assert len(buckets) == 5 and buckets.evictions == 5
+    for i in range(20):
+        buckets.acquire("busy{}".format(i), rate=1.0, burst=1)
+    assert len(buckets) == 10
+
+# Test that two stores on one file (two workers) share their buckets
+def test_sqlite_buckets_shared(tmp_path):
+    path = str(tmp_path / "limits.db")
+    first, second = SQLiteBuckets(path, max_idle_seconds=60), SQLiteBuckets(path, max_idle_seconds=60)
+    try:
+        assert first.acquire("k", rate=0.01, burst=2) == 0.0
+        assert second.acquire("k", rate=0.01, burst=2) == 0.0
+        assert first.acquire("k", rate=0.01, burst=2) > 0
+        assert second.acquire("k", rate=0.01, burst=2, cost=0) > 0
+        assert second.acquire("other", rate=0.01, burst=2, cost=0) == 0.0
+        assert len(first) == 1
+    finally:
+        first.close()
+        second.close()
+
+# Test the signup, auth failure and /buy limits through the app
+@pytest.mark.asyncio
+async def test_rate_limited_routes(limits):
+    users_db["seller"] = User(username="seller", password=HASHED, is_seller=True)
+    users_db["buyer"] = User(username="buyer", password=HASHED, balance_in_cents=10 ** 6)
+    products_db[1] = Product(id=1, name="Soda", price_in_cents=5, quantity=100, seller="seller")
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        signups = [await client.post("/users/", params={"username": "new{}".format(i), "password": "pw"}) for i in range(3)]
+        assert [r.status_code for r in signups] == [200, 200, 429]
+        assert 55 <= int(signups[2].headers["retry-after"]) <= 60  # a token every 60 s, minus the time the signups took
+
+        # three failures use up the budget of the username from this address, after that even the right password gets
+        # a 429 without bcrypt
+        failures = [await client.get("/users/buyer", auth=("buyer", "wrong")) for _ in range(3)]
+        assert [r.status_code for r in failures] == [401, 401, 401]
+        misses = credential_cache.misses
+        assert (await client.get("/users/buyer", auth=("buyer", "pw"))).status_code == 429
+        assert credential_cache.misses == misses + 1  # the cache lookup, bcrypt never ran
+        # other users of the address are not refused
+        assert (await client.get("/users/seller", auth=("seller", "wrong"))).status_code == 401
+        assert (await client.get("/users/seller", auth=("seller", "pw"))).status_code == 200
+
+    # the user still logs in from another address, and once the credentials are cached, from the first one too
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app, client=("10.0.0.2", 1234)), base_url="http://test") as other:
+        assert (await other.get("/users/buyer", auth=("buyer", "pw"))).status_code == 200
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        assert (await client.get("/users/buyer", auth=("buyer", "pw"))).status_code == 200
+
+        rate_limiter.store.clear()
+        buys = [await client.post("/buy", params={"product_id": 1, "quantity": 1}, auth=("buyer", "pw")) for _ in range(3)]
+        assert [r.status_code for r in buys][2] == 429
+        assert (await client.post("/buy/batch", json=[{"product_id": 1, "quantity": 1}], auth=("buyer", "pw"))).status_code == 429
+
+# Test that one address guessing across many usernames runs out of its own auth failure budget
+@pytest.mark.asyncio
+async def test_auth_failures_per_ip(limits):
+    for i in range(7):
+        users_db["user{}".format(i)] = User(username="user{}".format(i), password=HASHED)
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        failures = [await client.get("/users/user{}".format(i), auth=("user{}".format(i), "wrong")) for i in range(7)]
+        assert [r.status_code for r in failures] == [401] * 5 + [429] * 2
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app, client=("10.0.0.2", 1234)), base_url="http://test") as other:
+        assert (await other.get("/users/user6", auth=("user6", "pw"))).status_code == 200
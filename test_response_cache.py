@@ -0,0 +1,69 @@
+import pytest
+from conftest import HASHED
+from models import User
+from response_cache import ResponseCache, etag_matches, product_cache
+from user_operations import users_db
+from vending_operations import coins_db
+
+@pytest.fixture
+def client(client):
+    users_db["seller"] = User(username="seller", password=HASHED, is_seller=True)
+    users_db["buyer"] = User(username="buyer", password=HASHED, balance_in_cents=1000)
+    coins_db.update({coin: 10 for coin in coins_db})
+    return client
+
+# Test the byte bound, LRU order, oversized bodies and the counters
+def test_response_cache_eviction():
+    cache = ResponseCache(max_bytes=10)
+    cache.put(1, b"aaaa")
+    cache.put(2, b"bbbb")
+    assert cache.get(1)[0] == b"aaaa"  # 1 is now the most recently used
+    cache.put(3, b"cccc")
+    assert cache.get(2) is None and cache.get(1) is not None and cache.get(3) is not None
+    body, etag = cache.put(4, b"x" * 11)
+    assert body == b"x" * 11 and etag.startswith('"')
+    assert cache.get(4) is None
+    cache.invalidate([1, 99])
+    assert cache.stats() == {"hits": 3, "misses": 2, "evictions": 1, "entries": 1, "bytes": 4}
+    assert cache.hit_ratio == 0.6
+
+def test_etag_matches():
+    assert etag_matches('"a"', '"a"')
+    assert etag_matches('"b", W/"a"', '"a"')
+    assert etag_matches("*", '"a"')
+    assert not etag_matches(None, '"a"')
+    assert not etag_matches('"b"', '"a"')
+
+# Test ETag/304 and that every write drops exactly the product it touched and the full catalog
+@pytest.mark.asyncio
+async def test_product_cache_invalidation(client):
+    async with client:
+        for product_id in (1, 2):
+            response = await client.post("/products/", auth=("seller", "pw"),
+                                         params={"id": product_id, "name": "Soda", "price": "1.00", "quantity": 5})
+            assert response.status_code == 200
+
+        first = await client.get("/products/1")
+        etag = first.headers["etag"]
+        assert first.json()["quantity"] == 5
+        hits = product_cache.hits
+        not_modified = await client.get("/products/1", headers={"If-None-Match": etag})
+        assert (not_modified.status_code, not_modified.content, not_modified.headers["etag"]) == (304, b"", etag)
+        assert product_cache.hits == hits + 1
+        catalog = await client.get("/products/all")
+        assert [p["id"] for p in catalog.json()] == [1, 2]
+        other = (await client.get("/products/2")).headers["etag"]
+
+        assert (await client.post("/buy", params={"product_id": 1, "quantity": 2}, auth=("buyer", "pw"))).status_code == 200
+        assert set(product_cache._entries) == {2}
+        bought = await client.get("/products/1", headers={"If-None-Match": etag})
+        assert bought.status_code == 200 and bought.json()["quantity"] == 3 and bought.headers["etag"] != etag
+        assert (await client.get("/products/2", headers={"If-None-Match": other})).status_code == 304
+
+        await client.put("/products/2", auth=("seller", "pw"), params={"name": "Cola", "price": "2.00", "quantity": 1})
+        assert (await client.get("/products/2")).json()["name"] == "Cola"
+        await client.post("/products/", auth=("seller", "pw"), params={"id": 3, "name": "Gum", "price": "0.50", "quantity": 1})
+        assert [p["id"] for p in (await client.get("/products/all")).json()] == [1, 2, 3]
+        await client.delete("/products/3", auth=("seller", "pw"))
+        assert (await client.get("/products/3")).status_code == 404
+        assert [p["id"] for p in (await client.get("/products/all")).json()] == [1, 2]
@@ -0,0 +1,61 @@
+import time
+
+import pytest
+from conftest import HASHED
+from models import User, Product
+from user_operations import users_db
+from product_operations import products_db
+from vending_operations import coins_db
+
+@pytest.fixture
+def client(client):
+    users_db["seller"] = User(username="seller", password=HASHED, is_seller=True)
+    users_db["other"] = User(username="other", password=HASHED, is_seller=True)
+    users_db["buyer"] = User(username="buyer", password=HASHED, balance_in_cents=10000)
+    products_db[1] = Product(id=1, name="Soda", price_in_cents=150, quantity=10, seller="seller")
+    products_db[2] = Product(id=2, name="Chips", price_in_cents=100, quantity=10, seller="other")
+    coins_db.update({coin: 100 for coin in coins_db})
+    return client
+
+# Test that /buy and /buy/batch show up in the seller and product stats, and who may read them
+@pytest.mark.asyncio
+async def test_sales_stats(client):
+    async with client:
+        assert (await client.post("/buy", params={"product_id": 1, "quantity": 2}, auth=("buyer", "pw"))).status_code == 200
+        users_db["buyer"].balance_in_cents = 10000  # the rest of the balance was paid out as change
+        cart = [{"product_id": 1, "quantity": 1}, {"product_id": 2, "quantity": 3}]
+        assert (await client.post("/buy/batch", json=cart, auth=("buyer", "pw"))).status_code == 200
+
+        stats = (await client.get("/sellers/seller/stats", auth=("seller", "pw"))).json()
+        assert (stats["sales"], stats["units_sold"], stats["revenue_in_cents"], stats["revenue"]) == (2, 3, 450, "4.50")
+        assert [(b["sales"], b["units_sold"], b["revenue_in_cents"]) for b in stats["buckets"]] == [(2, 3, 450)]
+        assert stats["since"] <= stats["buckets"][0]["start"] <= time.time() < stats["until"] + 1
+
+        sales = (await client.get("/products/2/sales", auth=("other", "pw"))).json()
+        assert (sales["product_id"], sales["seller"], sales["units_sold"], sales["revenue_in_cents"]) == (2, "other", 3, 300)
+
+        # a range before the sales has the totals but no buckets
+        earlier = (await client.get("/sellers/seller/stats", params={"since": 0, "until": 3600}, auth=("seller", "pw"))).json()
+        assert earlier["revenue_in_cents"] == 450 and earlier["buckets"] == []
+
+        assert (await client.get("/sellers/other/stats", auth=("seller", "pw"))).status_code == 401
+        assert (await client.get("/products/2/sales", auth=("seller", "pw"))).status_code == 401
+        assert (await client.get("/products/3/sales", auth=("seller", "pw"))).status_code == 404
+        assert (await client.get("/sellers/seller/stats", params={"since": 0}, auth=("seller", "pw"))).status_code == 400
+
+        # no sales yet
+        products_db[3] = Product(id=3, name="Gum", price_in_cents=50, quantity=1, seller="seller")
+        assert (await client.get("/products/3/sales", auth=("seller", "pw"))).json()["sales"] == 0
+        assert (await client.get("/sellers/buyer/stats", auth=("buyer", "pw"))).json()["revenue"] == "0.00"
+
+        # sales of a deleted product stay readable by its seller
+        assert (await client.delete("/products/1", auth=("seller", "pw"))).status_code == 200
+        assert (await client.get("/products/1/sales", auth=("seller", "pw"))).json()["units_sold"] == 3
+
+        # the id reused by another seller: it starts from zero for them and never shows the previous seller's sales
+        products_db[1] = Product(id=1, name="Tea", price_in_cents=100, quantity=5, seller="other")
+        assert (await client.get("/products/1/sales", auth=("other", "pw"))).json()["sales"] == 0
+        assert (await client.post("/buy", params={"product_id": 1, "quantity": 1}, auth=("buyer", "pw"))).status_code == 200
+        sales = (await client.get("/products/1/sales", auth=("other", "pw"))).json()
+        assert (sales["seller"], sales["units_sold"], sales["revenue_in_cents"]) == ("other", 1, 100)
+        assert (await client.get("/products/1/sales", auth=("seller", "pw"))).status_code == 401
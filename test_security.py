@@ -0,0 +1,107 @@
+import asyncio
+import threading
+
+import bcrypt
+import pytest
+from fastapi import HTTPException, status
+
+import settings
+from security import CredentialCache, HashingPool, hash_password, hash_password_async, verify_password, verify_password_async
+
+def cheap_hash(password):
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds=4)).decode("utf-8")
+
+# Test hit/miss accounting of the credential cache
+@pytest.mark.asyncio
+async def test_credential_cache_hits_and_misses():
+    cache = CredentialCache(max_entries=10, ttl_seconds=60)
+    hashed = cheap_hash("abc")
+
+    assert await cache.verify_async("test_user", "abc", hashed)
+    assert await cache.verify_async("test_user", "abc", hashed)
+    assert cache.stats() == {"hits": 1, "misses": 1, "size": 1}
+
+    # wrong passwords are never cached
+    assert not await cache.verify_async("test_user", "wrong", hashed)
+    assert not await cache.verify_async("test_user", "wrong", hashed)
+    assert cache.stats() == {"hits": 1, "misses": 3, "size": 1}
+
+    # get_current_user looks the credentials up once, then runs bcrypt without a second lookup
+    assert not cache.cached("other_user", "abc", hashed)
+    assert await cache.verify_async("other_user", "abc", hashed, lookup=False)
+    assert cache.cached("other_user", "abc", hashed)
+    assert cache.stats() == {"hits": 2, "misses": 4, "size": 2}
+
+# Test that a changed stored hash or an invalidated user is verified again
+@pytest.mark.asyncio
+async def test_credential_cache_invalidation():
+    cache = CredentialCache(max_entries=10, ttl_seconds=60)
+    old_hash = cheap_hash("abc")
+    assert await cache.verify_async("test_user", "abc", old_hash)
+
+    # password changed: the old password must not pass against the new hash
+    new_hash = cheap_hash("xyz")
+    assert not await cache.verify_async("test_user", "abc", new_hash)
+    assert await cache.verify_async("test_user", "xyz", new_hash)
+
+    cache.invalidate("test_user")
+    assert cache.stats()["size"] == 0
+    assert await cache.verify_async("test_user", "xyz", new_hash)
+    assert cache.hits == 0
+
+# Test TTL expiry and LRU eviction
+@pytest.mark.asyncio
+async def test_credential_cache_ttl_and_lru():
+    expired = CredentialCache(max_entries=10, ttl_seconds=0)
+    hashed = cheap_hash("abc")
+    await expired.verify_async("test_user", "abc", hashed)
+    await expired.verify_async("test_user", "abc", hashed)
+    assert expired.hits == 0
+
+    cache = CredentialCache(max_entries=2, ttl_seconds=60)
+    hashes = {name: cheap_hash(name) for name in ("a", "b", "c")}
+    await cache.verify_async("a", "a", hashes["a"])
+    await cache.verify_async("b", "b", hashes["b"])
+    await cache.verify_async("a", "a", hashes["a"])  # "a" becomes most recently used
+    await cache.verify_async("c", "c", hashes["c"])  # evicts "b"
+    assert cache.stats()["size"] == 2
+    await cache.verify_async("a", "a", hashes["a"])
+    await cache.verify_async("b", "b", hashes["b"])
+    assert cache.hits == 2
+
+# Test that a disabled cache always falls through to bcrypt
+@pytest.mark.asyncio
+async def test_credential_cache_disabled():
+    cache = CredentialCache(max_entries=10, ttl_seconds=60, enabled=False)
+    hashed = cheap_hash("abc")
+    assert await cache.verify_async("test_user", "abc", hashed) == verify_password("abc", hashed)
+    assert cache.stats() == {"hits": 0, "misses": 0, "size": 0}
+
+# Test that a saturated hashing pool answers 503 instead of queueing more work
+@pytest.mark.asyncio
+async def test_hashing_pool_backpressure():
+    pool = HashingPool(kind="thread", workers=1, max_pending=1, retry_after_seconds=2)
+    release = threading.Event()
+    running = asyncio.ensure_future(pool.run(release.wait))
+    await asyncio.sleep(0.05)
+
+    with pytest.raises(HTTPException) as exc_info:
+        await pool.run(verify_password, "abc", cheap_hash("abc"))
+    assert exc_info.value.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert exc_info.value.headers == {"Retry-After": "2"}
+    assert pool.rejected == 1
+
+    release.set()
+    assert await running
+    assert pool.pending == 0
+    assert await pool.run(verify_password, "abc", cheap_hash("abc"))
+    pool.shutdown()
+
+# Test the async hashing API and the configurable cost factor
+@pytest.mark.asyncio
+async def test_async_hashing():
+    hashed = await hash_password_async("abc")
+    assert hashed.startswith("$2b${:02d}$".format(settings.BCRYPT_ROUNDS))
+    assert await verify_password_async("abc", hashed)
+    assert not await verify_password_async("xyz", hashed)
+    assert hash_password("abc", rounds=4).startswith("$2b$04$")
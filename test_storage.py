@@ -0,0 +1,437 @@
+import json
+import sqlite3
+import threading
+
+import httpx
+import pytest
+from fastapi.security import HTTPBasicCredentials
+from main import app
+from change import make_change
+from models import User, Product, Deposit
+from storage import Storage, InMemoryStorage, SQLiteStorage, PurchaseError, NOT_ENOUGH_STOCK, UserRecord, ProductRecord, set_storage, memory_storage
+from user_operations import create_user, get_current_user
+from product_operations import create_product, read_products
+from vending_operations import deposit_coins, buy_products
+from response_cache import product_cache
+
+@pytest.fixture(params=["memory", "memory-models", "sqlite"])
+# Run each contract test against every engine, and the in-memory one with both row layouts
+def storage(request, tmp_path):
+    if request.param.startswith("memory"):
+        backend = InMemoryStorage(compact=request.param == "memory")
+    else:
+        backend = SQLiteStorage(str(tmp_path / "vending.db"), pool_size=2)
+    yield backend
+    backend.close()
+
+@pytest.fixture
+# Route the handlers to a fresh SQLite file for the duration of a test
+def sqlite_storage(tmp_path):
+    backend = SQLiteStorage(str(tmp_path / "vending.db"), pool_size=2)
+    set_storage(backend)
+    product_cache.clear()
+    yield backend
+    set_storage(memory_storage)
+    product_cache.clear()
+    backend.close()
+
+# Test that an engine missing part of the interface fails when it is constructed, not on its first call
+def test_storage_interface():
+    class Incomplete(Storage):
+        def get_user(self, username):
+            return None
+
+    with pytest.raises(TypeError, match="abstract"):
+        Incomplete()
+
+# Test user operations of the storage interface
+def test_storage_users(storage):
+    assert storage.get_user("test_user") is None
+    assert storage.add_user(User(username="test_user", password="hash", is_seller=True))
+    assert not storage.add_user(User(username="test_user", password="other"))
+    storage.add_users([User(username="user{}".format(i), password="hash") for i in range(3)])
+    assert len(storage.list_users()) == 4
+
+    user = storage.get_user("test_user")
+    assert (user.username, user.password, user.is_seller, user.balance_in_cents) == ("test_user", "hash", True, 0)
+    user.is_seller = False
+    storage.save_user(user)
+    assert storage.get_user("test_user").is_seller is False
+    assert storage.set_seller("test_user", True) and storage.get_user("test_user").is_seller is True
+    assert not storage.set_seller("missing", True)
+
+    assert storage.add_to_balance("test_user", 150) == 150
+    assert storage.add_to_balance("test_user", 50) == 200
+    assert storage.add_to_balance("missing", 50) is None
+    assert storage.set_balance("test_user", 0)
+    assert not storage.set_balance("missing", 0)
+    assert storage.get_user("test_user").balance_in_cents == 0
+
+    assert storage.delete_user("test_user")
+    assert not storage.delete_user("test_user")
+    assert storage.get_user("test_user") is None
+
+# Test that changing the seller flag through one handle keeps a deposit committed through another since the user was read
+def test_sqlite_set_seller_keeps_balance(tmp_path):
+    path = str(tmp_path / "vending.db")
+    a, b = SQLiteStorage(path, pool_size=1), SQLiteStorage(path, pool_size=1)
+    try:
+        a.add_user(User(username="u", password="hash"))
+        assert a.get_user("u").balance_in_cents == 0
+        assert b.deposit("u", {100: 5}) == 500
+        assert a.set_seller("u", True)
+        user = b.get_user("u")
+        assert (user.is_seller, user.balance_in_cents) == (True, 500)
+    finally:
+        a.close()
+        b.close()
+
+# Test the bulk balance operations of the admin jobs: paging by role and one chunk per update_balances call
+def test_storage_bulk_balances(storage):
+    storage.add_users([User(username="user{:02d}".format(i), password="hash", is_seller=i % 3 == 0, balance_in_cents=100)
+                       for i in range(10)])
+    pages = list(storage.iter_username_pages(page_size=4))
+    assert sorted(name for page in pages for name in page) == ["user{:02d}".format(i) for i in range(10)]
+    assert max(len(page) for page in pages) == 4
+    sellers = [name for page in storage.iter_username_pages(page_size=4, is_seller=True) for name in page]
+    assert sorted(sellers) == ["user00", "user03", "user06", "user09"]
+
+    assert storage.update_balances(["user01", "user02", "missing"], "report") == (2, 200, 200)
+    assert storage.update_balances(["user00", "user01", "user02"], "add", -150, is_seller=False) == (2, 200, 0)
+    assert storage.update_balances(sellers, "set", 25) == (4, 400, 100)
+    assert storage.update_balances(["user00", "user01"], "add", 10) == (2, 25, 45)
+    assert [storage.get_user(name).balance_in_cents for name in ("user00", "user01", "user02", "user04")] == [35, 10, 0, 100]
+    with pytest.raises(ValueError):
+        storage.update_balances(["user00"], "double")
+
+# Test product operations of the storage interface
+def test_storage_products(storage):
+    assert storage.get_product(1) is None
+    assert storage.add_product(Product(id=1, name="Soda", price_in_cents=150, quantity=10, seller="test_user"))
+    assert not storage.add_product(Product(id=1, name="Chips", price_in_cents=200, quantity=1, seller="test_user"))
+    storage.add_products([Product(id=i, name="Item", price_in_cents=100, quantity=1, seller="other") for i in range(2, 5)])
+    assert [p.id for p in storage.list_products()] == [1, 2, 3, 4]
+
+    product = storage.get_product(1)
+    product.quantity = 0
+    storage.save_product(product)
+    assert storage.get_product(1).quantity == 0
+    assert storage.get_product(1).name == "Soda"
+
+    assert storage.delete_product(1)
+    assert not storage.delete_product(1)
+    storage.clear()
+    assert storage.list_products() == [] and storage.list_users() == []
+
+# Test that compact rows stay inside the engine: models go in and come out, changes need a save
+def test_storage_compact_rows():
+    storage = InMemoryStorage(compact=True)
+    storage.add_user(User(username="buyer", password="hash", balance_in_cents=100))
+    storage.add_products([Product(id=i, name="Item", price_in_cents=100, quantity=1, seller="".join(["sel", "ler"]))
+                          for i in range(2)])
+    assert type(storage.users["buyer"]) is UserRecord and type(storage.products[0]) is ProductRecord
+    assert storage.products[0].seller is storage.products[1].seller
+
+    user, product = storage.get_user("buyer"), storage.get_product(0)
+    assert (type(user), type(product)) == (User, Product)
+    assert product.model_dump() == {"id": 0, "name": "Item", "price_in_cents": 100, "quantity": 1, "seller": "seller", "price": "1.00"}
+    user.balance_in_cents = 0
+    product.quantity = 5
+    assert storage.get_user("buyer").balance_in_cents == 100 and storage.get_product(0).quantity == 1
+    storage.save_product(product)
+    assert storage.get_product(0).quantity == 5
+    assert all(type(p) is Product for p in storage.query_products(min_price_in_cents=0)[0])
+
+# Test that the handlers work unchanged on the SQLite engine
+@pytest.mark.asyncio
+async def test_handlers_on_sqlite(sqlite_storage):
+    await create_user(username="seller", password="abc", is_seller=True)
+    await create_user(username="buyer", password="xyz")
+    seller = await get_current_user(HTTPBasicCredentials(username="seller", password="abc"))
+    buyer = await get_current_user(HTTPBasicCredentials(username="buyer", password="xyz"))
+
+    await create_product(id=1, name="Soda", price=1.50, quantity=10, current_user=seller)
+    await deposit_coins(Deposit(coins_100=5), current_user=buyer)
+    response = await buy_products(product_id=1, quantity=2, current_user=buyer)
+    assert response["change"]["change_given"]["100"] == 2
+
+    assert sqlite_storage.get_user("buyer").balance_in_cents == 0
+    assert [p["quantity"] for p in json.loads((await read_products()).body)] == [8]
+    assert memory_storage.list_products() == []
+
+# Test that integers past the largest SQLite INTEGER get the same answer from every engine instead of a 500
+@pytest.mark.asyncio
+@pytest.mark.parametrize("engine", ["memory", "sqlite"])
+async def test_handlers_out_of_range_integers(engine, tmp_path):
+    backend = InMemoryStorage() if engine == "memory" else SQLiteStorage(str(tmp_path / "vending.db"), pool_size=2)
+    set_storage(backend)
+    product_cache.clear()
+    huge = 10 ** 20
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            await client.post("/users/", params={"username": "seller", "password": "pw", "is_seller": True})
+            await client.post("/users/", params={"username": "buyer", "password": "pw"})
+            responses = [
+                await client.get("/products/{}".format(huge)),
+                await client.post("/products/", params={"id": huge, "name": "Soda", "price": "1.00", "quantity": 1}, auth=("seller", "pw")),
+                await client.post("/deposit", json={"coins_100": huge}, auth=("buyer", "pw")),
+                await client.post("/deposit", json={"coins_100": 2 ** 62}, auth=("buyer", "pw")),  # 100 times that is too much
+                await client.post("/buy", params={"product_id": 1, "quantity": huge}, auth=("buyer", "pw")),
+                await client.post("/buy/batch", json=[{"product_id": huge, "quantity": 1}], auth=("buyer", "pw")),
+                await client.get("/products/", params={"cursor": str(huge)}),
+            ]
+        assert [response.status_code for response in responses] == [422, 422, 422, 422, 422, 422, 400]
+        assert backend.get_user("buyer").balance_in_cents == 0
+    finally:
+        set_storage(memory_storage)
+        product_cache.clear()
+        backend.close()
+
+# Test that carts and costs past the largest SQLite INTEGER are refused like any other unaffordable purchase
+def test_storage_purchase_out_of_range(storage):
+    storage.add_user(User(username="seller", password="hash", is_seller=True))
+    storage.add_user(User(username="buyer", password="hash", balance_in_cents=500))
+    storage.add_product(Product(id=1, name="Gold", price_in_cents=2 ** 62, quantity=4, seller="seller"))
+
+    with pytest.raises(PurchaseError) as exc_info:
+        storage.purchase_cart("buyer", [(1, 2 ** 62), (1, 2 ** 62)], no_change)
+    assert (exc_info.value.status_code, exc_info.value.detail) == (400, NOT_ENOUGH_STOCK)
+    with pytest.raises(PurchaseError) as exc_info:
+        storage.purchase("buyer", 1, 2, no_change)
+    assert (exc_info.value.status_code, exc_info.value.detail) == (400, "Insufficient balance")
+    assert storage.get_product(1).quantity == 4 and storage.get_user("buyer").balance_in_cents == 500
+
+def no_change(amount, coins):
+    return {"change_given": {"100": 0, "50": 0, "20": 0, "10": 0, "5": 0}, "unpaid_cents": amount}
+
+# Test purchase validation order and atomic updates
+def test_storage_purchase(storage):
+    storage.add_user(User(username="seller", password="hash", is_seller=True))
+    storage.add_user(User(username="buyer", password="hash", balance_in_cents=500))
+    storage.add_product(Product(id=1, name="Soda", price_in_cents=200, quantity=3, seller="seller"))
+
+    for args, expected in [(("buyer", 2, 1), (404, "Product not found")),
+                           (("buyer", 1, 0), (400, "Quantity must be positive integer")),
+                           (("buyer", 1, 4), (400, "Not enough products available")),
+                           (("seller", 1, 1), (400, "Seller can't buy their own products")),
+                           (("ghost", 1, 1), (404, "User not found")),
+                           (("buyer", 1, 3), (400, "Insufficient balance"))]:
+        with pytest.raises(PurchaseError) as exc_info:
+            storage.purchase(*args, make_change=no_change)
+        assert (exc_info.value.status_code, exc_info.value.detail) == expected
+
+    # rejected purchases leave no trace
+    assert storage.get_product(1).quantity == 3
+    assert storage.get_user("buyer").balance_in_cents == 500
+
+    total_cost, change, stock = storage.purchase("buyer", 1, 2, no_change)
+    assert total_cost == 400
+    assert change["unpaid_cents"] == 100
+    assert stock == {1: ("seller", 1)}
+    assert storage.get_product(1).quantity == 1
+    assert storage.get_user("buyer").balance_in_cents == 100
+
+# Test that a rejected cart line rolls back the lines before it
+def test_storage_purchase_cart(storage):
+    storage.add_user(User(username="seller", password="hash", is_seller=True))
+    storage.add_user(User(username="buyer", password="hash", balance_in_cents=1000))
+    storage.add_products([Product(id=i, name="Item", price_in_cents=100, quantity=2, seller="seller") for i in (1, 2, 3)])
+
+    with pytest.raises(PurchaseError) as exc_info:
+        storage.purchase_cart("buyer", [(1, 2), (2, 1), (3, 3)], no_change)
+    assert (exc_info.value.product_id, exc_info.value.detail) == (3, "Not enough products available")
+    with pytest.raises(PurchaseError) as exc_info:
+        storage.purchase_cart("buyer", [(1, 2), (2, 2), (3, 2), (1, 1)], no_change)
+    assert (exc_info.value.product_id, exc_info.value.detail) == (1, "Not enough products available")
+    # a negative line is rejected even when the total for its product is positive
+    with pytest.raises(PurchaseError) as exc_info:
+        storage.purchase_cart("buyer", [(1, 5), (1, -3)], no_change)
+    assert (exc_info.value.status_code, exc_info.value.detail) == (400, "Quantity must be positive integer")
+    assert [p.quantity for p in storage.list_products()] == [2, 2, 2]
+    assert storage.get_user("buyer").balance_in_cents == 1000
+
+    costs, total_cost, change, stock = storage.purchase_cart("buyer", [(1, 2), (3, 1)], no_change)
+    assert costs == {1: 200, 3: 100}
+    assert total_cost == 300
+    assert stock == {1: ("seller", 0), 3: ("seller", 1)}
+    assert [p.quantity for p in storage.list_products()] == [0, 2, 1]
+    assert storage.get_user("buyer").balance_in_cents == 700
+
+# Test that concurrent purchases from many threads never oversell or double-spend
+def test_storage_purchase_concurrency(storage):
+    threads, attempts, stock = 8, 250, 1000
+    storage.add_user(User(username="seller", password="hash", is_seller=True))
+    storage.add_users([User(username="buyer{}".format(t), password="hash", balance_in_cents=10 ** 6) for t in range(threads)])
+    storage.add_product(Product(id=1, name="Soda", price_in_cents=100, quantity=stock, seller="seller"))
+    sold = [0] * threads
+    remaining = []  # the stock every purchase saw right after itself
+
+    def buy_loop(t):
+        for _ in range(attempts):
+            try:
+                remaining.append(storage.purchase("buyer{}".format(t), 1, 1, no_change)[2][1][1])
+                sold[t] += 1
+            except PurchaseError as e:
+                assert e.detail == "Not enough products available"
+
+    workers = [threading.Thread(target=buy_loop, args=(t,)) for t in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert sum(sold) == stock
+    assert storage.get_product(1).quantity == 0
+    assert sorted(remaining) == list(range(stock))
+    for t in range(threads):
+        assert storage.get_user("buyer{}".format(t)).balance_in_cents == 10 ** 6 - 100 * sold[t]
+
+def all_pages(storage, limit, **filters):
+    ids, after = [], None
+    while True:
+        page, after = storage.query_products(after=after, limit=limit, **filters)
+        ids.extend(p.id for p in page)
+        if after is None:
+            return ids
+
+# Test filtered, paginated catalog queries and that every write keeps the indexes current
+def test_storage_query_products(storage):
+    storage.add_products([Product(id=i, name="Item", price_in_cents=100 * (10 - i % 5), quantity=i % 3, seller="s{}".format(i % 2))
+                          for i in range(1, 21) if i % 3])
+    storage.add_product(Product(id=30, name="Item", price_in_cents=100, quantity=1, seller="s0"))
+    storage.add_users([User(username="buyer", password="hash", balance_in_cents=10 ** 6)])
+    products = {p.id: p for p in storage.list_products()}
+
+    def expected(pred, by_price=False):
+        chosen = [p for p in products.values() if pred(p)]
+        return [p.id for p in sorted(chosen, key=lambda p: (p.price_in_cents, p.id) if by_price else p.id)]
+
+    for limit in (1, 3, 50):
+        assert all_pages(storage, limit) == expected(lambda p: True)
+        assert all_pages(storage, limit, seller="s1") == expected(lambda p: p.seller == "s1")
+        assert all_pages(storage, limit, in_stock=True) == expected(lambda p: p.quantity > 0)
+        assert all_pages(storage, limit, min_price_in_cents=700, max_price_in_cents=900) == \
+            expected(lambda p: 700 <= p.price_in_cents <= 900, True)
+        assert all_pages(storage, limit, seller="s0", min_price_in_cents=800, in_stock=True) == \
+            expected(lambda p: p.seller == "s0" and p.price_in_cents >= 800 and p.quantity > 0, True)
+
+    # update, purchase and delete move products in and out of the filtered views
+    product = storage.get_product(30)
+    product.price_in_cents = 950
+    product.seller = "s1"
+    storage.save_product(product)
+    assert 30 in all_pages(storage, 5, seller="s1", min_price_in_cents=950)
+    assert 30 not in all_pages(storage, 5, seller="s0")
+
+    storage.purchase("buyer", 30, 1, no_change)
+    assert 30 not in all_pages(storage, 5, in_stock=True)
+    assert 30 in all_pages(storage, 5, in_stock=False)
+
+    storage.delete_product(30)
+    assert 30 not in all_pages(storage, 5)
+    assert 30 not in all_pages(storage, 5, min_price_in_cents=0)
+
+# Test chunked upserts: inserts, updates, restocks and ids owned by another seller
+def test_storage_upsert_products(storage):
+    storage.add_products([Product(id=1, name="Soda", price_in_cents=100, quantity=5, seller="s0"),
+                          Product(id=2, name="Chips", price_in_cents=200, quantity=1, seller="s0"),
+                          Product(id=3, name="Gum", price_in_cents=50, quantity=1, seller="s1")])
+    storage.add_users([User(username="buyer", password="hash", balance_in_cents=10 ** 6)])
+    storage.purchase("buyer", 2, 1, no_change)  # sold out
+
+    rejected = storage.upsert_products([Product(id=2, name="Chips", price_in_cents=250, quantity=4, seller="s0"),
+                                        Product(id=3, name="Stolen", price_in_cents=10, quantity=9, seller="s0"),
+                                        Product(id=4, name="Water", price_in_cents=80, quantity=2, seller="s0")], "s0")
+    assert rejected == {3}
+    assert (storage.get_product(2).price_in_cents, storage.get_product(2).quantity) == (250, 4)
+    assert storage.get_product(3).name == "Gum"
+    assert storage.get_product(4).name == "Water"
+
+    assert all_pages(storage, 2) == [1, 2, 3, 4]
+    assert all_pages(storage, 2, in_stock=True) == [1, 2, 3, 4]
+    assert all_pages(storage, 2, seller="s0") == [1, 2, 4]
+    assert all_pages(storage, 2, min_price_in_cents=0) == [3, 4, 1, 2]
+    assert all_pages(storage, 2, min_price_in_cents=200, max_price_in_cents=200) == []
+
+# Test that a SQLite file with float prices is migrated to integer cents on open
+def test_sqlite_float_price_migration(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE users (username TEXT PRIMARY KEY, password TEXT NOT NULL,
+                            is_seller INTEGER NOT NULL DEFAULT 0, balance_in_cents INTEGER NOT NULL DEFAULT 0);
+        CREATE TABLE products (id INTEGER PRIMARY KEY, name TEXT NOT NULL, price REAL NOT NULL,
+                               quantity INTEGER NOT NULL, seller TEXT NOT NULL);
+        INSERT INTO users VALUES ('buyer', 'hash', 0, 93.00000000000001);
+        INSERT INTO products VALUES (1, 'Gum', 0.07, 5, 'seller'), (2, 'Soda', 1.15, 5, 'seller');
+    """)
+    conn.commit()
+    conn.close()
+
+    storage = SQLiteStorage(path, pool_size=1)
+    assert [p.price_in_cents for p in storage.list_products()] == [7, 115]
+    assert storage.get_user("buyer").balance_in_cents == 93
+    assert isinstance(storage.get_user("buyer").balance_in_cents, int)
+    storage.close()
+
+# Test that deposits fill the coin inventory and change is paid from it
+def test_storage_coin_inventory(storage):
+    storage.add_user(User(username="seller", password="hash", is_seller=True))
+    storage.add_user(User(username="buyer", password="hash"))
+    storage.add_product(Product(id=1, name="Soda", price_in_cents=50, quantity=10, seller="seller"))
+
+    assert storage.deposit("buyer", {100: 1, 20: 2}) == 140
+    assert storage.deposit("ghost", {100: 1}) is None
+    assert storage.coin_inventory() == {100: 1, 50: 0, 20: 2, 10: 0, 5: 0}
+
+    # 90 left after paying 50: only two 20 coins can be handed out
+    _, change, _ = storage.purchase("buyer", 1, 1, make_change)
+    assert change["change_given"]["20"] == 2 and change["unpaid_cents"] == 50
+    assert storage.get_user("buyer").balance_in_cents == 50
+    assert storage.coin_inventory() == {100: 1, 50: 0, 20: 0, 10: 0, 5: 0}
+
+    # refilled machine pays the rest
+    storage.add_coins({50: 1})
+    assert storage.deposit("buyer", {50: 1}) == 100
+    _, change, _ = storage.purchase("buyer", 1, 1, make_change)
+    assert change["change_given"]["50"] == 1 and change["unpaid_cents"] == 0
+    assert storage.coin_inventory() == {100: 1, 50: 1, 20: 0, 10: 0, 5: 0}
+
+# Test that purchases feed the sales ledger and the totals per product, per seller and per bucket
+def test_storage_sales(storage, monkeypatch):
+    storage.add_users([User(username="seller", password="h", is_seller=True), User(username="other", password="h", is_seller=True),
+                       User(username="buyer", password="h", balance_in_cents=10000)])
+    storage.add_products([Product(id=1, name="Soda", price_in_cents=150, quantity=10, seller="seller"),
+                          Product(id=2, name="Gum", price_in_cents=50, quantity=10, seller="seller"),
+                          Product(id=3, name="Chips", price_in_cents=100, quantity=10, seller="other")])
+    clock = [7200.0 * 1000]
+    monkeypatch.setattr("storage.time.time", lambda: clock[0])
+    storage.purchase("buyer", 1, 2, make_change)
+    clock[0] += 1800
+    storage.purchase_cart("buyer", [(1, 1), (2, 3), (3, 1)], make_change)
+    clock[0] += 3600
+    storage.purchase("buyer", 2, 1, make_change)
+    with pytest.raises(PurchaseError):
+        storage.purchase("buyer", 1, 100, make_change)  # rejected purchases are not sales
+
+    hour = 7200 * 1000
+    assert [sale for _, sale in storage.iter_sales()][:2] == [(hour, "buyer", 1, "seller", 2, 300), (hour + 1800.0, "buyer", 1, "seller", 1, 150)]
+    assert len(list(storage.iter_sales())) == 5
+    assert storage.sales_totals("seller", "seller", 0, 2 ** 40) == ("seller", 4, 7, 650, [(hour, 3, 6, 600), (hour + 3600, 1, 1, 50)])
+    assert storage.sales_totals("seller", "seller", hour + 3600, 2 ** 40)[4] == [(hour + 3600, 1, 1, 50)]
+    assert storage.sales_totals("product", 1, 0, 2 ** 40) == ("seller", 2, 3, 450, [(hour, 2, 3, 450)])
+    assert storage.sales_totals("product", 3, 0, hour)[:4] == ("other", 1, 1, 100)
+    assert storage.sales_totals("product", 4, 0, 2 ** 40) is None
+    assert storage.sales_totals("seller", "buyer", 0, 2 ** 40) is None
+
+    storage.add_sales([(hour + 7200.0, "buyer", 3, "other", 4, 400)])
+    assert storage.sales_totals("seller", "other", 0, 2 ** 40) == ("other", 2, 5, 500, [(hour, 1, 1, 100), (hour + 7200, 1, 4, 400)])
+
+    # product 2 deleted and its id reused by another seller: its totals start over
+    storage.delete_product(2)
+    storage.add_product(Product(id=2, name="Mints", price_in_cents=20, quantity=10, seller="other"))
+    storage.purchase("buyer", 2, 1, make_change)
+    assert storage.sales_totals("product", 2, 0, 2 ** 40) == ("other", 1, 1, 20, [(hour + 3600, 1, 1, 20)])
+    assert storage.sales_totals("seller", "seller", 0, 2 ** 40)[:4] == ("seller", 4, 7, 650)
+    storage.clear()
+    assert list(storage.iter_sales()) == [] and storage.sales_totals("seller", "other", 0, 2 ** 40) is None
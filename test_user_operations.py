@@ -38,11 +38,11 @@ async def test_read_user(clean_users_db):
 
     # Test unauthorized access
     with pytest.raises(HTTPException) as exc_info:
-        await read_user(username="test_user", current_user=get_current_user(other_user))
+        await read_user(username="test_user", current_user=await get_current_user(other_user))
     assert exc_info.value.status_code == status.HTTP_401_UNAUTHORIZED
 
     # Test valid case
-    user = await read_user(username="test_user", current_user=get_current_user(curr_user))
+    user = await read_user(username="test_user", current_user=await get_current_user(curr_user))
     assert user == {"username": "test_user", "is_seller": True, "balance_in_cents": 0}
 
 # Test read_users function
@@ -68,19 +68,19 @@ async def test_update_seller_status(clean_users_db):
 
     # Test unauthorized access
     with pytest.raises(HTTPException) as exc_info:
-        await update_seller_status(username="test_user", is_seller=False, current_user=get_current_user(other_user))
+        await update_seller_status(username="test_user", is_seller=False, current_user=await get_current_user(other_user))
     assert exc_info.value.status_code == status.HTTP_401_UNAUTHORIZED
 
     # Test already seller status
-    response = await update_seller_status(username="test_user", is_seller=True, current_user=get_current_user(curr_user))
+    response = await update_seller_status(username="test_user", is_seller=True, current_user=await get_current_user(curr_user))
     assert response == {"message": "User test_user is already a seller"}
 
     # Test already not a seller status
-    response = await update_seller_status(username="other_user", is_seller=False, current_user=get_current_user(other_user))
+    response = await update_seller_status(username="other_user", is_seller=False, current_user=await get_current_user(other_user))
     assert response == {"message": "User other_user is already not a seller"}
 
     # Test valid case
-    response = await update_seller_status(username="updated_user", is_seller=True, current_user=get_current_user(update_user))
+    response = await update_seller_status(username="updated_user", is_seller=True, current_user=await get_current_user(update_user))
     assert response == {"username": "updated_user", "is_seller": True}
 
 # Test delete_user function
@@ -89,10 +89,28 @@ async def test_delete_user(clean_users_db):
     # Test unauthorized access
     await create_user(username="test_user", password="abc", is_seller=True)
     with pytest.raises(HTTPException) as exc_info:
-        await delete_user(username="test_user", current_user=get_current_user(other_user))
+        await delete_user(username="test_user", current_user=await get_current_user(other_user))
     assert exc_info.value.status_code == status.HTTP_401_UNAUTHORIZED
 
     # Test valid case
-    response = await delete_user(username="test_user", current_user=get_current_user(curr_user))
+    response = await delete_user(username="test_user", current_user=await get_current_user(curr_user))
     assert response == {"message": "User test_user was deleted successfully"}
     assert len(users_db) == 0
+
+# Test that cached credentials do not outlive a deleted user
+@pytest.mark.asyncio
+async def test_get_current_user_after_delete(clean_users_db):
+    await create_user(username="test_user", password="abc", is_seller=True)
+    assert (await get_current_user(curr_user)).username == "test_user"
+    assert (await get_current_user(curr_user)).username == "test_user"
+
+    await delete_user(username="test_user", current_user=await get_current_user(curr_user))
+    with pytest.raises(HTTPException) as exc_info:
+        await get_current_user(curr_user)
+    assert exc_info.value.status_code == status.HTTP_401_UNAUTHORIZED
+
+    # re-created with another password: the old password must be rejected
+    await create_user(username="test_user", password="new", is_seller=True)
+    with pytest.raises(HTTPException) as exc_info:
+        await get_current_user(curr_user)
+    assert exc_info.value.status_code == status.HTTP_401_UNAUTHORIZED
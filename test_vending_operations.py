@@ -1,9 +1,16 @@
+import asyncio
+
+import bcrypt
+import httpx
 import pytest
 from fastapi import HTTPException, status
-from vending_operations import deposit_coins, buy_products, reset_deposit, compute_change
-from models import User, Deposit
+import settings
+from main import app
+from vending_operations import deposit_coins, buy_products, buy_cart, reset_deposit, compute_change, coins_db
+from models import User, Product, Deposit, CartItem
 from user_operations import users_db, create_user
 from product_operations import products_db, create_product
+from response_cache import product_cache
 
 # Dummy test users
 zero_balance_user = User(username="test_user", password="abc", is_seller=True, balance_in_cents=0)
@@ -15,9 +22,13 @@ reset_user = User(username="reset_user", password="mno", is_seller=False, balanc
 def clean_users_and_products_db():
     users_db.clear()
     products_db.clear()
+    product_cache.clear()
+    coins_db.update({coin: 10 for coin in coins_db}) # machine starts with a float to pay change from
     yield
     users_db.clear()
     products_db.clear()
+    product_cache.clear()
+    coins_db.update({coin: 0 for coin in coins_db})
 
 # Test deposit_coins function
 @pytest.mark.asyncio
@@ -31,6 +42,9 @@ async def test_deposit_coins(clean_users_and_products_db):
     await deposit_coins(Deposit(coins_5=0, coins_10=0, coins_20=0, coins_50=1, coins_100=1), current_user=zero_balance_user)
     assert users_db["test_user"].balance_in_cents == 210
 
+    # deposited coins refill the machine
+    assert coins_db == {100: 11, 50: 11, 20: 11, 10: 13, 5: 12}
+
 # Test compute_change function
 def test_compute_change():
     change = compute_change(123)
@@ -84,17 +98,99 @@ async def test_buy_products(clean_users_and_products_db):
     assert exc_info.value.status_code == status.HTTP_400_BAD_REQUEST
     assert exc_info.value.detail == "Seller can't buy their own products"
 
+# Test buy_cart function
+@pytest.mark.asyncio
+async def test_buy_cart(clean_users_and_products_db):
+    await create_product(id=1, name="Soda", price=1.50, quantity=10, current_user=zero_balance_user)
+    await create_product(id=2, name="Chips", price=0.75, quantity=2, current_user=zero_balance_user)
+    users_db["buyer"] = User(username="buyer", password="xyz", is_seller=False, balance_in_cents=500)
+
+    # Test a cart that fails on its last line: nothing is bought
+    with pytest.raises(HTTPException) as exc_info:
+        await buy_cart([CartItem(product_id=1, quantity=1), CartItem(product_id=2, quantity=3)], current_user=buyer)
+    assert exc_info.value.status_code == status.HTTP_400_BAD_REQUEST
+    assert exc_info.value.detail == "ProductId 2: Not enough products available"
+    assert products_db[1].quantity == 10
+    assert users_db["buyer"].balance_in_cents == 500
+
+    # Test repeated lines of the same product are checked against their total
+    with pytest.raises(HTTPException) as exc_info:
+        await buy_cart([CartItem(product_id=2, quantity=1), CartItem(product_id=2, quantity=2)], current_user=buyer)
+    assert exc_info.value.detail == "ProductId 2: Not enough products available"
+
+    # Test empty cart and unknown product
+    with pytest.raises(HTTPException) as exc_info:
+        await buy_cart([], current_user=buyer)
+    assert exc_info.value.status_code == status.HTTP_400_BAD_REQUEST
+    with pytest.raises(HTTPException) as exc_info:
+        await buy_cart([CartItem(product_id=99, quantity=1)], current_user=buyer)
+    assert exc_info.value.status_code == status.HTTP_404_NOT_FOUND
+
+    # Test valid cart: change is computed once on the final balance
+    response = await buy_cart([CartItem(product_id=1, quantity=2), CartItem(product_id=2, quantity=1),
+                               CartItem(product_id=2, quantity=1)], current_user=buyer)
+    assert response == {
+        "message": "Cart purchased successfully",
+        "items": [{"product_id": 1, "quantity_purchased": 2, "cost": 300},
+                  {"product_id": 2, "quantity_purchased": 2, "cost": 150}],
+        "total_cost": 450,
+        "change": {"change_given": {"100": 0, "50": 1, "20": 0, "10": 0, "5": 0}, "unpaid_cents": 0}
+    }
+    assert products_db[1].quantity == 8
+    assert products_db[2].quantity == 0
+    assert users_db["buyer"].balance_in_cents == 0
+
 # Test reset_deposit function
 @pytest.mark.asyncio
-async def test_reset_deposit(clean_users_and_products_db):
-    users_db["reset_user"] = reset_user
+async def test_reset_deposit(clean_users_and_products_db, monkeypatch):
+    users_db["reset_user"] = reset_user.model_copy()
+    users_db["buyer"] = buyer.model_copy(update={"balance_in_cents": 100})
 
-    # Test reset deposit with valid input
-    response = await reset_deposit(username="reset_user")
+    # Test reset deposit of the caller's own account
+    response = await reset_deposit(username="reset_user", current_user=reset_user)
     assert response == {"message": "Deposit reset successful"}
     assert users_db["reset_user"].balance_in_cents == 0
 
+    # Test reset deposit of another user's account
+    with pytest.raises(HTTPException) as exc_info:
+        await reset_deposit(username="buyer", current_user=reset_user)
+    assert exc_info.value.status_code == status.HTTP_401_UNAUTHORIZED
+    assert users_db["buyer"].balance_in_cents == 100
+
+    # Test that an admin can reset any account
+    monkeypatch.setattr(settings, "ADMIN_USERS", frozenset(["reset_user"]))
+    await reset_deposit(username="buyer", current_user=reset_user)
+    assert users_db["buyer"].balance_in_cents == 0
+
     # Test reset deposit with invalid user
     with pytest.raises(HTTPException) as exc_info:
-        await reset_deposit(username="non_existent_user")
+        await reset_deposit(username="non_existent_user", current_user=reset_user)
     assert exc_info.value.status_code == status.HTTP_404_NOT_FOUND
+
+# Test thousands of concurrent /buy requests against one product through the ASGI app
+@pytest.mark.asyncio
+async def test_buy_products_concurrent_requests(clean_users_and_products_db):
+    buyers, stock = 2000, 1500
+    hashed = bcrypt.hashpw(b"pw", bcrypt.gensalt(rounds=4)).decode("utf-8")
+    users_db["seller"] = User(username="seller", password=hashed, is_seller=True)
+    for i in range(buyers):
+        users_db["buyer{}".format(i)] = User(username="buyer{}".format(i), password=hashed, balance_in_cents=100)
+    products_db[1] = Product(id=1, name="Soda", price_in_cents=100, quantity=stock, seller="seller")
+
+    # stay below the hashing pool's backpressure limit, otherwise part of the storm is answered with 503
+    in_flight = asyncio.Semaphore(128)
+
+    async def buy(client, i):
+        async with in_flight:
+            return await client.post("/buy", params={"product_id": 1, "quantity": 1}, auth=("buyer{}".format(i), "pw"))
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        responses = await asyncio.gather(*(buy(client, i) for i in range(buyers)))
+
+    succeeded = [r for r in responses if r.status_code == 200]
+    assert len(succeeded) == stock
+    assert all(r.json()["detail"] == "Not enough products available" for r in responses if r.status_code != 200)
+    assert products_db[1].quantity == 0
+    # every cent is either spent on the product or still in a balance
+    spent = sum(r.json()["total_cost"] for r in succeeded)
+    assert spent + sum(u.balance_in_cents for u in users_db.values()) == buyers * 100
@@ -0,0 +1,152 @@
+import asyncio
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+import httpx
+import pytest
+from storage import SQLiteStorage, prepare_for_workers
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SELLER = ("seller", "pw")
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+# n single-process uvicorn workers on their own ports sharing one SQLite file, so every request lands on a known worker
+@contextmanager
+def workers(n, url):
+    prepare_for_workers(url, n)
+    env = dict(os.environ, STORAGE_URL=url, BCRYPT_ROUNDS="4", METRICS_ENABLED="false")
+    ports = [free_port() for _ in range(n)]
+    processes = [subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+                                  cwd=ROOT, env=env) for port in ports]
+    try:
+        urls = ["http://127.0.0.1:{}".format(port) for port in ports]
+        for url in urls:
+            for _ in range(200):
+                try:
+                    httpx.get(url + "/products/", params={"limit": 1})
+                    break
+                except httpx.TransportError:
+                    time.sleep(0.05)
+            else:
+                raise RuntimeError("worker {} did not start".format(url))
+        yield urls
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=10)
+
+# Test that the launcher refuses engines that keep their state in one process
+def test_prepare_for_workers(tmp_path):
+    prepare_for_workers("memory://", 1)
+    with pytest.raises(ValueError):
+        prepare_for_workers("memory://", 4)
+    with pytest.raises(ValueError):
+        prepare_for_workers("journal:///{}".format(tmp_path / "journal"), 2)
+    prepare_for_workers("sqlite:///{}".format(tmp_path / "shared.db"), 4)
+    assert (tmp_path / "shared.db").exists()
+
+# Test that deposits and purchases spread over several workers stay consistent: no lost deposit,
+# no double spend of a balance and no oversold stock
+@pytest.mark.asyncio
+async def test_workers_consistency(tmp_path):
+    n, buyers, stock = 3, 12, 8
+    path = str(tmp_path / "shared.db")
+    with workers(n, "sqlite:///" + path) as urls:
+        clients = [httpx.AsyncClient(base_url=url) for url in urls]
+        try:
+            await clients[0].post("/users/", params={"username": SELLER[0], "password": SELLER[1], "is_seller": True})
+            response = await clients[1 % n].post("/products/", auth=SELLER, params={"id": 1, "name": "Soda", "price": "1.00", "quantity": stock})
+            assert response.status_code == 200, response.text
+            names = ["buyer{}".format(i) for i in range(buyers)]
+            for i, name in enumerate(names):
+                assert (await clients[i % n].post("/users/", params={"username": name, "password": "pw"})).status_code == 200
+
+            # every buyer deposits one coin on every worker at the same time, while another worker flips its seller flag
+            deposits = await asyncio.gather(*(client.post("/deposit", json={"coins_100": 1}, auth=(name, "pw"))
+                                              for name in names for client in clients),
+                                            *(clients[(i + 1) % n].put("/users/{}/seller".format(name), params={"is_seller": True},
+                                                                        auth=(name, "pw"))
+                                              for i, name in enumerate(names)))
+            assert all(response.status_code == 200 for response in deposits)
+            # then tries to buy on every worker at once: a purchase spends the whole balance, so each buyer
+            # gets at most one unit, and only `stock` buyers get one at all
+            attempts = [(name, client) for name in names for client in clients]
+            buys = await asyncio.gather(*(client.post("/buy", params={"product_id": 1, "quantity": 1}, auth=(name, "pw"))
+                                          for name, client in attempts))
+        finally:
+            for client in clients:
+                await client.aclose()
+
+    winners = [name for (name, _), response in zip(attempts, buys) if response.status_code == 200]
+    assert len(winners) == stock and len(set(winners)) == stock
+    storage = SQLiteStorage(path, pool_size=1)
+    try:
+        assert storage.get_product(1).quantity == 0
+        for name in names:
+            user = storage.get_user(name)
+            assert user.is_seller and user.balance_in_cents == (0 if name in winners else n * 100)
+        # deposited coins minus the change paid out to the winners
+        assert storage.coin_inventory()[100] == buyers * n - stock * (n - 1)
+    finally:
+        storage.close()
+
+# Test that a worker never serves a product body cached before another worker changed the product
+@pytest.mark.asyncio
+async def test_workers_product_reads(tmp_path):
+    with workers(2, "sqlite:///" + str(tmp_path / "shared.db")) as urls:
+        first, second = httpx.AsyncClient(base_url=urls[0]), httpx.AsyncClient(base_url=urls[1])
+        try:
+            await first.post("/users/", params={"username": SELLER[0], "password": SELLER[1], "is_seller": True})
+            await first.post("/users/", params={"username": "buyer", "password": "pw"})
+            await first.post("/products/", auth=SELLER, params={"id": 1, "name": "Soda", "price": "1.00", "quantity": 10})
+            assert (await second.get("/products/1")).json()["quantity"] == 10
+            assert (await first.post("/deposit", json={"coins_100": 3}, auth=("buyer", "pw"))).status_code == 200
+            assert (await first.post("/buy", params={"product_id": 1, "quantity": 3}, auth=("buyer", "pw"))).status_code == 200
+            assert (await second.get("/products/1")).json()["quantity"] == 7
+            assert (await second.get("/products/all")).json()[0]["quantity"] == 7
+        finally:
+            await first.aclose()
+            await second.aclose()
+
+# one load generator: sequential product reads against url for a number of seconds
+def read_loop(url, seconds, results):
+    count = 0
+    with httpx.Client(base_url=url) as client:
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            client.get("/products/1")
+            count += 1
+    results.put(count / seconds)
+
+def read_throughput(urls, seconds):
+    results = multiprocessing.Queue()
+    clients = [multiprocessing.Process(target=read_loop, args=(url, seconds, results)) for url in urls]
+    for client in clients:
+        client.start()
+    total = sum(results.get() for _ in clients)
+    for client in clients:
+        client.join()
+    return total
+
+# Test that read throughput grows about linearly with the number of workers (one load generator per worker)
+@pytest.mark.skipif((os.cpu_count() or 1) < 4, reason="needs a core for every worker and every load generator")
+def test_workers_read_scaling(tmp_path):
+    n = min(4, os.cpu_count() // 2)
+    url = "sqlite:///{}".format(tmp_path / "shared.db")
+    with workers(n, url) as urls:
+        httpx.post(urls[0] + "/users/", params={"username": SELLER[0], "password": SELLER[1], "is_seller": True})
+        httpx.post(urls[0] + "/products/", auth=SELLER, params={"id": 1, "name": "Soda", "price": "1.00", "quantity": 10})
+        read_throughput(urls, 0.5)  # warm up
+        single = read_throughput(urls[:1], 2)
+        scaled = read_throughput(urls, 2)
+    assert scaled >= 0.6 * n * single, "{} workers: {:.0f} reads/s, 1 worker: {:.0f} reads/s".format(n, scaled, single)
@@ -1,20 +1,30 @@
 # CRUD OPERATIONS FOR USERS
 
+from typing import List, Union
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
-from fastapi import APIRouter, HTTPException, Depends, status
-from models import User
-from security import verify_password, hash_password
+from fastapi import APIRouter, HTTPException, Depends, Request, status
+from models import User, Message, UserInfo, SellerStatus
+from security import hash_password_async, credential_cache
+from storage import get_storage, memory_storage
+from metrics import timed_route_class
+from ratelimit import rate_limiter, client_ip
 
 security = HTTPBasic()
-user_router = APIRouter()
-users_db = {} #using a dictionary for this task, but for production apps would use a real DB
-
-# Dependency to get current auth user
-def get_current_user(credentials: HTTPBasicCredentials = Depends(security)):
-    user = None
-    if credentials.username in users_db:
-        user = users_db[credentials.username]
-    if not user or not verify_password(credentials.password, user.password):
+user_router = APIRouter(route_class=timed_route_class("users"))
+users_db = memory_storage.users # tables of the default in-memory engine, see storage.py for the other engines
+
+# Dependency to get current auth user.
+# Cached credentials authenticate right away. Otherwise failed checks spend the auth_failure budget of the username from
+# this client address, and an exhausted budget is a 429 before bcrypt: guesses from one address cannot lock the user
+# out from the others
+async def get_current_user(credentials: HTTPBasicCredentials = Depends(security), request: Request = None):
+    user = get_storage().get_user(credentials.username)
+    if user is not None and credential_cache.cached(credentials.username, credentials.password, user.password):
+        return user
+    ip = client_ip(request)
+    rate_limiter.check_budget("auth_failure", user=credentials.username, ip=ip)
+    if not user or not await credential_cache.verify_async(credentials.username, credentials.password, user.password, lookup=False):
+        rate_limiter.spend("auth_failure", user=credentials.username, ip=ip)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid username or password",
@@ -22,63 +32,85 @@ def get_current_user(credentials: HTTPBasicCredentials = Depends(security)):
         )
     return user
 
+# Dependencies enforcing the per-route limits of ratelimit.py, the authenticated one runs after get_current_user
+def rate_limited(route):
+    async def check_rate_limit(request: Request, current_user: User = Depends(get_current_user)):
+        rate_limiter.check(route, user=current_user.username, ip=client_ip(request))
+    return check_rate_limit
+
+async def signup_rate_limit(request: Request):
+    rate_limiter.check("signup", ip=client_ip(request))
+
 #CREATE
-@user_router.post("/users/")
+@user_router.post("/users/", response_model=Message, dependencies=[Depends(signup_rate_limit)])
 async def create_user(username: str, password: str, is_seller: bool=False):
-    if username in users_db:
+    storage = get_storage()
+    if storage.get_user(username) is not None:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="User already exists")
-    
-    user = User(username=username,password=password,is_seller=is_seller,balance=0)
-    users_db[username] = user
-    hashed_password = hash_password(password)
-    users_db[username].password = hashed_password
-    
+
+    # hash on the worker pool before the user becomes visible, add_user rejects a concurrent signup
+    hashed_password = await hash_password_async(password)
+    user = User(username=username,password=hashed_password,is_seller=is_seller,balance=0)
+    if not storage.add_user(user):
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="User already exists")
+    credential_cache.invalidate(username)
+    await storage.sync()
+
     return {"message": "User {} was created successfully".format(user.username)}
 
 #READ
-@user_router.get("/users/{username}")
+@user_router.get("/users/{username}", response_model=UserInfo)
 async def read_user(username: str, current_user: User = Depends(get_current_user)):
     if current_user.username != username:
         raise HTTPException(status.HTTP_401_UNAUTHORIZED, detail="Cannot access other user's details")
-    if username not in users_db:
+    user = get_storage().get_user(username)
+    if user is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail="User not found")
-    
-    return { "username" : username, 
-             "is_seller" : users_db[username].is_seller,
-             "balance_in_cents": users_db[username].balance_in_cents
+
+    return { "username" : username,
+             "is_seller" : user.is_seller,
+             "balance_in_cents": user.balance_in_cents
     }
 
-@user_router.get("/users/") #used for testing/debugging purposes
+@user_router.get("/users/", response_model=List[UserInfo]) #used for testing/debugging purposes, without the password hashes
 async def read_users():
-    return list(users_db.values())
+    return [{"username": user.username, "is_seller": user.is_seller, "balance_in_cents": user.balance_in_cents}
+            for user in get_storage().list_users()]
 
 #UPDATE
-@user_router.put("/users/{username}/seller")
+@user_router.put("/users/{username}/seller", response_model=Union[SellerStatus, Message])
 async def update_seller_status(username: str, is_seller: bool, current_user: User = Depends(get_current_user)):
-    if username not in users_db:
+    storage = get_storage()
+    user = storage.get_user(username)
+    if user is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail="User not found")
-    
+
     if current_user.username != username:
         raise HTTPException(status.HTTP_401_UNAUTHORIZED, detail="Cannot update other user's details")
-    
-    if users_db[username].is_seller == is_seller:
-        if is_seller: 
+
+    if user.is_seller == is_seller:
+        if is_seller:
             return {"message": "User {} is already a seller".format(username)}
         else:
             return {"message": "User {} is already not a seller".format(username)}
-        
-    users_db[username].is_seller = is_seller
-    return { "username" : username, 
-             "is_seller" : users_db[username].is_seller,
+
+    if not storage.set_seller(username, is_seller):
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="User not found")
+    await storage.sync()
+    return { "username" : username,
+             "is_seller" : is_seller,
     }
 
 #DELETE
-@user_router.delete("/users/{username}")
+@user_router.delete("/users/{username}", response_model=Message)
 async def delete_user(username: str, current_user: User = Depends(get_current_user)):
-    if username not in users_db:
+    storage = get_storage()
+    if storage.get_user(username) is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail="User not found")
     if current_user.username != username:
         raise HTTPException(status.HTTP_401_UNAUTHORIZED, detail="Cannot delete other user")
 
-    del users_db[username]
+    storage.delete_user(username)
+    credential_cache.invalidate(username)
+    await storage.sync()
     return {"message": "User {} was deleted successfully".format(username)}
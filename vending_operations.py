@@ -1,71 +1,103 @@
 # OPERATIONS FOR VENDING MACHINE
 
+from typing import List
 from fastapi import APIRouter, HTTPException, Depends, status
-from models import User, Deposit
-from user_operations import users_db, get_current_user
-from product_operations import products_db
+import settings
+from models import User, Deposit, CartItem, StorableInt, Message, DepositResult, PurchaseResult, CartResult
+from user_operations import get_current_user, rate_limited
+from storage import get_storage, merge_lines, memory_storage, PurchaseError, NOT_ENOUGH_STOCK
+from change import compute_change, make_change # compute_change: change from an unlimited supply of coins
+from metrics import STAGE_SECONDS, COINS_DEPOSITED, UNITS_SOLD, STOCK_OUTS
+from response_cache import invalidate_products
+from idempotency import idempotent, idempotent_route_class
+from events import publish_purchase
 
-vending_router = APIRouter()
+vending_router = APIRouter(route_class=idempotent_route_class("vending"))
+coins_db = memory_storage.coins # coin inventory of the default in-memory engine
 
-# Deposit coins
-@vending_router.post("/deposit")
-async def deposit_coins(deposit: Deposit, current_user: User = Depends(get_current_user)):
-    # assumption: a user with a non-buyer role can also deposit money
-    users_db[current_user.username].balance_in_cents += (deposit.coins_5 * 5) + \
-        (deposit.coins_10 * 10) + (deposit.coins_20 * 20) + \
-        (deposit.coins_50 * 50) + (deposit.coins_100 * 100)
-
-    return {"message": "Deposit successful", "balance_in_cents": users_db[current_user.username].balance_in_cents}
+# make_change as passed to the storage engines, timed as the compute_change stage
+def timed_make_change(amount, available):
+    with STAGE_SECONDS.time("compute_change"):
+        return make_change(amount, available)
 
-# helper function to compute change
-def compute_change(amount):
-    denominations = [100, 50, 20, 10, 5]
-    change_in_coins = {str(coin): 0 for coin in denominations}
+def record_purchase_error(e):
+    if e.detail == NOT_ENOUGH_STOCK:
+        STOCK_OUTS.inc(str(e.product_id))
 
-    # Compute the change in coins
-    for coin in denominations:
-        while amount >= coin:
-            amount -= coin
-            change_in_coins[str(coin)] += 1
+# Deposit coins, retries with the same Idempotency-Key get the first response back (see idempotency.py)
+@vending_router.post("/deposit", response_model=DepositResult, dependencies=[Depends(rate_limited("deposit"))])
+@idempotent
+async def deposit_coins(deposit: Deposit, current_user: User = Depends(get_current_user)):
+    # assumption: a user with a non-buyer role can also deposit money
+    # the coins go into the machine's inventory and are used to pay out change later
+    coins = {5: deposit.coins_5, 10: deposit.coins_10, 20: deposit.coins_20, 50: deposit.coins_50, 100: deposit.coins_100}
+    storage = get_storage()
+    balance_in_cents = storage.deposit(current_user.username, coins)
+    if balance_in_cents is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="User not found")
+    await storage.sync()
+    for coin, count in coins.items():
+        if count:
+            COINS_DEPOSITED.inc(str(coin), amount=count)
 
-    return {"change_given": change_in_coins, "unpaid_cents": amount}
+    return {"message": "Deposit successful", "balance_in_cents": balance_in_cents}
 
 # Buy products
-@vending_router.post("/buy")
-async def buy_products(product_id: int, quantity: int, current_user: User = Depends(get_current_user)):
-    if product_id not in products_db:
-        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Product not found")
-    
-    product = products_db[product_id]
-    if quantity <= 0:
-        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Quantity must be positive integer")
-    
-    if product.quantity < quantity:
-        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Not enough products available")
-    
-    #Assumption: Seller of product won't buy their own product but is allowed to buy other user's products 
-    if product.seller == current_user.username:
-        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Seller can't buy their own products")
-   
-    price_in_cents = product.price * 100
-    total_cost = price_in_cents * quantity
-    if users_db[current_user.username].balance_in_cents < total_cost:
-        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Insufficient balance")
-    
-    users_db[current_user.username].balance_in_cents -= total_cost
-    products_db[product_id].quantity -= quantity
-    change = compute_change(users_db[current_user.username].balance_in_cents)
-    users_db[current_user.username].balance_in_cents = change["unpaid_cents"]
+@vending_router.post("/buy", response_model=PurchaseResult, dependencies=[Depends(rate_limited("buy"))])
+@idempotent
+async def buy_products(product_id: StorableInt, quantity: StorableInt, current_user: User = Depends(get_current_user)):
+    # validation, stock decrement, charge and change (paid from the coin inventory) happen atomically inside the storage engine
+    storage = get_storage()
+    try:
+        total_cost, change, stock = storage.purchase(current_user.username, product_id, quantity, timed_make_change)
+    except PurchaseError as e:
+        record_purchase_error(e)
+        raise HTTPException(e.status_code, detail=e.detail)
+    invalidate_products((product_id,))  # stock changed
+    await storage.sync()
+    UNITS_SOLD.inc(str(product_id), amount=quantity)
+    publish_purchase({product_id: quantity}, stock)
 
     return {"message": "ProductId {} purchased successfully".format(product_id), 
             "quanity_purchased": quantity,
             "total_cost": total_cost,
             "change": change}
 
-# Reset deposit
-@vending_router.post("/reset/{username}")
-async def reset_deposit(username: str):
-    if username not in users_db:
+# Buy a cart of products in one request: all lines succeed or none do, change is computed once at the end
+@vending_router.post("/buy/batch", response_model=CartResult, dependencies=[Depends(rate_limited("buy"))])
+@idempotent
+async def buy_cart(items: List[CartItem], current_user: User = Depends(get_current_user)):
+    if not items:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Cart is empty")
+
+    lines = [(item.product_id, item.quantity) for item in items]
+    storage = get_storage()
+    try:
+        costs, total_cost, change, stock = storage.purchase_cart(current_user.username, lines, timed_make_change)
+    except PurchaseError as e:
+        record_purchase_error(e)
+        detail = e.detail if e.product_id is None else "ProductId {}: {}".format(e.product_id, e.detail)
+        raise HTTPException(e.status_code, detail=detail)
+    purchased = merge_lines(lines)
+    invalidate_products(purchased)
+    await storage.sync()
+    for product_id, quantity in purchased.items():
+        UNITS_SOLD.inc(str(product_id), amount=quantity)
+    publish_purchase(purchased, stock)
+
+    return {"message": "Cart purchased successfully",
+            "items": [{"product_id": product_id, "quantity_purchased": quantity, "cost": costs[product_id]}
+                      for product_id, quantity in purchased.items()],
+            "total_cost": total_cost,
+            "change": change}
+
+# Reset deposit, of the caller's own account or of anyone's for the ADMIN_USERS
+@vending_router.post("/reset/{username}", response_model=Message)
+async def reset_deposit(username: str, current_user: User = Depends(get_current_user)):
+    if current_user.username != username and current_user.username not in settings.ADMIN_USERS:
+        raise HTTPException(status.HTTP_401_UNAUTHORIZED, detail="Cannot reset other user's deposit")
+    storage = get_storage()
+    if not storage.set_balance(username, 0):
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail="User not found")
-    users_db[username].balance_in_cents = 0
+    await storage.sync()
     return {"message": "Deposit reset successful"}